@@ -1,17 +1,20 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
 
 import pandas as pd
 import numpy as np
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Any
 import time, os
 from datetime import datetime
-import pickle, json
+import pickle
 
-from Webscrapers import scrape_monthly_listeners, scrape_genres_from_bio
+from artist_pages import iter_artist_pages, MONTHLY_LISTENERS_MAX_AGE_HOURS
 import artist_info_helper as aih
 import track_info_helper as tih
+from id_index import get_index
+from budget import spending
+from playlist_discovery import discover_playlists, fetch_all_items, get_market_categories, get_playlists_items, is_spotify_public
+from table_storage import read_table, append_table, write_table, table_exists
+from settings import get_config
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -24,38 +27,37 @@ export SPOTIPY_CLIENT_SECRET='your-spotify-client-secret'
 export SPOTIPY_REDIRECT_URI='your-app-redirect-url'
 '''
 
-with open('config.json') as f:
-    config = json.load(f)
+config = get_config()
 OUTPUT_DIR = config['paths']['editorial_output_dir']
 BIO_GENRES = config['filenames']['bio_genres']
 MISSING_BIO_GENRES = config['filenames']['missing_bio_genres']
 CURRENT_DATE = datetime.now().strftime("%Y-%m-%d")
 DEFAULT_DATAFRAME = "Playlist_names-IDs_{:s}.csv".format(CURRENT_DATE)
 USER_ID = 'spotify'
-TIMEOUT = 10*60
 
-client_credentials_manager = SpotifyClientCredentials()
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+'''All requests made by this module are charged to the 'editorial' stage of the
+daily request budget, which is served ahead of the random-sample crawl.'''
 
+from spotify_client import sp
+
+@spending('editorial')
 def store_available_spotify_playlists() -> None:
     '''Store Spotify public playlists that are directly available via the user_playlists
     endpoint with the USER_ID "spotify". This is limited by market, but is a good starting
     point.'''
 
-    playlists = sp.user_playlists(USER_ID, limit=50)
+    '''All pages, including the last, are fetched concurrently'''
+    playlists = fetch_all_items('user_playlists', None, [{'user': USER_ID}])[0]
 
-    '''Continue fetching until no more results left'''
     playlist_names, playlist_ids, playlist_owners, playlist_public = [], [], [], []
-    while playlists['next']:
-        for playlist in playlists['items']:
-            if playlist['owner']['id'] != USER_ID or not playlist['public']:
-                continue
-            playlist_names.append(playlist['name'])
-            playlist_ids.append(playlist['id'])
-            playlist_owners.append(playlist['owner']['id'])
-            playlist_public.append(playlist['public'])
-        playlists = sp.next(playlists)
-        logger.info("Saved batch of {:d} playlists.".format(len(playlist_names)))
+    for playlist in playlists:
+        if not is_spotify_public(playlist):
+            continue
+        playlist_names.append(playlist['name'])
+        playlist_ids.append(playlist['id'])
+        playlist_owners.append(playlist['owner']['id'])
+        playlist_public.append(playlist['public'])
+    logger.info("Saved {:d} playlists.".format(len(playlist_names)))
 
     playlist_ids, unique_indices = np.unique(playlist_ids, return_index=True)
     logger.info("Total number of unique playlists: {:d}".format(len(playlist_ids)))
@@ -65,38 +67,37 @@ def store_available_spotify_playlists() -> None:
         'playlist_owner': [playlist_owners[i] for i in unique_indices],
         'public': [playlist_public[i] for i in unique_indices]
     })
-    playlist_df.to_csv(OUTPUT_DIR + DEFAULT_DATAFRAME, index=False)
+    write_table(playlist_df, OUTPUT_DIR + DEFAULT_DATAFRAME)
 
 def get_category_ids_for_market(market: str) -> Tuple[List[str], List[str]]:
     '''Get all available categories for a particular market.'''
 
-    categories = sp.categories(country=market, limit=50)
-    category_ids, category_names = [], []
-
-    while categories['categories']['next']:
-        for category in categories['categories']['items']:
-            category_ids.append(category['id'])
-            category_names.append(category['name'])
-        categories = sp.next(categories['categories'])
-        logger.info("Saved batch of {:d} categories.".format(len(category_ids)))
+    categories = get_market_categories([market])[0]
+    logger.info("Saved {:d} categories.".format(len(categories)))
+    return [category['id'] for category in categories], [category['name'] for category in categories]
 
-    return category_ids, category_names
-
-def get_category_playlists_for_market(market: str, category_id: str) -> Tuple[List[str], List[str]]:
+def get_category_playlists_for_market(market: str, category_id: str) -> List[Dict[str, Any]]:
     '''Get all available playlists for a particular category in a particular market.'''
 
-    playlists = sp.category_playlists(category_id=category_id, country=market)
-    playlists_fullinfo = []
-    while playlists['playlists']['next']:
-        for playlist in playlists['playlists']['items']:
-            if playlist['owner']['id'] != USER_ID or not playlist['public']:
-                continue
-            playlists_fullinfo.append(playlist)
-        playlists = sp.next(playlists['playlists'])
-        logger.info("Saved batch of {:d} playlists.".format(len(playlists_fullinfo)))
-
+    playlists = fetch_all_items('category_playlists', 'playlists', [{'category_id': category_id, 'country': market}])[0]
+    playlists_fullinfo = [playlist for playlist in playlists if is_spotify_public(playlist)]
+    logger.info("Saved {:d} playlists.".format(len(playlists_fullinfo)))
     return playlists_fullinfo
 
+def playlists_dataframe(playlists: Dict[str, Dict[str, Any]], with_markets: bool=False) -> pd.DataFrame:
+    '''Table of discovered playlists (see playlist_discovery.discover_playlists),
+    ordered by playlist ID, optionally with the markets and categories of each.'''
+
+    columns = ['playlist_name', 'playlist_id', 'playlist_owner', 'public', 'category_id', 'category_name']
+    records = [playlists[playlist_id] for playlist_id in sorted(playlists)]
+    playlist_df = pd.DataFrame({column: [record[column] for record in records] for column in columns})
+    if with_markets:
+        playlist_df['num_markets'] = [len(record['markets']) for record in records]
+        playlist_df['markets'] = [', '.join(record['markets']) for record in records]
+        playlist_df['category_ids'] = [', '.join(record['category_ids']) for record in records]
+    return playlist_df
+
+@spending('editorial')
 def store_spotify_playlist_selection_for_market(market: str) -> None:
     '''Store Spotify public playlists that are available via browsing categories in
     a particular market. This is also not comprehensive because the results are just a subset
@@ -105,78 +106,64 @@ def store_spotify_playlist_selection_for_market(market: str) -> None:
     for the user_playlists endpoint.'''
 
     logger.info("Entering Market: {:s}".format(market))
-    category_ids, category_names = get_category_ids_for_market(market)
-
-    playlist_names, playlist_ids, playlist_owners, playlist_public = [], [], [], []
-    playlist_category_ids, playlist_category_names = [], []
-    for category_id, category_name in zip(category_ids, category_names):
-        logger.info("Entering Category: {:s}".format(category_name))
-        playlists_fullinfo = get_category_playlists_for_market(market, category_id)
-        for playlist in playlists_fullinfo:
-            if playlist['owner']['id'] != USER_ID or not playlist['public']: # just to be sure
-                continue
-            playlist_names.append(playlist['name'])
-            playlist_ids.append(playlist['id'])
-            playlist_owners.append(playlist['owner']['id'])
-            playlist_public.append(playlist['public'])
-            playlist_category_ids.append(category_id)
-            playlist_category_names.append(category_name)
-
-    playlist_ids, unique_indices = np.unique(playlist_ids, return_index=True)
-    logger.info("Total number of unique playlists: {:d}".format(len(playlist_ids)))
-    playlist_df = pd.DataFrame({
-        'playlist_name': [playlist_names[i] for i in unique_indices],
-        'playlist_id': playlist_ids,
-        'playlist_owner': [playlist_owners[i] for i in unique_indices],
-        'public': [playlist_public[i] for i in unique_indices],
-        'category_id': [playlist_category_ids[i] for i in unique_indices],
-        'category_name': [playlist_category_names[i] for i in unique_indices]
-    })
+    playlist_df = playlists_dataframe(discover_playlists([market]))
+    logger.info("Total number of unique playlists: {:d}".format(len(playlist_df)))
     filename = OUTPUT_DIR + DEFAULT_DATAFRAME.split(".csv")[0] + \
         "_{:s}".format(market) + ".csv"
-    playlist_df.to_csv(filename, index=False)
+    write_table(playlist_df, filename)
     logger.info("Saved playlists for market: {:s} to {:s}.".format(market, filename))
 
+@spending('editorial')
 def find_playlists_across_markets() -> None:
     '''Store Spotify public playlists that are available via browsing categories and
     markets. This is also not comprehensive because the results are just a subset
     of the total and are ordered by popularity and other metrics. However it seems
     to be the only way to browse markets now that the market is not an input parameter
-    for the user_playlists endpoint.'''
+    for the user_playlists endpoint.
 
-    markets = sp.available_markets()
-    for market in markets['markets']:
-        store_spotify_playlist_selection_for_market(market)
-        logger.info("Finished Market: {:s}. Pausing for 30s...".format(market))
-        time.sleep(TIMEOUT)
+    All markets and their categories are crawled concurrently under the shared rate
+    limit (see playlist_discovery.py), and each playlist is stored once, in a single
+    table, with the markets and categories it appears in.'''
 
-def get_artists_last_24hrs(playlist_id: str) -> Tuple[List[str], List[str]]:
-    '''Get the tracks added to a playlist in the last 24 hours and store
-    the IDs of their artists in a temporary pickle.'''
+    markets = sp.available_markets()['markets']
+    playlist_df = playlists_dataframe(discover_playlists(markets), with_markets=True)
+    filename = OUTPUT_DIR + DEFAULT_DATAFRAME.split(".csv")[0] + "_all-markets.csv"
+    write_table(playlist_df, filename)
+    logger.info("Saved {:d} playlists across {:d} markets to {:s}.".format(len(playlist_df), len(markets), filename))
+
+def artists_added_last_24hrs(items: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    '''The IDs of the artists of the playlist items added in the last 24 hours, and
+    the ID of the track each artist was found on.'''
 
-    playlist = sp.playlist(playlist_id)
-    tracks = playlist['tracks']
     artist_ids, track_ids = [], []
-    for track in tracks['items']:
+    now = datetime.now()
+    for track in items:
         added_at = track['added_at']
         added_at = datetime.strptime(added_at, "%Y-%m-%dT%H:%M:%SZ")
-        if (datetime.now() - added_at).days < 1:
+        if (now - added_at).days < 1:
             try:
                 for artist in track['track']['artists']:
                     artist_ids.append(artist['id'])
                     track_ids.append(track['track']['id'])
-            except TypeError or KeyError:
+            except (TypeError, KeyError):
                 logger.info("No artist information available for that track.")
 
     return artist_ids, track_ids
 
+def get_artists_last_24hrs(playlist_id: str) -> Tuple[List[str], List[str]]:
+    '''Get the tracks added to a playlist in the last 24 hours (among all its items,
+    not only the first page) and the IDs of their artists.'''
+    return artists_added_last_24hrs(get_playlists_items([playlist_id])[0])
+
+@spending('editorial')
 def pickle_1000_artists_last_24hrs() -> None:
     '''Store a random selection of 1000 of all artists that have been added to
-    featured playlists in the last 24 hours, in a temporary pickle.'''
+    featured playlists in the last 24 hours, in a temporary pickle. The items of
+    all playlists are fetched concurrently (see playlist_discovery.py).'''
 
-    playlist_df = pd.read_csv(OUTPUT_DIR + DEFAULT_DATAFRAME)
+    playlist_df = read_table(OUTPUT_DIR + DEFAULT_DATAFRAME, columns=['playlist_id', 'playlist_name'])
 
-    artist_ids, track_ids, playlists_found = [], [], []
+    playlists = []
     for playlist_id, playlist_name in zip(playlist_df['playlist_id'], playlist_df['playlist_name']):
         if "This Is" in playlist_name: # these explicitly highlight a popular artist
             continue
@@ -186,8 +173,13 @@ def pickle_1000_artists_last_24hrs() -> None:
             "Official" in playlist_name or "official" in playlist_name
         ): # these are a priori popular songs
             continue
+        playlists.append((playlist_id, playlist_name))
+    playlists_items = get_playlists_items([playlist_id for playlist_id, _ in playlists])
+
+    artist_ids, track_ids, playlists_found = [], [], []
+    for (playlist_id, playlist_name), items in zip(playlists, playlists_items):
         logger.info("Entering playlist: {:s}".format(playlist_name))
-        artists_to_add, tracks_to_add = get_artists_last_24hrs(playlist_id)
+        artists_to_add, tracks_to_add = artists_added_last_24hrs(items)
         artist_ids.extend(artists_to_add)
         track_ids.extend(tracks_to_add)
         playlists_found.extend([playlist_name]*len(artists_to_add))
@@ -218,6 +210,7 @@ def pickle_1000_artists_last_24hrs() -> None:
     with open(OUTPUT_DIR + "tracks_last_24hrs_{:s}.pkl".format(CURRENT_DATE), "wb") as f:
         pickle.dump(dict_artist_tracks, f)
 
+@spending('editorial')
 def scrape_monthly_listeners_for_pickled_artists() -> Dict[str, int]:
     '''Scrape monthly listeners for all artists that have been added to playlists
     in the last 24 hours. This uses the temporary pickle of artist IDs generated
@@ -232,22 +225,23 @@ def scrape_monthly_listeners_for_pickled_artists() -> Dict[str, int]:
 
     artist_ids = artists_dict['ids']
 
-    artist_monthly_listeners = []
-    i = 0
+    '''Pages are fetched concurrently under the scraper's rate limit, so there is no
+    need to pause between batches. Results are still checkpointed every 50 artists,
+    as before as a list of monthly listeners for the first artist IDs in order (None
+    for any of those not scraped yet).'''
+    monthly_listeners_by_id = {}
     logger.info("Monthly Listeners: Total number of artists to scrape: {:d}".format(len(artist_ids)))
-    for artist_id in artist_ids:
-        artist_monthly_listeners.append(scrape_monthly_listeners(artist_id, "temp"))
-        i += 1
-        print(i)
+    artist_pages = iter_artist_pages(artist_ids, max_age_hours=MONTHLY_LISTENERS_MAX_AGE_HOURS)
+    for i, (artist_id, record) in enumerate(artist_pages, start=1):
+        monthly_listeners_by_id[artist_id] = None if record is None else record['monthly_listeners']
         if i % 50 == 0:
-            artist_monthly_listeners_print = [x for x in artist_monthly_listeners if x is not None]
+            artist_monthly_listeners_print = [x for x in monthly_listeners_by_id.values() if x is not None]
             logger.info("Scraped monthly listeners for {:d} artists. Current average is {:f}.".format(i, sum(artist_monthly_listeners_print)/i))
-            logger.info("Pausing for 5 minutes...")
             with open (OUTPUT_DIR + "artists_last_24hrs_monthly_listeners_{:s}_{:d}.pkl".format(CURRENT_DATE, i), "wb") as f:
-                pickle.dump(artist_monthly_listeners, f)
-            time.sleep(300)
+                pickle.dump([monthly_listeners_by_id.get(artist_id) for artist_id in artist_ids[:i]], f)
 
-    artists_dict['monthly_listeners'] = artist_monthly_listeners
+    '''Stored pages stream back first, so line the results up with the artist IDs'''
+    artists_dict['monthly_listeners'] = [monthly_listeners_by_id.get(artist_id) for artist_id in artist_ids]
     # gather up the pickles
     # monthly_listeners_dict = []
     # for i in range(50, len(artist_ids)+1, 50):
@@ -256,6 +250,7 @@ def scrape_monthly_listeners_for_pickled_artists() -> Dict[str, int]:
     # with open(OUTPUT_DIR + "artists_last_24hrs_monthly_listeners_{:s}.pkl".format(CURRENT_DATE), "wb") as f:
     #     pickle.dump(artists_dict, f)
 
+@spending('editorial')
 def get_artist_info_for_pickled_artists() -> Dict[str, Dict[str, str]]:
     '''Get artist information for all artists that have been added to playlists
     in the last 24 hours. This uses the temporary pickle of artist IDs generated
@@ -279,6 +274,7 @@ def get_artist_info_for_pickled_artists() -> Dict[str, Dict[str, str]]:
     with open(OUTPUT_DIR + "artists_last_24hrs_info_dict_{:s}.pkl".format(CURRENT_DATE), "wb") as f:
         pickle.dump(artist_info_dict, f)
 
+@spending('editorial')
 def get_save_track_info_for_pickled_tracks(date: str=None) -> None:
     '''Retrieve and save the track information for all tracks that have been added
     to playlists in the last 24 hours. This uses the temporary pickle of track IDs
@@ -293,7 +289,7 @@ def get_save_track_info_for_pickled_tracks(date: str=None) -> None:
         artist_ids = dict_artist_tracks['artist_ids']
 
     '''First check if track info already processed and in a csv file, if so, return.'''
-    if os.path.exists(OUTPUT_DIR + "track_info_last_24hrs_{:s}.csv".format(date)):
+    if table_exists(OUTPUT_DIR + "track_info_last_24hrs_{:s}.csv".format(date)):
         logger.info("Track info already processed for date {:s}.".format(date))
         return
 
@@ -308,9 +304,10 @@ def get_save_track_info_for_pickled_tracks(date: str=None) -> None:
     track_info_dict = tih.TrackInfoDict(tracks_info, tracks_audio_info)
 
     '''Append to the Spotify_track_info.csv file as a new row. Note that this must be a new file.'''
-    track_info_df = pd.DataFrame({key: track_info_dict[key] for key in track_info_dict.keys})
-    track_info_df.to_csv(OUTPUT_DIR + "track_info_last_24hrs_{:s}.csv".format(date), index=False)
+    track_info_df = track_info_dict.to_pandas()
+    write_table(track_info_df, OUTPUT_DIR + "track_info_last_24hrs_{:s}.csv".format(date))
 
+@spending('editorial')
 def get_save_track_info_for_trackids(trackid_filename: str, num_to_scrape: int=None) -> None:
     '''Retrieve and save the track information for the master list of unique tracks. Assumes
     that the track IDs are unique in this list.'''
@@ -319,22 +316,15 @@ def get_save_track_info_for_trackids(trackid_filename: str, num_to_scrape: int=N
         logger.error("No filename provided.")
 
     '''List of unique track IDs'''
-    track_ids_df = pd.read_csv(OUTPUT_DIR + trackid_filename)
-
-    '''Track info file, load if it exists, otherwise create a new one'''
-    stored_ids = []
-    if os.path.exists(OUTPUT_DIR + "featured_Spotify_track_info.csv"):
-        track_info_df = pd.read_csv(OUTPUT_DIR + "featured_Spotify_track_info.csv")
-        stored_ids.extend(track_info_df['ids'])
-    else:
-        track_info_df = pd.DataFrame()
+    track_ids_df = read_table(OUTPUT_DIR + trackid_filename)
+
+    '''Index of the track IDs already in the track info file'''
+    stored_ids = get_index(OUTPUT_DIR + "featured_Spotify_track_info.csv")
     logger.info("Total number of unique track IDs found: {:d}".format(len(track_ids_df)))
-    logger.info("Total number of unique track IDs already assigned info in the csv: {:d}".format(len(track_info_df)))
-    
+    logger.info("Total number of unique track IDs already assigned info in the csv: {:d}".format(len(stored_ids)))
+
     '''Get the IDs that have not yet been computed'''
-    print(len(track_ids_df['feat_track_ids']), len(stored_ids))
-    track_ids = [track_id for track_id in track_ids_df['feat_track_ids'] if track_id not in stored_ids]
-    print(len(track_ids))
+    track_ids = stored_ids.filter_new(track_ids_df['feat_track_ids'].tolist())
     if num_to_scrape is not None:
         track_ids = track_ids[:num_to_scrape]
     logger.info("Computing information for {:d} tracks.".format(len(track_ids)))
@@ -345,20 +335,17 @@ def get_save_track_info_for_trackids(trackid_filename: str, num_to_scrape: int=N
     track_info_dict = tih.TrackInfoDict(tracks_info, tracks_audio_info)
 
     '''Add the dates, counts and playlists_featured from the track_ids_df (artists updated separately in get_tracks_info)'''
-    track_info_dict['dates'] = [
-        track_ids_df[track_ids_df['feat_track_ids'] == track_id]['dates'].values[0] for track_id in track_ids]
-    track_info_dict['count'] = [
-        track_ids_df[track_ids_df['feat_track_ids'] == track_id]['count'].values[0] for track_id in track_ids]
-    track_info_dict['playlists_found'] = [
-        track_ids_df[track_ids_df['feat_track_ids'] == track_id]['playlists_found'].values[0] for track_id in track_ids]
-
-    '''Append to the featured_Spotify_track_info.csv file as new rows.'''
-    track_info_df = pd.concat(
-        [track_info_df, pd.DataFrame({key: track_info_dict[key] for key in
-        track_info_dict.keys + ['count', 'dates', 'playlists_found']})], ignore_index=True
-    )
-    track_info_df.to_csv(OUTPUT_DIR + "featured_Spotify_track_info.csv", index=False)
+    track_ids_lookup_df = track_ids_df.drop_duplicates('feat_track_ids').set_index('feat_track_ids')
+    track_info_dict['dates'] = track_ids_lookup_df.loc[track_ids, 'dates'].tolist()
+    track_info_dict['count'] = track_ids_lookup_df.loc[track_ids, 'count'].tolist()
+    track_info_dict['playlists_found'] = track_ids_lookup_df.loc[track_ids, 'playlists_found'].tolist()
+
+    '''Append to the featured_Spotify_track_info.csv file as new rows, rather than
+    rewriting the whole file, so that the ID index only has to read the new rows.'''
+    track_info_df = track_info_dict.to_pandas(track_info_dict.keys + ['count', 'dates', 'playlists_found'])
+    append_table(track_info_df, OUTPUT_DIR + "featured_Spotify_track_info.csv")
 
+@spending('editorial')
 def gather_artist_info_last_24hrs() -> None:
     '''Gather artist information from all temporary pickles, consolidate in a csv
     file and delete the temporary pickles.'''
@@ -376,7 +363,7 @@ def gather_artist_info_last_24hrs() -> None:
             total_info_dict[key] = artist_info_dict[key].copy()
 
     total_info_df = pd.DataFrame(total_info_dict)
-    total_info_df.to_csv(OUTPUT_DIR + "artists_last_24hrs_{:s}_info.csv".format(CURRENT_DATE), index=False)
+    write_table(total_info_df, OUTPUT_DIR + "artists_last_24hrs_{:s}_info.csv".format(CURRENT_DATE))
     logger.info(
         "Saved all artist information to csv file: {:s}".format(
             OUTPUT_DIR + "artists_last_24hrs_{:s}_info.csv".format(CURRENT_DATE)
@@ -403,68 +390,69 @@ def delete_pickles() -> None:
         logger.info("Artist IDs pickle not found: {:s}".format(OUTPUT_DIR + "artists_last_24hrs_{:s}.pkl".format(CURRENT_DATE)))
     logger.info("Deleted all temporary pickles.")
 
+@spending('editorial')
 def generate_artist_genres_from_bio(num_to_scrape: int=None) -> None:
     genres_to_search = config["genres"]
 
-    artist_info_df = pd.read_csv(OUTPUT_DIR + "featured_Spotify_artist_info.csv", usecols=["ids", "names", "genres"])
+    artist_info_df = read_table(OUTPUT_DIR + "featured_Spotify_artist_info.csv", columns=["ids", "names", "genres"])
     artist_ids = artist_info_df[artist_info_df["genres"].isnull()]["ids"].tolist()
     artist_ids = list(set(artist_ids))
     logger.info(f"Number of unique artists with no genres: {len(artist_ids)}")
 
     '''take only those that don't appear in BIO_GENRES or MISSING_BIO_GENRES files'''
-    if os.path.exists(OUTPUT_DIR + BIO_GENRES):
-        bio_genres_df = pd.read_csv(OUTPUT_DIR + BIO_GENRES, usecols=["ids"])
-        bio_genres_ids = bio_genres_df["ids"].tolist()
-        artist_ids = [x for x in artist_ids if x not in bio_genres_ids]
-    if os.path.exists(OUTPUT_DIR + MISSING_BIO_GENRES):
-        missing_bio_genres_df = pd.read_csv(OUTPUT_DIR + MISSING_BIO_GENRES, usecols=["ids"])
-        missing_bio_genres_ids = missing_bio_genres_df["ids"].tolist()
-        artist_ids = [x for x in artist_ids if x not in missing_bio_genres_ids]
+    artist_ids = get_index(OUTPUT_DIR + BIO_GENRES).filter_new(artist_ids)
+    artist_ids = get_index(OUTPUT_DIR + MISSING_BIO_GENRES).filter_new(artist_ids)
     logger.info(f"Total number of artists to scrape: {len(artist_ids)}")
 
     if num_to_scrape is not None:
         artist_ids = artist_ids[:num_to_scrape]
     logger.info(f"Scraping number of artists: {len(artist_ids)}")
 
-    '''Divide artist IDs into batches of 100'''
-    artist_ids_batches = [artist_ids[i:i + 100] for i in range(0, len(artist_ids), 100)]
-    for i, artist_ids_batch in enumerate(artist_ids_batches):
-        artist_ids_genres, artist_genres, artist_names, missing_ids_genres = [], [], [], []
-        for j, artist_id in enumerate(artist_ids_batch):
-            artist_name = artist_info_df[artist_info_df["ids"] == artist_id]["names"].values[0]
-            genres = scrape_genres_from_bio(artist_id, artist_name, genres_to_search)
-            if genres:
-                genres = ','.join(genres)
+    '''Artist pages already fetched (e.g. by the monthly-listener stage) are read from
+    the artist page store, the rest are fetched concurrently. Results are appended
+    in batches of 100.'''
+    artist_names_by_id = dict(zip(artist_info_df["ids"], artist_info_df["names"]))
+    artist_ids_genres, artist_genres, artist_names, missing_ids_genres = [], [], [], []
+
+    def append_batch(j: int) -> None:
+        '''Append the genres (and missing genres) found since the last batch.'''
+        if len(artist_ids_genres) + len(missing_ids_genres) == 0:
+            return
+        artist_info_genres_df = pd.DataFrame({"ids": artist_ids_genres, "names": artist_names, "genres": artist_genres})
+        append_table(artist_info_genres_df, OUTPUT_DIR + BIO_GENRES)
+        logger.info(f'{j}: Appended {len(artist_info_genres_df)} artist genres to: {OUTPUT_DIR + BIO_GENRES}')
+
+        missing_names_df = pd.DataFrame({"ids": missing_ids_genres})
+        append_table(missing_names_df, OUTPUT_DIR + MISSING_BIO_GENRES)
+        logger.info(f'{j}: Appended {len(missing_names_df)} missing artist genres to: {OUTPUT_DIR + MISSING_BIO_GENRES}')
+        for results in [artist_ids_genres, artist_genres, artist_names, missing_ids_genres]:
+            results.clear()
+
+    '''The last, partial batch is appended even if the scrape stops early (e.g. with
+    BudgetExhausted once the day's artist page budget is used up)'''
+    j = -1
+    try:
+        for j, (artist_id, record) in enumerate(iter_artist_pages(artist_ids, genres_to_find=genres_to_search)):
+            artist_name = artist_names_by_id[artist_id]
+            if record is not None and record['genres']:
+                genres = ','.join(record['genres'])
                 artist_ids_genres.append(artist_id)
                 artist_genres.append(genres)
                 artist_names.append(artist_name)
-                logger.info(f"{i*100 + j}: Genres {genres} found for: {artist_name}, {artist_id}.")
+                logger.info(f"{j}: Genres {genres} found for: {artist_name}, {artist_id}.")
             else:
                 missing_ids_genres.append(artist_id)
-                logger.info(f"{i*100 + j}: Genres not found for artist id: {artist_id} and artist name: {artist_name}, {artist_id}.")
-    
-        artist_info_genres_df = pd.DataFrame({"ids": artist_ids_genres, "names": artist_names, "genres": artist_genres})
-        if os.path.exists(OUTPUT_DIR + BIO_GENRES):
-            artist_info_genres_df.to_csv(OUTPUT_DIR + BIO_GENRES, mode='a', header=False, index=False)
-            logger.info(f'{i*100 + j}: Appended {len(artist_info_genres_df)} artist genres to existing file: {OUTPUT_DIR + BIO_GENRES}')
-        else:
-            artist_info_genres_df.to_csv(OUTPUT_DIR + BIO_GENRES, index=False)
-            logger.info(f'Saved {len(artist_info_genres_df)} artist genres to new file: {OUTPUT_DIR + BIO_GENRES}')
+                logger.info(f"{j}: Genres not found for artist id: {artist_id} and artist name: {artist_name}, {artist_id}.")
 
-        missing_names_df = pd.DataFrame({"ids": missing_ids_genres})
-        if os.path.exists(OUTPUT_DIR + MISSING_BIO_GENRES):
-            missing_names_df.to_csv(OUTPUT_DIR + MISSING_BIO_GENRES, mode='a', header=False, index=False)
-            logger.info(f'{i*100 + j}: Appended {len(missing_names_df)} missing artist genres to existing file: {OUTPUT_DIR + MISSING_BIO_GENRES}')
-        else:
-            missing_names_df.to_csv(OUTPUT_DIR + MISSING_BIO_GENRES, index=False)
-            logger.info(f'{i*100 + j}: Saved {len(missing_names_df)} missing artist genres to new file: {OUTPUT_DIR + MISSING_BIO_GENRES}')
-        logger.info(f"{i*100 + j}: Sleeping for 10 seconds.")
-        time.sleep(10)
+            if (j + 1) % 100 == 0:
+                append_batch(j)
+    finally:
+        append_batch(j)
 
 def clean_save_artist_info(req_features: List[str]) -> None:
     '''Clean the Spotify_artist_info_Mnth-Lstnrs.csv file, and save it to a new csv file.'''
 
-    artist_info_df = pd.read_csv(OUTPUT_DIR + "featured_Spotify_artist_info.csv")
+    artist_info_df = read_table(OUTPUT_DIR + "featured_Spotify_artist_info.csv")
 
     for_logging = artist_info_df.dropna(subset=[column for column in artist_info_df.columns if column in req_features])
     for_logging = for_logging.drop(for_logging[(for_logging[req_features] == -1).any(axis=1)].index)
@@ -472,7 +460,7 @@ def clean_save_artist_info(req_features: List[str]) -> None:
 
     '''First add the genres scraped from the Spotify bios'''
     if 'genres' in req_features:
-        bio_genres_df = pd.read_csv(OUTPUT_DIR + BIO_GENRES)
+        bio_genres_df = read_table(OUTPUT_DIR + BIO_GENRES, columns=['ids', 'genres'])
         artist_info_df = artist_info_df.merge(bio_genres_df[['ids', 'genres']], on='ids', how='left', suffixes=('', '_new'))
         artist_info_df['genres'] = artist_info_df['genres'].combine_first(artist_info_df['genres_new'])
         artist_info_df = artist_info_df.drop(columns=['genres_new'])
@@ -483,7 +471,7 @@ def clean_save_artist_info(req_features: List[str]) -> None:
     logger.info("Number of artists after cleaning, with bio-scraping: {:d}".format(len(artist_info_df)))
 
     '''Save to a new csv file with a date-stamp for cleaning time'''
-    artist_info_df.to_csv(OUTPUT_DIR + "CLEANED_featured_Spotify_artist_info.csv", index=False)
+    write_table(artist_info_df, OUTPUT_DIR + "CLEANED_featured_Spotify_artist_info.csv")
     logger.info("Saved cleaned artist info to {:s}.".format("CLEANED_featured_Spotify_artist_info.csv"))
 
 if __name__ == "__main__":
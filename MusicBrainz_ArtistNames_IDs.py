@@ -1,11 +1,14 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
 from spotipy.exceptions import SpotifyException
 
 import random
 import numpy as np
 import pandas as pd
 import artist_info_helper as aih
+from table_storage import append_table
+from stage_ledger import get_ledger
+from name_universe import load_clean_names
+from budget import get_planner, BudgetExhausted
+from settings import get_config
 
 from typing import List, Dict, Tuple
 import logging
@@ -14,13 +17,9 @@ logger = logging.getLogger(__name__)
 import sys, os, glob, re
 regex = re.compile(r"\d+")
 
-import json, pickle, time
+import pickle, time
 from datetime import datetime
 
-import signal
-def handler(signum, frame) -> None:
-    raise TimeoutError("Operation timed out")
-
 '''
 Remember environment variables:
 export SPOTIPY_CLIENT_ID='your-spotify-client-id'
@@ -28,70 +27,41 @@ export SPOTIPY_CLIENT_SECRET='your-spotify-client-secret'
 export SPOTIPY_REDIRECT_URI='your-app-redirect-url'
 '''
 
-client_credentials_manager = SpotifyClientCredentials()
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+from spotify_client import sp
 
-with open('config.json') as f:
-    config = json.load(f)
+config = get_config()
 OUTPUT_DIR = config['paths']['output_dir']
 ARTIST_NAMES_FILE = config['filenames']['artist_names']
 ARTIST_IDS_FILE = config['filenames']['artist_ids']
-MISSING_NAMES_FILE = config['filenames']['missing_names']
-DEEP_MISSING_NAMES_FILE = config['filenames']['deep_missing_names']
 CURRENT_YEAR = datetime.now().year
-TIMEOUT = 10*60
+DEEP_SEARCH_REQUESTS = 20 # up to 1,000 results, 50 per page
 
 def load_clean_artist_names() -> List[str]:
-    '''Load data, clean bad and empty strings from the list of artist names, convert to lowercase'''
-
-    artist_names = pd.read_csv(OUTPUT_DIR + ARTIST_NAMES_FILE)['artist_name'].tolist()
-
-    seen = set()
-    artist_names_unique = [name for name in artist_names if not (name in seen or seen.add(name))]
-    artist_names_good = [name for name in artist_names_unique if name is not None and type(name) == str]
-    artist_names_nonzero = [name for name in artist_names_good if len(name) > 0]
-    artist_names_nobrack = [name for name in artist_names_nonzero if '[' not in name and ']' not in name]
-    artist_names = [str(name.lower()) for name in artist_names_nobrack]
-
-    return artist_names
-
-def get_names_already_in_file(artist_names: List[str], filename: str) -> List[str]:
-    '''Retrieve artist names already stored in the file, to avoid duplicates'''
-
-    saved_artists = []
-    if os.path.exists(OUTPUT_DIR + filename):
-        for chunk in pd.read_csv(OUTPUT_DIR + filename, usecols=['names'], chunksize=1000):
-            chunk_artists = [name.lower() for name in chunk['names']]
-            artist_names = [name.lower() for name in artist_names]
-            saved_artists.extend(list(set(artist_names) & set(chunk_artists)))            
-            if len(saved_artists) == len(artist_names):
-                break
-        return saved_artists
-    else:
-        return saved_artists
-
-def only_new_names(artist_names: List[str], rand_num_artist_names: str) -> List[str]:
-    '''Check if artist names in list already have assigned info in the local datastore,
-    or to the list of missing names, and return those that do not.'''
-
-    saved_artists = []
-    if os.path.exists(OUTPUT_DIR + ARTIST_IDS_FILE):
-        saved_artists.extend(get_names_already_in_file(artist_names, ARTIST_IDS_FILE))
-    if os.path.exists(OUTPUT_DIR + MISSING_NAMES_FILE):
-        missing_artists = get_names_already_in_file(artist_names, MISSING_NAMES_FILE)
-    if os.path.exists(OUTPUT_DIR + DEEP_MISSING_NAMES_FILE):
-        deep_missing_artists = get_names_already_in_file(artist_names, DEEP_MISSING_NAMES_FILE)
-    saved_artists += missing_artists + deep_missing_artists
-
-    if len(saved_artists) > 0:
-        logger.info(f'Already have {len(saved_artists)} of MusicBrainz artists.')
-
-    new_artist_names = []
-    while len(new_artist_names) < rand_num_artist_names:
-        name = artist_names.pop()
-        if name not in saved_artists:
-            new_artist_names.append(name)
-        
+    '''Load data, clean bad and empty strings from the list of artist names, convert to
+    lowercase. The cleaning is done once per version of the names table, and the result
+    is kept as a binary artifact that loads quickly (see name_universe.py).'''
+
+    return load_clean_names(OUTPUT_DIR + ARTIST_NAMES_FILE, column='artist_name')
+
+def only_new_names(artist_names: List[str], rand_num_artist_names: int) -> List[str]:
+    '''Take names from the end of the list until rand_num_artist_names are found that
+    are not yet in the ledger's search stage (found, missing or pending). Only these
+    candidates are looked up in the ledger, in chunks, so the cost scales with the
+    number of names taken rather than with everything processed so far.'''
+
+    ledger = get_ledger()
+    new_artist_names, num_known = [], 0
+    while len(new_artist_names) < rand_num_artist_names and len(artist_names) > 0:
+        candidates = artist_names[-1000:][::-1]
+        del artist_names[-1000:]
+        known = ledger.known('search', candidates)
+        num_known += len(known)
+        new_artist_names.extend([name for name in candidates if name not in known])
+    artist_names.extend(new_artist_names[rand_num_artist_names:][::-1]) # put back the surplus
+    new_artist_names = new_artist_names[:rand_num_artist_names]
+
+    if num_known > 0:
+        logger.info(f'Already have {num_known} of MusicBrainz artists.')
     logger.info(f'Found {len(new_artist_names)} new artists names to save.')
     return new_artist_names
 
@@ -104,67 +74,68 @@ def sample_artist_names(artist_names: List[str], random_seed: int, rand_num_arti
 
     return only_new_names(artist_names_sample, rand_num_artist_names)
 
-def retrieve_artist_ids(artist_names: List[str]) -> Tuple[List[str], List[str]]:
-    '''Assign Spotify IDs to the artist names in the list. This includes a time-out
-    condition in case we hit the daily rate limit.'''
-
-    artist_ids, missing_names = [], []
-    artist_names_batch = [artist_names[i:i + 100] for i in range(0, len(artist_names), 100)]
-    for artist_names in artist_names_batch:
-        try:
-            signal.signal(signal.SIGALRM, handler)
-            signal.alarm(TIMEOUT)
-            for artist_name in artist_names:
-                spot_id = aih.get_artist_spotify_id(artist_name)
-                if spot_id is not None:
-                    artist_ids.append(spot_id)
-                else:
-                    missing_names.append(artist_name)
-            logger.info(f'Fetched {len(artist_ids)} artist ids from Spotify.')
-            signal.alarm(0)
-            if artist_names != artist_names_batch[-1]:
-                logger.info(f'Waiting 30 seconds before next batch.')
-                time.sleep(30)
-        except TimeoutError as e:
-            logger.critical(f"Operation timed out: {e}")
-            sys.exit(1)
-
-    return artist_ids, missing_names
+def retrieve_artist_ids(artist_names: List[str]) -> Tuple[List[str], List[str], List[str]]:
+    '''Assign Spotify IDs to the artist names in the list, searching for them
+    concurrently (see aih.get_artist_spotify_ids). Returns the names found, their IDs,
+    and the names not found. Requests are paced by the daily request budget (see
+    budget.py); if it runs out, only the names searched until then are returned.'''
+
+    found_names, artist_ids, missing_names = [], [], []
+    try:
+        for artist_name, spot_id in aih.get_artist_spotify_ids(artist_names):
+            if spot_id is not None:
+                found_names.append(artist_name)
+                artist_ids.append(spot_id)
+            else:
+                missing_names.append(artist_name)
+    except BudgetExhausted as e: # keep the results so far
+        logger.info(f'{e} Stopped after {len(found_names) + len(missing_names)} of {len(artist_names)} artist names.')
+    logger.info(f'Fetched {len(artist_ids)} artist ids from Spotify.')
+
+    return found_names, artist_ids, missing_names
 
 def save_artist_ids(artist_names: List[str]) -> None:
-    '''Save the artist names, IDs and missing names to a CSV file'''
-
-    artist_ids, missing_names = retrieve_artist_ids(artist_names)
-    artist_names = [name for name in artist_names if name not in missing_names]
-
-    artist_ids_df = pd.DataFrame({'names': artist_names, 'ids': artist_ids})
-    if not os.path.exists(OUTPUT_DIR + ARTIST_IDS_FILE):
-        artist_ids_df.to_csv(OUTPUT_DIR + ARTIST_IDS_FILE, index=False)
-        logger.info(f'Saved {len(artist_ids_df)} artist IDs to new file: {OUTPUT_DIR + ARTIST_IDS_FILE}')
-    else:
-        artist_ids_df.to_csv(OUTPUT_DIR + ARTIST_IDS_FILE, mode='a', header=False, index=False)
-        logger.info(f'Appended {len(artist_ids_df)} artist IDs to existing file: {OUTPUT_DIR + ARTIST_IDS_FILE}')
-
-    missing_names_df = pd.DataFrame({'missing_names': missing_names})
-    if not os.path.exists(OUTPUT_DIR + MISSING_NAMES_FILE):
-        missing_names_df.to_csv(OUTPUT_DIR + MISSING_NAMES_FILE, index=False)
-        logger.info(f'Saved {len(missing_names_df)} missing artist names to new file: {OUTPUT_DIR + MISSING_NAMES_FILE}')
-    else:
-        missing_names_df.to_csv(OUTPUT_DIR + MISSING_NAMES_FILE, mode='a', header=False, index=False)
-        logger.info(f'Appended {len(missing_names_df)} missing artist names to existing file: {OUTPUT_DIR + MISSING_NAMES_FILE}')
-    
+    '''Search for the IDs of a list of claimed artist names, in batches of 100. After
+    each batch, the found IDs are appended to the artist IDs table, and all results are
+    committed to the ledger in one transaction. Missing names are queued for the deep
+    search stage. A batch is only started if today's search budget can finish it; the
+    names that do not fit, or that were not searched because the budget ran out
+    during the batch, are released back to pending for the next run.'''
+
+    ledger, planner = get_ledger(), get_planner()
+    for i in range(0, len(artist_names), 100):
+        artist_names_batch = artist_names[i:i + 100]
+        num_affordable = planner.affordable('search', len(artist_names_batch))
+        if num_affordable < len(artist_names_batch):
+            ledger.release('search', artist_names[i + num_affordable:])
+            logger.info(f'Released {len(artist_names) - i - num_affordable} artist names for a later run.')
+            artist_names_batch = artist_names_batch[:num_affordable]
+        if len(artist_names_batch) == 0:
+            break
+        found_names, artist_ids, missing_names = retrieve_artist_ids(artist_names_batch)
+
+        artist_ids_df = pd.DataFrame({'names': found_names, 'ids': artist_ids})
+        append_table(artist_ids_df, OUTPUT_DIR + ARTIST_IDS_FILE)
+        logger.info(f'Appended {len(artist_ids_df)} artist IDs to: {OUTPUT_DIR + ARTIST_IDS_FILE}')
+
+        ledger.commit('search', dict(zip(found_names, artist_ids)), missing_names)
+        ledger.add('deep_search', missing_names)
+        logger.info(f'Queued {len(missing_names)} missing artist names for the deep search.')
+
+        num_searched = len(found_names) + len(missing_names)
+        if num_searched < len(artist_names_batch): # budget spent by another process in the meantime
+            ledger.release('search', artist_names[i + num_searched:])
+            logger.info(f'Released {len(artist_names) - i - num_searched} artist names for a later run.')
+            break
+        if len(artist_names_batch) < 100:
+            break
+
 def extend_sample_MusicBrainz_artist_ids(num_artist_names: int=1000, random_seed: int=42) -> None:
-    '''Check total number of rows in the existing IDs file and missing names file combined'''
-    total_names_stored = 0
-    if os.path.exists(OUTPUT_DIR + ARTIST_IDS_FILE):
-        artist_ids_df = pd.read_csv(OUTPUT_DIR + ARTIST_IDS_FILE)
-        total_names_stored = len(artist_ids_df)
-    if os.path.exists(OUTPUT_DIR + MISSING_NAMES_FILE):
-        missing_names_df = pd.read_csv(OUTPUT_DIR + MISSING_NAMES_FILE)
-        total_names_stored += len(missing_names_df)
-    if os.path.exists(OUTPUT_DIR + DEEP_MISSING_NAMES_FILE):
-        deep_missing_names_df = pd.read_csv(OUTPUT_DIR + DEEP_MISSING_NAMES_FILE)
-        total_names_stored += len(deep_missing_names_df)
+    '''Check total number of names already searched, and any left pending by an
+    interrupted run, which are searched first.'''
+    ledger = get_ledger()
+    num_pending = ledger.count('search', 'pending')
+    logger.info(f"Names searched so far: {ledger.count('search')}, of which {num_pending} are pending.")
 
     '''Run the ID search on N new artists in batches. Stored names will in excluded
     from the sample, so if we keep the seed fixed, we need to sample N more artists
@@ -172,73 +143,65 @@ def extend_sample_MusicBrainz_artist_ids(num_artist_names: int=1000, random_seed
     the order, so that intermediate samples can be analyzed.'''
     start_time = time.time()
 
-    artist_names = load_clean_artist_names()
-    new_artist_names = sample_artist_names(
-        artist_names=artist_names,
-        random_seed=random_seed,
-        rand_num_artist_names=num_artist_names
-    )
-    save_artist_ids(new_artist_names)
+    if num_pending < num_artist_names:
+        artist_names = load_clean_artist_names()
+        new_artist_names = sample_artist_names(
+            artist_names=artist_names,
+            random_seed=random_seed,
+            rand_num_artist_names=num_artist_names - num_pending
+        )
+        ledger.add('search', new_artist_names)
+    save_artist_ids(ledger.claim('search', num_artist_names))
 
     print(f"Total time to load and save data: {time.time() - start_time}.")
 
 def save_deepscraped_missing_ids(num_to_scrape=1000) -> int:
-    '''Check through missing_names.csv and try again to get the IDs for these artists,
-    using the maximum search limit of 1,000. If the ID still isn't found, shift to a new
-    file deep-missing_names.csv. If found, add to the artist_ids.csv file.'''
+    '''Claim names pending in the ledger's deep search stage and try again to get the
+    IDs for these artists, using the maximum search limit of 1,000. The names are searched
+    together, with their result pages fetched concurrently (see
+    aih.get_artist_spotify_ids_deepscrape). If found, add to the artist_ids.csv file.
+    The results are committed to the ledger in one transaction.'''
 
-    missing_names_df = pd.read_csv(OUTPUT_DIR + MISSING_NAMES_FILE)
-    missing_names = missing_names_df['names'].tolist()
-    if num_to_scrape is not None:
-        missing_names = missing_names[:num_to_scrape]
+    ledger = get_ledger()
+    num_to_scrape = get_planner().affordable('search', num_to_scrape, DEEP_SEARCH_REQUESTS)
+    missing_names = ledger.claim('deep_search', num_to_scrape)
 
     deep_found_ids, deep_found_names, deep_missing_names = [], [], []
-    for missing_name in missing_names:
-        spot_id = aih.get_artist_spotify_id_deepscrape(missing_name)
-        if spot_id is not None:
-            deep_found_ids.append(spot_id)
-            deep_found_names.append(missing_name)
-        else:
-            deep_missing_names.append(missing_name)
+    try:
+        for missing_name, spot_id in aih.get_artist_spotify_ids_deepscrape(missing_names):
+            if spot_id is not None:
+                deep_found_ids.append(spot_id)
+                deep_found_names.append(missing_name)
+            else:
+                deep_missing_names.append(missing_name)
+    except BudgetExhausted as e: # keep the results so far
+        num_searched = len(deep_found_names) + len(deep_missing_names)
+        ledger.release('deep_search', missing_names[num_searched:])
+        logger.info(f'{e} Released {len(missing_names) - num_searched} artist names for a later run.')
 
     '''Append the deep-found IDs to the artist_ids.csv file'''
     if len(deep_found_ids) > 0:
         deep_found_ids_df = pd.DataFrame({'names': deep_found_names, 'ids': deep_found_ids})
-        if not os.path.exists(OUTPUT_DIR + ARTIST_IDS_FILE):
-            deep_found_ids_df.to_csv(OUTPUT_DIR + ARTIST_IDS_FILE, index=False)
-            logger.info(f'Saved {len(deep_found_ids_df)} deep-scraped artist IDs to new file: {OUTPUT_DIR + ARTIST_IDS_FILE}')
-        else:
-            deep_found_ids_df.to_csv(OUTPUT_DIR + ARTIST_IDS_FILE, mode='a', header=False, index=False)
-            logger.info(f'Appended {len(deep_found_ids_df)} deep-scraped artist IDs to existing file: {OUTPUT_DIR + ARTIST_IDS_FILE}')
-
-    '''Save the deep-missing names to a new file'''
-    deep_missing_names_df = pd.DataFrame({'names': deep_missing_names})
-    if not os.path.exists(OUTPUT_DIR + 'deep_missing_names.csv'):
-        deep_missing_names_df.to_csv(OUTPUT_DIR + 'deep_missing_names.csv', index=False)
-        logger.info(f'Saved {len(deep_missing_names_df)} deep-missing artist names to new file: {OUTPUT_DIR + "deep_missing_names.csv"}')
-    else:
-        deep_missing_names_df.to_csv(OUTPUT_DIR + 'deep_missing_names.csv', mode='a', header=False, index=False)
-        logger.info(f'Appended {len(deep_missing_names_df)} deep-missing artist names to existing file: {OUTPUT_DIR + "deep_missing_names.csv"}')
-    
-    '''Remove the scraped names from the missing names file'''
-    missing_names_df = missing_names_df[~missing_names_df['names'].isin(deep_missing_names)]
-    deep_found_names_df = pd.DataFrame({'names': deep_found_names})
-    missing_names_df = missing_names_df[~missing_names_df['names'].isin(deep_found_names)]
-    missing_names_df.to_csv(OUTPUT_DIR + MISSING_NAMES_FILE, index=False)
-    logger.info(f'Removed {len(deep_missing_names) + len(deep_found_names)} deep-scraped artist names from missing names file: {OUTPUT_DIR + MISSING_NAMES_FILE}')
+        append_table(deep_found_ids_df, OUTPUT_DIR + ARTIST_IDS_FILE)
+        logger.info(f'Appended {len(deep_found_ids_df)} deep-scraped artist IDs to: {OUTPUT_DIR + ARTIST_IDS_FILE}')
+
+    '''Record the deep-found and deep-missing names in the ledger'''
+    ledger.commit('deep_search', dict(zip(deep_found_names, deep_found_ids)), deep_missing_names)
+    logger.info(f'Committed {len(deep_found_names)} found and {len(deep_missing_names)} deep-missing artist names to the ledger.')
 
     return len(deep_found_ids) + len(deep_missing_names)
 
 def extend_deepscraped_missing_ids() -> None:
+    '''Deep search in batches of 100 names, paced by the daily request budget, until
+    no names are pending or the budget is used up.'''
     for i in range(100):
         no_returned = save_deepscraped_missing_ids(num_to_scrape=100)
         if no_returned == 0:
-            logger.info(f'No more deep-scraped IDs found. Exiting.')
+            logger.info(f'No more names to deep-scrape today. Exiting.')
             break
-        logger.info(f'Waiting 30 seconds before next batch.')
-        time.sleep(30)
 
 if __name__ == "__main__":
     '''Spotify seems to have an (undisclosed) daily limit on the number of requests that
-    can be made. Keep this in mind.'''
+    can be made. The request budget (budget.py, config.json["request_budget"]) keeps
+    all stages under it.'''
     pass
@@ -1,16 +1,19 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
 import pandas as pd
 import numpy as np
 
 from typing import List, Dict, Tuple
 import time, os
 from datetime import datetime
-import pickle, json
+import pickle
 
-from Webscrapers import scrape_monthly_listeners, scrape_genres_from_bio
+from artist_pages import iter_artist_pages, MONTHLY_LISTENERS_MAX_AGE_HOURS
 import artist_info_helper as aih
 import track_info_helper as tih
+from discography import get_representative_tracks
+from id_index import get_index
+from budget import get_planner
+from table_storage import read_table, append_table, write_table
+from settings import get_config
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -23,11 +26,9 @@ export SPOTIPY_CLIENT_SECRET='your-spotify-client-secret'
 export SPOTIPY_REDIRECT_URI='your-app-redirect-url'
 '''
 
-client_credentials_manager = SpotifyClientCredentials()
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+from spotify_client import sp
 
-with open('config.json') as f:
-    config = json.load(f)
+config = get_config()
 OUTPUT_DIR = config['paths']['output_dir']
 ARTIST_IDS_FILE = config['filenames']['artist_ids']
 ARTIST_FILE = config['filenames']['artist_info']
@@ -40,20 +41,21 @@ CURRENT_DATE = datetime.now().strftime("%Y-%m-%d")
 USER_ID = 'spotify'
 TIMEOUT = 10*60
 
+'''Estimated requests per item, used to cut each run to what fits in the day's
+remaining request budget before it starts (see budget.py)'''
+REQUESTS_PER_ARTIST = 1 + 1/50 # artist_albums, plus artists in batches of 50
+REQUESTS_PER_TRACK = 2/50 # tracks and audio_features, in batches of 50
+
 def get_artist_info(num_to_scrape: int) -> None:
     '''Get artist information for all artist IDs that are in artist_ids.csv but not
     in Spotify_artist_info.csv. If num_to_scrape is None, scrape all that have not
     yet been scraped.'''
 
-    artist_ids_df = pd.read_csv(OUTPUT_DIR + ARTIST_IDS_FILE, usecols=["ids"])
-    artist_ids_total = artist_ids_df["ids"].tolist()
-
-    artist_ids_info_df = pd.read_csv(OUTPUT_DIR + ARTIST_FILE, usecols=["ids"])
-    artist_ids_info = artist_ids_info_df["ids"].tolist()
-
-    artist_ids = [x for x in artist_ids_total if x not in artist_ids_info]
+    artist_ids_total = get_index(OUTPUT_DIR + ARTIST_IDS_FILE).ids
+    artist_ids = get_index(OUTPUT_DIR + ARTIST_FILE).filter_new(artist_ids_total)
     if num_to_scrape is not None:
         artist_ids = artist_ids[:num_to_scrape]
+    artist_ids = artist_ids[:get_planner().affordable('catalog', len(artist_ids), REQUESTS_PER_ARTIST)]
     logger.info("Total number of artists to scrape: {:d}".format(len(artist_ids)))
 
     '''Retrieve full info structure for each artist, from Spotify'''
@@ -64,45 +66,41 @@ def get_artist_info(num_to_scrape: int) -> None:
     artist_info_dict = aih.generate_artist_info_dict(artists_info)
 
     '''Append to the Spotify_artist_info.csv file as a new row.'''
-    artist_info_df = pd.DataFrame({key: artist_info_dict[key] for key in artist_info_dict.keys})
-    artist_info_df.to_csv(OUTPUT_DIR + ARTIST_FILE, mode='a', header=False, index=False)
+    artist_info_df = artist_info_dict.to_pandas()
+    append_table(artist_info_df, OUTPUT_DIR + ARTIST_FILE)
 
 def get_artist_monthly_listeners(num_to_scrape: int=1000) -> None:
     '''Scrape monthly listeners for artist IDs that appear in Spotify_artist_info.csv
     but not in Spotify_artist_info_Mnth-Lstnrs.csv.'''
 
-    artist_info_df = pd.read_csv(OUTPUT_DIR + ARTIST_FILE)
-    artist_ids = artist_info_df["ids"].tolist()
-
-    artist_info_mnth_lstnrs_df = pd.read_csv(OUTPUT_DIR + ARTIST_MNTH_LSTNRS_FILE, usecols=["ids"])
-    artist_ids_mnth_lstnrs = artist_info_mnth_lstnrs_df["ids"].tolist()
-
-    artist_ids = [x for x in artist_ids if x not in artist_ids_mnth_lstnrs]
+    artist_ids = get_index(OUTPUT_DIR + ARTIST_FILE).ids
+    artist_ids = get_index(OUTPUT_DIR + ARTIST_MNTH_LSTNRS_FILE).filter_new(artist_ids)
     logger.info("Total number of artists to scrape: {:d}".format(len(artist_ids)))
 
     if num_to_scrape is not None:
         artist_ids = artist_ids[:num_to_scrape]
-
-    artist_monthly_listeners = []
-    i = 0
-    for artist_id in artist_ids:
-        artist_monthly_listeners.append(scrape_monthly_listeners(artist_id, "temp"))
-        i += 1
+    artist_ids = artist_ids[:get_planner().affordable('web', len(artist_ids))]
+
+    '''Pages are fetched concurrently, and results stream back in order'''
+    monthly_listeners_by_id = {}
+    artist_pages = iter_artist_pages(artist_ids, max_age_hours=MONTHLY_LISTENERS_MAX_AGE_HOURS)
+    for i, (artist_id, record) in enumerate(artist_pages, start=1):
+        monthly_listeners = None if record is None else record['monthly_listeners']
+        monthly_listeners_by_id[artist_id] = monthly_listeners
         if i % 100 == 0:
-            artist_monthly_listeners_print = [x for x in artist_monthly_listeners if x is not None]
+            artist_monthly_listeners_print = [x for x in monthly_listeners_by_id.values() if x is not None]
             logger.info("Scraped monthly listeners for {:d} artists. Current average is {:f}.".format(i, sum(artist_monthly_listeners_print)/i))
 
     '''Append to the Spotify_artist_info_Mnth-Lstnrs.csv file, along with all the info
     from Spotify_artist_info.csv for those IDs.'''
-    artist_info_df = pd.read_csv(OUTPUT_DIR + ARTIST_FILE)
-    artist_info_df = artist_info_df[artist_info_df["ids"].isin(artist_ids)]
-    artist_info_df["monthly_listeners"] = artist_monthly_listeners
-    artist_info_df.to_csv(OUTPUT_DIR + ARTIST_MNTH_LSTNRS_FILE, mode='a', header=False, index=False)
+    artist_info_df = read_table(OUTPUT_DIR + ARTIST_FILE, filters=[("ids", "in", artist_ids)])
+    artist_info_df["monthly_listeners"] = artist_info_df["ids"].map(monthly_listeners_by_id)
+    append_table(artist_info_df, OUTPUT_DIR + ARTIST_MNTH_LSTNRS_FILE)
 
 def clean_artist_info_mnth_lstnrs(req_features: List[str]) -> None:
     '''Clean the Spotify_artist_info_Mnth-Lstnrs.csv file, and save it to a new csv file.'''
 
-    artist_info_df = pd.read_csv(OUTPUT_DIR + ARTIST_MNTH_LSTNRS_FILE)
+    artist_info_df = read_table(OUTPUT_DIR + ARTIST_MNTH_LSTNRS_FILE)
 
     for_logging = artist_info_df.dropna(subset=[column for column in artist_info_df.columns if column in req_features])
     for_logging = for_logging.drop(for_logging[(for_logging[req_features] == -1).any(axis=1)].index)
@@ -110,7 +108,7 @@ def clean_artist_info_mnth_lstnrs(req_features: List[str]) -> None:
 
     '''First add the genres scraped from the Spotify bios'''
     if 'genres' in req_features:
-        bio_genres_df = pd.read_csv(OUTPUT_DIR + BIO_GENRES)
+        bio_genres_df = read_table(OUTPUT_DIR + BIO_GENRES, columns=["ids", "genres"])
         artist_info_df = artist_info_df.set_index('ids')
         bio_genres_df = bio_genres_df.set_index('ids')
         artist_info_df['genres'] = artist_info_df['genres'].combine_first(bio_genres_df['genres'])
@@ -122,7 +120,7 @@ def clean_artist_info_mnth_lstnrs(req_features: List[str]) -> None:
     logger.info("Number of artists after cleaning, with bio-scraping: {:d}".format(len(artist_info_df)))
 
     '''Save to a new csv file with a date-stamp for cleaning time'''
-    artist_info_df.to_csv(OUTPUT_DIR + CLEAN_MNTH_LSTNRS_FILE, index=False)
+    write_table(artist_info_df, OUTPUT_DIR + CLEAN_MNTH_LSTNRS_FILE)
     logger.info("Saved cleaned artist info to {:s}.".format(CLEAN_MNTH_LSTNRS_FILE))
 
 def get_artist_random_track_ids(num_to_scrape: int=None) -> None:
@@ -130,41 +128,33 @@ def get_artist_random_track_ids(num_to_scrape: int=None) -> None:
     but not in Spotify_artist_info_Random-Track-IDs.csv. If num_to_scrape is None, scrape all.'''
 
     try:
-        artist_info_df = pd.read_csv(OUTPUT_DIR + CLEAN_MNTH_LSTNRS_FILE)
+        artist_info_df = read_table(OUTPUT_DIR + CLEAN_MNTH_LSTNRS_FILE, columns=["ids", "names"])
         artist_ids = artist_info_df["ids"].tolist()
         artist_names = artist_info_df["names"].tolist()
     except FileNotFoundError:
         logger.error("Cleaned artist info file not found.")
         return
 
-    try:
-        artist_info_rand_tracks_df = pd.read_csv(OUTPUT_DIR + RAND_TRACK_IDS_FILE, usecols=["ids"])
-        artist_ids_rand_tracks = artist_info_rand_tracks_df["ids"].tolist()
-    except FileNotFoundError:
-        artist_ids_rand_tracks = []
-
+    artist_ids_rand_tracks = get_index(OUTPUT_DIR + RAND_TRACK_IDS_FILE)
     artist_names = [x for _, x in zip(artist_ids, artist_names) if _ not in artist_ids_rand_tracks]
-    artist_ids = [x for x in artist_ids if x not in artist_ids_rand_tracks]
+    artist_ids = artist_ids_rand_tracks.filter_new(artist_ids)
     if num_to_scrape is not None:
         artist_ids = artist_ids[:num_to_scrape]
         artist_names = artist_names[:num_to_scrape]
+    num_affordable = get_planner().affordable('catalog', len(artist_ids), REQUESTS_PER_ARTIST)
+    artist_ids, artist_names = artist_ids[:num_affordable], artist_names[:num_affordable]
     logger.info("Total number of artist tracks to retrieve: {:d}".format(len(artist_ids)))
 
+    '''Resolve tracks in batches of 1000 artists; discographies and album track lists
+    are fetched concurrently and in bulk (see discography.py).'''
     artist_random_tracks = []
-    i = 0
-    for artist_id in artist_ids:
-        artist_random_tracks.append(aih.get_artist_random_track_id(artist_id))
-        i += 1
-        if i % 100 == 0:
-            artist_random_tracks_print = [x for x in artist_random_tracks if x is not None]
-            logger.info("Pulled random tracks for {:d} artists.".format(i))
+    for i in range(0, len(artist_ids), 1000):
+        artist_random_tracks.extend(get_representative_tracks(artist_ids[i:i + 1000]))
+        logger.info("Pulled random tracks for {:d} artists.".format(len(artist_random_tracks)))
 
     '''Append the artist IDs and track IDs to Spotify_artist_info_Random-Track-IDs file.'''
     artist_info_to_add_df = pd.DataFrame({"ids": artist_ids, "names": artist_names, "track_ids": artist_random_tracks})
-    if not os.path.exists(OUTPUT_DIR + RAND_TRACK_IDS_FILE):
-        artist_info_to_add_df.to_csv(OUTPUT_DIR + RAND_TRACK_IDS_FILE, index=False)
-    else:
-        artist_info_to_add_df.to_csv(OUTPUT_DIR + RAND_TRACK_IDS_FILE, mode='a', header=False, index=False)
+    append_table(artist_info_to_add_df, OUTPUT_DIR + RAND_TRACK_IDS_FILE)
 
 def generate_track_info_for_artists(num_to_scrape: int=None) -> None:
     '''Generate track info for a number of artists by reading in the track IDs for those artists
@@ -176,18 +166,12 @@ def generate_track_info_for_artists(num_to_scrape: int=None) -> None:
 
     '''Generate track info, by reading in the track IDs, selecting the ones to scrape,
     and then retrieving the full track info structure for each track ID.'''
-    track_ids_df = pd.read_csv(OUTPUT_DIR + tracks_id_file, usecols=["track_ids"])
-    track_ids = track_ids_df["track_ids"].tolist()
-    track_ids = [x for x in track_ids if x == x]
+    track_ids = get_index(OUTPUT_DIR + tracks_id_file, column="track_ids").ids
     '''Remove tracks already scraped'''
-    try:
-        track_info_df = pd.read_csv(OUTPUT_DIR + tracks_info_file)
-        track_ids_scraped = track_info_df["ids"].tolist()
-    except FileNotFoundError:
-        track_ids_scraped = []
-    track_ids = [x for x in track_ids if x not in track_ids_scraped]
+    track_ids = get_index(OUTPUT_DIR + tracks_info_file).filter_new(track_ids)
     if num_to_scrape is not None:
         track_ids = track_ids[:num_to_scrape]
+    track_ids = track_ids[:get_planner().affordable('catalog', len(track_ids), REQUESTS_PER_TRACK)]
     
     '''Retrieve full info structure for each track, from Spotify'''
     tracks_info = tih.get_tracks_info(track_ids)
@@ -195,68 +179,66 @@ def generate_track_info_for_artists(num_to_scrape: int=None) -> None:
     track_info_dict = tih.TrackInfoDict(tracks_info, tracks_audio_info)
 
     '''Append to the Spotify_track_info.csv file as a new row.'''
-    track_info_df = pd.DataFrame({key: track_info_dict[key] for key in track_info_dict.keys})
-    if not os.path.exists(OUTPUT_DIR + tracks_info_file):
-        track_info_df.to_csv(OUTPUT_DIR + tracks_info_file, index=False)
-    else:
-        track_info_df.to_csv(OUTPUT_DIR + tracks_info_file, mode='a', index=False, header=False)
+    track_info_df = track_info_dict.to_pandas()
+    append_table(track_info_df, OUTPUT_DIR + tracks_info_file)
 
 def generate_artist_genres_from_bio(num_to_scrape: int=None) -> None:
     genres_to_search = config["genres"]
 
-    artist_info_df = pd.read_csv(OUTPUT_DIR + ARTIST_MNTH_LSTNRS_FILE, usecols=["ids", "names", "genres"])
+    artist_info_df = read_table(OUTPUT_DIR + ARTIST_MNTH_LSTNRS_FILE, columns=["ids", "names", "genres"])
     artist_ids = artist_info_df[artist_info_df["genres"].isnull()]["ids"].tolist()
     logger.info(f"Number of artists with no genres: {len(artist_ids)}")
 
     '''take only those that don't appear in BIO_GENRES or MISSING_BIO_GENRES files'''
-    if os.path.exists(OUTPUT_DIR + BIO_GENRES):
-        bio_genres_df = pd.read_csv(OUTPUT_DIR + BIO_GENRES, usecols=["ids"])
-        bio_genres_ids = bio_genres_df["ids"].tolist()
-        artist_ids = [x for x in artist_ids if x not in bio_genres_ids]
-    if os.path.exists(OUTPUT_DIR + MISSING_BIO_GENRES):
-        missing_bio_genres_df = pd.read_csv(OUTPUT_DIR + MISSING_BIO_GENRES, usecols=["ids"])
-        missing_bio_genres_ids = missing_bio_genres_df["ids"].tolist()
-        artist_ids = [x for x in artist_ids if x not in missing_bio_genres_ids]
+    artist_ids = get_index(OUTPUT_DIR + BIO_GENRES).filter_new(artist_ids)
+    artist_ids = get_index(OUTPUT_DIR + MISSING_BIO_GENRES).filter_new(artist_ids)
+    artist_ids = list(dict.fromkeys(artist_ids))
     logger.info(f"Total number of artists to scrape: {len(artist_ids)}")
 
     if num_to_scrape is not None:
         artist_ids = artist_ids[:num_to_scrape]
     logger.info(f"Scraping number of artists: {len(artist_ids)}")
 
-    '''Divide artist IDs into batches of 100'''
-    artist_ids_batches = [artist_ids[i:i + 100] for i in range(0, len(artist_ids), 100)]
-    for i, artist_ids_batch in enumerate(artist_ids_batches):
-        artist_ids_genres, artist_genres, artist_names, missing_ids_genres = [], [], [], []
-        for j, artist_id in enumerate(artist_ids_batch):
-            artist_name = artist_info_df[artist_info_df["ids"] == artist_id]["names"].values[0]
-            genres = scrape_genres_from_bio(artist_id, artist_name, genres_to_search)
-            if genres:
-                genres = ','.join(genres)
+    '''Artist pages already fetched (e.g. by the monthly-listener stage) are read from
+    the artist page store, the rest are fetched concurrently. Results are appended
+    in batches of 100.'''
+    artist_names_by_id = dict(zip(artist_info_df["ids"], artist_info_df["names"]))
+    artist_ids_genres, artist_genres, artist_names, missing_ids_genres = [], [], [], []
+
+    def append_batch(j: int) -> None:
+        '''Append the genres (and missing genres) found since the last batch.'''
+        if len(artist_ids_genres) + len(missing_ids_genres) == 0:
+            return
+        artist_info_genres_df = pd.DataFrame({"ids": artist_ids_genres, "names": artist_names, "genres": artist_genres})
+        append_table(artist_info_genres_df, OUTPUT_DIR + BIO_GENRES)
+        logger.info(f'{j}: Appended {len(artist_info_genres_df)} artist genres to: {OUTPUT_DIR + BIO_GENRES}')
+
+        missing_names_df = pd.DataFrame({"ids": missing_ids_genres})
+        append_table(missing_names_df, OUTPUT_DIR + MISSING_BIO_GENRES)
+        logger.info(f'{j}: Appended {len(missing_names_df)} missing artist genres to: {OUTPUT_DIR + MISSING_BIO_GENRES}')
+        for results in [artist_ids_genres, artist_genres, artist_names, missing_ids_genres]:
+            results.clear()
+
+    '''The last, partial batch is appended even if the scrape stops early (e.g. with
+    BudgetExhausted once the day's artist page budget is used up)'''
+    j = -1
+    try:
+        for j, (artist_id, record) in enumerate(iter_artist_pages(artist_ids, genres_to_find=genres_to_search)):
+            artist_name = artist_names_by_id[artist_id]
+            if record is not None and record['genres']:
+                genres = ','.join(record['genres'])
                 artist_ids_genres.append(artist_id)
                 artist_genres.append(genres)
                 artist_names.append(artist_name)
-                logger.info(f"{i*100 + j}: Genres {genres} found for: {artist_name}, {artist_id}.")
+                logger.info(f"{j}: Genres {genres} found for: {artist_name}, {artist_id}.")
             else:
                 missing_ids_genres.append(artist_id)
-                logger.info(f"{i*100 + j}: Genres not found for artist id: {artist_id} and artist name: {artist_name}, {artist_id}.")
-    
-        artist_info_genres_df = pd.DataFrame({"ids": artist_ids_genres, "names": artist_names, "genres": artist_genres})
-        if os.path.exists(OUTPUT_DIR + BIO_GENRES):
-            artist_info_genres_df.to_csv(OUTPUT_DIR + BIO_GENRES, mode='a', header=False, index=False)
-            logger.info(f'{i*100 + j}: Appended {len(artist_info_genres_df)} artist genres to existing file: {OUTPUT_DIR + BIO_GENRES}')
-        else:
-            artist_info_genres_df.to_csv(OUTPUT_DIR + BIO_GENRES, index=False)
-            logger.info(f'Saved {len(artist_info_genres_df)} artist genres to new file: {OUTPUT_DIR + BIO_GENRES}')
+                logger.info(f"{j}: Genres not found for artist id: {artist_id} and artist name: {artist_name}, {artist_id}.")
 
-        missing_names_df = pd.DataFrame({"ids": missing_ids_genres})
-        if os.path.exists(OUTPUT_DIR + MISSING_BIO_GENRES):
-            missing_names_df.to_csv(OUTPUT_DIR + MISSING_BIO_GENRES, mode='a', header=False, index=False)
-            logger.info(f'{i*100 + j}: Appended {len(missing_names_df)} missing artist genres to existing file: {OUTPUT_DIR + MISSING_BIO_GENRES}')
-        else:
-            missing_names_df.to_csv(OUTPUT_DIR + MISSING_BIO_GENRES, index=False)
-            logger.info(f'{i*100 + j}: Saved {len(missing_names_df)} missing artist genres to new file: {OUTPUT_DIR + MISSING_BIO_GENRES}')
-        logger.info(f"{i*100 + j}: Sleeping for 10 seconds.")
-        time.sleep(10)
+            if (j + 1) % 100 == 0:
+                append_batch(j)
+    finally:
+        append_batch(j)
 
 if __name__ == "__main__":
     #pass
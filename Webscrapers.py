@@ -1,54 +1,161 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
-import os, time, json
+import os, time, threading
+from collections import deque
 
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Any, Callable, Iterator
 
-with open('config.json') as f:
-    config = json.load(f)
+from spotify_client import TokenBucket
+from budget import get_planner, StageExecutor
+from metrics import get_metrics, MeteredRetry
+from genre_matcher import get_matcher
+from settings import get_config
+
+config = get_config()
 OUTPUT_DIR = config['paths']['output_dir']
 DATAFRAME_MNTHLSTNRS = config['filenames']["artist_info_mnth_lstnrs"]
+REQUESTS_PER_SECOND = config['scraper']['requests_per_second']
+BURST = config['scraper']['burst']
+MAX_WORKERS = config['scraper']['max_workers']
+TIMEOUT = config['scraper']['timeout_seconds']
+RETRIES = config['scraper']['retries']
+BACKOFF = config['scraper']['backoff_seconds']
+ARTIST_URL = config['scraper']['artist_url']
+
+'''Only these nodes are built into a tree when parsing an artist page'''
+MONTHLY_LISTENERS_STRAINER = SoupStrainer("div", attrs={"data-testid": "monthly-listeners-label"})
+BIO_STRAINER = SoupStrainer("span", attrs={"data-encore-id": "type"})
+BIO_CLASS = 'Type__TypeElement-sc-goli3j-0 kmjYak G_f5DJd2sgHWeto5cwbi'
+
+class ArtistPageScraper:
+    '''Fetches Spotify artist pages over a pooled keep-alive session, with up to
+    max_workers requests in flight, all drawing from one token bucket. Connection
+    errors and 429/5xx responses are retried with exponential backoff (honouring
+    Retry-After), and every request has a timeout.'''
+    def __init__(self, bucket: TokenBucket, max_workers: int=MAX_WORKERS):
+        self.bucket = bucket
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        retry = MeteredRetry(
+            total=RETRIES,
+            backoff_factor=BACKOFF,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.hooks['response'].append(get_metrics().response_hook)
+        self.executor = StageExecutor(max_workers=max_workers, thread_name_prefix='scraper')
+
+    def fetch(self, artist_id: str) -> str:
+        '''HTML of an artist page, or None if it could not be loaded.'''
+        url = ARTIST_URL.format(artist_id)
+        with get_metrics().measure('artist_page') as measured:
+            get_planner().acquire('web')
+            self.bucket.acquire()
+            measured.send()
+            try:
+                response = self.session.get(url, timeout=TIMEOUT)
+            except requests.RequestException as e:
+                logger.error(f"Failed to load page: {url}: {e}")
+                return None
+            if response.status_code != 200:
+                logger.error(f"Failed to load page: {url}, status {response.status_code}.")
+                return None
+            measured.items = 1
+        return response.text
+
+    def scrape(self, artist_id: str, parse: Callable[[str], Any]) -> Any:
+        html = self.fetch(artist_id)
+        if html is None:
+            return None
+        return parse(html)
+
+    def scrape_many(self, artist_ids: List[str], parse: Callable[[str], Any]) -> Iterator[Tuple[str, Any]]:
+        '''Fetch and parse the pages of many artists, yielding (artist_id, result)
+        in the order of artist_ids as soon as each is ready. At most 2*max_workers
+        pages are held at once, so this can stream through any number of IDs.
+        result is None if the page could not be loaded.'''
+
+        artist_ids = iter(artist_ids)
+        in_flight = deque()
+        for artist_id in artist_ids:
+            in_flight.append((artist_id, self.executor.submit(self.scrape, artist_id, parse)))
+            if len(in_flight) >= 2*self.max_workers:
+                break
+        try:
+            while len(in_flight) > 0:
+                artist_id, future = in_flight.popleft()
+                result = future.result()
+                next_id = next(artist_ids, None)
+                if next_id is not None:
+                    in_flight.append((next_id, self.executor.submit(self.scrape, next_id, parse)))
+                yield artist_id, result
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+def parse_monthly_listeners(html: str) -> int:
+    '''Monthly listeners shown on an artist page, or 0 if they are not shown.'''
+    soup = BeautifulSoup(html, "html.parser", parse_only=MONTHLY_LISTENERS_STRAINER)
+    monthly_listeners_element = soup.find("div", {"data-testid": "monthly-listeners-label"})
+    if monthly_listeners_element:
+        monthly_listeners = monthly_listeners_element.text.strip()
+        return int(monthly_listeners.split("monthly listener")[0].replace(",", "").strip())
+    return 0
+
+def parse_bio(html: str) -> str:
+    '''Lowercased bio text of an artist page, or None if there is no bio.'''
+    soup = BeautifulSoup(html, "html.parser", parse_only=BIO_STRAINER)
+    bio_text = soup.find('span', class_=BIO_CLASS, attrs={'data-encore-id': 'type'})
+    if bio_text:
+        return bio_text.get_text().lower()
+    return None
+
+def parse_artist_page(html: str) -> Dict[str, Any]:
+    '''All the fields extracted from an artist page.'''
+    return {'monthly_listeners': parse_monthly_listeners(html), 'bio': parse_bio(html)}
+
+def match_genres(bio_text: str, genres_to_find: List[str]) -> List[str]:
+    '''Genres from genres_to_find that appear as whole words in a bio.'''
+    return get_matcher(tuple(genres_to_find)).match(bio_text)
+
+scraper = None
+scraper_lock = threading.Lock()
+def get_scraper() -> ArtistPageScraper:
+    '''The process-wide artist page scraper, created on first use.'''
+    global scraper
+    with scraper_lock:
+        if scraper is None:
+            scraper = ArtistPageScraper(TokenBucket(REQUESTS_PER_SECOND, BURST))
+    return scraper
+
+def scrape_monthly_listeners_many(artist_ids: List[str]) -> Iterator[Tuple[str, int]]:
+    '''Stream (artist_id, monthly_listeners) for many artists, concurrently. Monthly
+    listeners are 0 if not shown, and None if the page could not be loaded.'''
+    return get_scraper().scrape_many(artist_ids, parse_monthly_listeners)
 
 def scrape_monthly_listeners(artist_id, artist_name) -> int:
-    url = f"https://open.spotify.com/artist/{artist_id}"
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, "html.parser")
-        monthly_listeners_element = soup.find("div", {"data-testid": "monthly-listeners-label"})
-        if monthly_listeners_element:
-            monthly_listeners = monthly_listeners_element.text.strip()
-            monthly_listeners = int(monthly_listeners.split("monthly listener")[0].replace(",", "").strip())
-            return monthly_listeners
-        else:
-            print(f"Failed to find monthly listeners for artist id: {artist_id} and artist name: {artist_name}. Monthly listeners must be 0.")
-            return 0
-    else:
-        print(f"Failed to load page: {url} for artist name {artist_name}.")
-        return None
+    monthly_listeners = get_scraper().scrape(artist_id, parse_monthly_listeners)
+    if monthly_listeners == 0:
+        logger.info(f"Failed to find monthly listeners for artist id: {artist_id} and artist name: {artist_name}. Monthly listeners must be 0.")
+    return monthly_listeners
 
 def scrape_genres_from_bio(artist_id, artist_name, genres_to_find) -> int:
-    url = f"https://open.spotify.com/artist/{artist_id}"
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, "html.parser")
-        bio_text = soup.find('span', class_='Type__TypeElement-sc-goli3j-0 kmjYak G_f5DJd2sgHWeto5cwbi', attrs={'data-encore-id': 'type'})
-        if bio_text:
-            bio_text = bio_text.get_text()
-            bio_text = bio_text.lower()
-            found_strings = [elem for elem in genres_to_find if elem in bio_text]
-            return found_strings
-        else:
-            print(f"Failed to find bio for artist id: {artist_id} and artist name: {artist_name}.")
-            return None
+    bio_text = get_scraper().scrape(artist_id, parse_bio)
+    if bio_text:
+        return match_genres(bio_text, genres_to_find)
     else:
-        print(f"Failed to load page: {url} for artist name {artist_name}.")
+        logger.info(f"Failed to find bio for artist id: {artist_id} and artist name: {artist_name}.")
         return None
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
@@ -1,15 +1,13 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-
 import numpy as np
 from datetime import datetime
 
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator
+from concurrent.futures import Future
 
-import time
+import sys
 import signal
 def handler(signum, frame) -> None:
     raise TimeoutError("Operation timed out")
@@ -21,8 +19,10 @@ export SPOTIPY_CLIENT_SECRET='your-spotify-client-secret'
 export SPOTIPY_REDIRECT_URI='your-app-redirect-url'
 '''
 
-client_credentials_manager = SpotifyClientCredentials()
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+from spotify_client import sp, batched
+from columnar import ColumnarRecords, Field
+from discography import get_artists_albums, get_artist_albums, get_representative_tracks
+from name_resolution import get_resolution_cache, normalize_name
 
 CURRENT_YEAR = datetime.now().year
 TIMEOUT = 10*60
@@ -32,46 +32,134 @@ def get_artist_spotify_id(artist_name, limit=10) -> Dict[str, str]:
     characters. Because the search returns the closest *most popular* match, it
     sometimes misses the artist we're looking for. To respect rate limits, set to 10
     by default, but we can comb through more forcefully in another function to double-
-    check whether an ID is really missing.'''
+    check whether an ID is really missing. Names are first looked up in the name
+    resolution cache, which also stores every artist on the search pages received.'''
+    for _, spot_id in get_artist_spotify_ids([artist_name], limit):
+        return spot_id
+
+def get_artist_spotify_ids(artist_names: List[str], limit=10) -> Iterator[Tuple[str, str]]:
+    '''Search for many artist names as get_artist_spotify_id does for one, yielding
+    (artist_name, spotify_id or None) in order. The searches for all the names not in
+    the name resolution cache are submitted to the shared client at once. If a request
+    fails (e.g. with BudgetExhausted), the generator stops after the results yielded
+    so far, and cancels all its outstanding requests.'''
+
+    resolutions = get_resolution_cache()
+    resolved = {}
+    for artist_name in artist_names:
+        is_known, spot_id = resolutions.lookup(artist_name, depth='search')
+        if is_known:
+            resolved[artist_name] = spot_id
+    searches = {
+        artist_name: sp.submit('search', q=f'artist:"{artist_name}"', type='artist', limit=limit)
+        for artist_name in dict.fromkeys(artist_names) if artist_name not in resolved
+    }
 
-    results = sp.search(q=f'artist:"{artist_name}"', type='artist', limit=limit)
-    artists = results['artists']['items']
+    try:
+        for artist_name in artist_names:
+            if artist_name not in resolved:
+                artists = searches[artist_name].result()['artists']['items']
+                resolutions.record_page(artists)
+                spot_id = find_exact_match(artist_name, artists) # search returns closest, make sure exact match
+                if spot_id is None:
+                    resolutions.record_miss(artist_name, depth='search')
+                resolved[artist_name] = spot_id
+            yield artist_name, resolved[artist_name]
+    finally:
+        for search in searches.values():
+            search.cancel()
+
+DEEP_SEARCH_LIMIT = 50 # maximum page size of the search endpoint
+DEEP_SEARCH_MAX_RESULTS = 1000 # the search endpoint returns nothing beyond this offset
+
+def submit_deep_search_page(artist_name: str, offset: int) -> Future:
+    return sp.submit('search', q=f'artist:"{artist_name}"', type='artist', limit=DEEP_SEARCH_LIMIT, offset=offset)
+
+def get_artist_spotify_ids_deepscrape(artist_names: List[str]) -> Iterator[Tuple[str, str]]:
+    '''Deep search for many artist names, searching through all 1,000 results of each
+    for an exact match, and yielding (artist_name, spotify_id or None) in order. The
+    first pages of all names are requested concurrently through the shared client,
+    then all remaining offsets of the names not matched there. Pages are checked in
+    offset order, and those of a name not yet started are cancelled as soon as one
+    of them has a match. Every page goes into the name resolution cache, as does a
+    final miss. If a request fails (e.g. with BudgetExhausted), the generator stops
+    after the results yielded so far, and cancels all its outstanding requests.'''
+
+    resolutions = get_resolution_cache()
+    resolved = {}
+    for artist_name in artist_names:
+        is_known, spot_id = resolutions.lookup(artist_name, depth='deep')
+        if is_known:
+            resolved[artist_name] = spot_id
+    first_pages = {
+        artist_name: submit_deep_search_page(artist_name, 0)
+        for artist_name in dict.fromkeys(artist_names) if artist_name not in resolved
+    }
+    outstanding = list(first_pages.values())
 
-    if len(artists) == 0:
-        return None
-    else:
-        for artist in artists:
-            if artist['name'].lower() == artist_name.lower(): # make sure exact match, search returns closest
-                return artist['id']
-        return None
+    try:
+        later_pages = {}
+        for artist_name, first_page in first_pages.items():
+            results = first_page.result()['artists']
+            resolutions.record_page(results['items'])
+            spot_id = find_exact_match(artist_name, results['items'])
+            if spot_id is not None or not results['next']:
+                resolved[artist_name] = spot_id
+                if spot_id is None:
+                    resolutions.record_miss(artist_name, depth='deep')
+                continue
+            later_pages[artist_name] = [
+                submit_deep_search_page(artist_name, offset)
+                for offset in range(DEEP_SEARCH_LIMIT, min(results['total'], DEEP_SEARCH_MAX_RESULTS), DEEP_SEARCH_LIMIT)
+            ]
+            outstanding.extend(later_pages[artist_name])
+
+        for artist_name in artist_names:
+            if artist_name not in resolved:
+                pages, spot_id = later_pages[artist_name], None
+                for page in pages:
+                    items = page.result()['artists']['items']
+                    resolutions.record_page(items)
+                    spot_id = find_exact_match(artist_name, items)
+                    if spot_id is not None:
+                        break
+                for page in pages:
+                    page.cancel()
+                resolved[artist_name] = spot_id
+                if spot_id is None:
+                    resolutions.record_miss(artist_name, depth='deep')
+
+            if resolved[artist_name] is not None:
+                logger.info(f"Found {artist_name} in deep search.")
+            else:
+                logger.info(f"Could not find {artist_name} in deep search.")
+            yield artist_name, resolved[artist_name]
+    finally:
+        for future in outstanding:
+            future.cancel()
 
 def get_artist_spotify_id_deepscrape(artist_name) -> Dict[str, str]:
     '''Fetch artist id from Spotify by name, searching through all 1,000 results
-    for an exact match. 50 is the max. limit per page.'''
-
-    results = sp.search(q=f'artist:"{artist_name}"', type='artist', limit=50)
-    artists = results['artists']['items']
-
-    if len(artists) == 0:
-        return None
-    else:
-        for artist in artists:
-            if artist['name'].lower() == artist_name.lower():
-                logger.info(f"Found {artist_name} in deep search.")
-                return artist['id']
-        while results['artists']['next']:
-            results = sp.next(results['artists'])
-            for artist in results['artists']['items']:
-                if artist['name'].lower() == artist_name.lower():
-                    logger.info(f"Found {artist_name} in deep search.")
-                    return artist['id']
-        logger.info(f"Could not find {artist_name} in deep search.")
-        return None
+    for an exact match, with the result pages fetched concurrently (see
+    get_artist_spotify_ids_deepscrape).'''
+    for _, spot_id in get_artist_spotify_ids_deepscrape([artist_name]):
+        return spot_id
+
+def find_exact_match(artist_name, artists) -> str:
+    '''ID of the first artist whose name matches artist_name up to case and diacritics.'''
+    key = normalize_name(artist_name)
+    for artist in artists:
+        if normalize_name(artist['name']) == key:
+            return artist['id']
+    return None
 
-def get_artist_release_dates(artist_id) -> List[str]:
-    '''Get the release years of all albums and singles by a given artist.'''
+def get_artist_release_dates(artist_id, artist_albums=None) -> List[str]:
+    '''Get the release years and track counts of all albums and singles by a given
+    artist. The full artist_albums listing (see discography.py) can be passed in if
+    it has already been fetched.'''
 
-    artist_albums = sp.artist_albums(artist_id, album_type='album,single')
+    if artist_albums is None:
+        artist_albums = get_artist_albums(artist_id)
 
     release_dates, album_ids, album_types, total_tracks = [], [], [], []
     for album in artist_albums['items']:
@@ -79,111 +167,87 @@ def get_artist_release_dates(artist_id) -> List[str]:
         if album_type == 'album' or album_type == 'single':
             release_dates.append(album['release_date'])
             album_types.append(album['album_type'])
-            total_tracks = album['total_tracks']
+            total_tracks.append(album['total_tracks'])
             album_ids.append(album['id'])
     release_dates = [int(date.split('-')[0]) for date in release_dates]
     return album_ids, release_dates, album_types, total_tracks
 
-def get_artist_random_track_id(artist_id) -> str:
-    '''Get a random track ID from a given artist. Just the first track from
-    the first album or single that Spotify returns.'''
+def get_artist_random_track_id(artist_id, policy: str=None) -> str:
+    '''Get a representative track ID from a given artist. By default (policy 'first'),
+    just the first track from the first album or single that Spotify returns. For
+    many artists, use discography.get_representative_tracks directly.'''
 
-    artist_albums = sp.artist_albums(artist_id, album_type='album,single')
-    for album in artist_albums['items']:
-        album_id = album['id']
-        if album['album_type'] == 'album' or album['album_type'] == 'single':
-            album_tracks = sp.album_tracks(album_id)
-            if len(album_tracks['items']) > 0:
-                return album_tracks['items'][0]['id']
-
-    return None
+    if policy is None:
+        return get_representative_tracks([artist_id])[0]
+    return get_representative_tracks([artist_id], policy=policy)[0]
 
-class ArtistInfoDict:
+class ArtistInfoDict(ColumnarRecords):
     '''Data structure to store artist information. Default keys are listed.
-    The user can exclude keys by passing a list of keys to exclude_keys.'''
+    The user can exclude keys by passing a list of keys to exclude_keys.
+    Each key is a typed column (see columnar.py); container[key] returns it as a
+    list, and to_pandas() the whole table.'''
+    __slots__ = ()
+    FIELDS = {
+        'ids': Field('str', 'artist', ('id',), str),
+        'names': Field('category', 'artist', ('name',), lambda name: str(name).lower()),
+        'popularity': Field('int', 'artist', ('popularity',), int),
+        'followers': Field('int', 'artist', ('followers', 'total'), int),
+        'genres': Field('category', 'artist', ('genres',), ', '.join),
+        'first_release': Field('int', 'albums', ('first_release',)),
+        'last_release': Field('int', 'albums', ('last_release',)),
+        'num_releases': Field('int', 'albums', ('num_releases',)),
+        'num_tracks': Field('int', 'albums', ('num_tracks',))
+    }
+
     def __init__(self, artist_info=None, exclude_keys=None):
-        self.keys = [
-            'ids',
-            'names',
-            'popularity',
-            'followers',
-            'genres',
-            'first_release',
-            'last_release',
-            'num_releases',
-            'num_tracks'
-        ]
-        if exclude_keys:
-            if 'ids' in exclude_keys:
-                logger.critical("Cannot exclude 'ids' key.")
-                sys.exit(1)
-            self.keys = [key for key in self.keys if key not in exclude_keys]
-
-        self.data = {key: [] for key in self.keys}
+        super().__init__(exclude_keys)
 
         if artist_info: # initial store
             self.append_artist_info(artist_info)
 
-    def __getitem__(self, key):
-        return self.data[key]
-
-    def __setitem__(self, key, value):
-        self.data[key] = value
-
-    def check_equal_length(self):
-        '''Check that all lists in the dictionary have the same length.'''
-        for key in self.keys:
-            if len(self.data[key]) != len(self.data['ids']):
-                logger.critical(f"Length of {key} does not match length of ids.")
-                sys.exit(1)
-
-    def append_artist_info(self, artist_info):
-        if 'ids' in self.keys:
-            self.data['ids'].append(str(artist_info['id']))
-        if 'names' in self.keys:
-            self.data['names'].append(str(artist_info['name']).lower())
-        if 'popularity' in self.keys:
-            self.data['popularity'].append(int(artist_info['popularity']))
-        if 'followers' in self.keys:
-            self.data['followers'].append(int(artist_info['followers']['total']))
-        if 'genres' in self.keys:
-            genres = ', '.join(artist_info['genres'])
-            self.data['genres'].append(str(genres))
-        if 'first_release' in self.keys or 'last_release' in self.keys or 'num_releases' in self.keys or 'num_tracks' in self.keys:
-            album_ids, release_dates, album_types, total_tracks = get_artist_release_dates(artist_info['id'])
-            if(len(release_dates) > 0):
-                if 'first_release' in self.keys:
-                    self.data['first_release'].append(int(min(release_dates)))
-                if 'last_release' in self.keys:
-                    self.data['last_release'].append(int(max(release_dates)))
-                if 'num_releases' in self.keys:
-                    self.data['num_releases'].append(int(len(release_dates)))
-                if 'num_tracks' in self.keys:
-                    self.data['num_tracks'].append(int(np.sum(total_tracks)))
-            else:
-                if 'first_release' in self.keys:
-                    self.data['first_release'].append(int(-1))
-                if 'last_release' in self.keys:
-                    self.data['last_release'].append(int(-1))
-                if 'num_releases' in self.keys:
-                    self.data['num_releases'].append(int(0))
-                if 'num_tracks' in self.keys:
-                    self.data['num_tracks'].append(int(0))
+    def requires_albums(self) -> bool:
+        '''Whether any of the stored keys need the artist_albums endpoint.'''
+        return len(self.group_keys('albums')) > 0
+
+    def append_artist_info(self, artist_info, artist_albums=None):
+        self.append_artists_info([artist_info], [artist_albums])
+
+    def append_artists_info(self, artists_info, artists_albums=None):
+        '''Append a batch of artists, extracting all stored keys in one pass. The
+        artist_albums responses can be passed in if they have already been fetched.'''
+        self.append_payloads('artist', artists_info)
+        if self.requires_albums():
+            if artists_albums is None:
+                artists_albums = [None]*len(artists_info)
+            summaries = []
+            for artist_info, artist_albums in zip(artists_info, artists_albums):
+                album_ids, release_dates, album_types, total_tracks = get_artist_release_dates(artist_info['id'], artist_albums)
+                summaries.append(summarize_releases(release_dates, total_tracks))
+            self.append_payloads('albums', summaries)
+
+def summarize_releases(release_dates: List[int], total_tracks) -> Dict[str, int]:
+    '''The 'albums' fields of ArtistInfoDict, from an artist's release years.'''
+    if len(release_dates) == 0:
+        return {'first_release': -1, 'last_release': -1, 'num_releases': 0, 'num_tracks': 0}
+    return {
+        'first_release': int(min(release_dates)),
+        'last_release': int(max(release_dates)),
+        'num_releases': len(release_dates),
+        'num_tracks': int(np.sum(total_tracks))
+    }
 
 def get_spotify_artists_info(artist_ids):
     '''Get all artist information for a set of artist ids. This returns the whole
     Spotify info structure for that list of artist IDs, and includes a time-out
     condition in case we hit the daily rate limit.'''
 
-    '''Maximum 50 artists per request to sp.artists'''
+    '''Maximum 50 artists per request to sp.artists. Artists already in the response
+    cache are not requested again, and the remaining batches are fetched concurrently
+    through the shared, rate-limited client.'''
     try:
         signal.signal(signal.SIGALRM, handler)
         signal.alarm(TIMEOUT)
-        artists_info = []
-        artist_ids_batches = [artist_ids[i:i + 50] for i in range(0, len(artist_ids), 50)]
-        for artist_ids_batch in artist_ids_batches:
-            artists_info_batch = sp.artists(artist_ids_batch)['artists']
-            artists_info.extend(artists_info_batch)
+        artists_info = sp.entities('artists', list(artist_ids), batch_size=50)
         signal.alarm(0)
     except TimeoutError as e:
         logger.critical(f"Operation timed out: {e}")
@@ -195,31 +259,91 @@ def get_spotify_artists_info(artist_ids):
 def generate_artist_info_dict(artists_info) -> ArtistInfoDict:
     '''Fill out all the artist information from the Spotify artist info structure,
     including information about artist releases, which must be calculated from
-    the artist_albums endpoint, hence the batching and timeout.'''
+    the artist_albums endpoint, hence the batching and timeout. The artist_albums
+    requests for each batch are kept in flight concurrently by the shared client,
+    which also paces them, so no pause between batches is needed.'''
 
     all_artist_info = ArtistInfoDict()
     try:
         logger.info(f'Fetching release dates and number of tracks for {len(artists_info)} artists, will timeout.')
-        artists_info_batches = [artists_info[i:i + 50] for i in range(0, len(artists_info), 50)]
+        artists_info_batches = batched(artists_info, 50)
         signal.signal(signal.SIGALRM, handler)
-        signal.alarm(len(artists_info)*(60 + 10)) # 1 min per batch + downtime
-        i = 0
-        for artist_info_batch in artists_info_batches:
-            for artist_info in artist_info_batch:
-                all_artist_info.append_artist_info(artist_info)
-            logger.info(f'{i}: Fetched release dates and number of tracks for batch {len(artist_info_batch)} artists. Pausing for 10s...')
-            i += 1
-            time.sleep(10)
+        signal.alarm(len(artists_info_batches)*60 + TIMEOUT) # 1 min per batch + margin
+        for i, artist_info_batch in enumerate(artists_info_batches):
+            artists_albums = None
+            if all_artist_info.requires_albums():
+                artists_albums = get_artists_albums([artist_info['id'] for artist_info in artist_info_batch])
+            all_artist_info.append_artists_info(artist_info_batch, artists_albums)
+            logger.info(f'{i}: Fetched release dates and number of tracks for batch {len(artist_info_batch)} artists.')
         signal.alarm(0)
     except TimeoutError as e:
         logger.critical(f"Operation timed out: {e}")
         sys.exit(1)
     all_artist_info.check_equal_length()
-    logger.info(f'Finished fetching release dates and number of tracks for {len(all_artist_info["ids"])} artists.')
+    logger.info(f'Finished fetching release dates and number of tracks for {len(all_artist_info)} artists.')
 
     return all_artist_info
 
-def get_active_artists(artist_info_dict, strict=False) -> Dict[str, np.array]:
+CLASSIFIER_KEYS = ['first_release', 'last_release', 'num_tracks', 'num_releases']
+ARTIST_LABELS = np.array(['other', 'legacy', 'active', 'new_active'])
+
+def column_names(artist_info) -> List[str]:
+    '''Keys of a dict, DataFrame or ArtistInfoDict (whose keys are an attribute).'''
+    keys = artist_info.keys
+    return list(keys() if callable(keys) else keys)
+
+def classifier_columns(artist_info, reference_year: int=None) -> Tuple[Dict[str, np.ndarray], int]:
+    '''The columns the classifiers need, as float arrays (views of DataFrame columns
+    where possible), and the reference year (default: the current year).'''
+    if not all(key in column_names(artist_info) for key in CLASSIFIER_KEYS):
+        logger.critical(f"Missing required keys in artist_info: {CLASSIFIER_KEYS}")
+        sys.exit(1)
+    columns = {key: np.asarray(artist_info[key], dtype=float) for key in CLASSIFIER_KEYS}
+    return columns, CURRENT_YEAR if reference_year is None else reference_year
+
+def active_mask(artist_info, reference_year: int=None) -> np.ndarray:
+    '''Boolean mask of the artists that fulfil both of the following:
+    1. Have produced new music in the past five years
+    2. If they're more than one years old, have an average of
+    two tracks per year over the last ten years'''
+    c, year = classifier_columns(artist_info, reference_year)
+    age = year - c['first_release']
+    return (c['num_releases'] > 0) & (c['last_release'] > year - 5) & ((age < 2) | (c['num_tracks'] > age * 2))
+
+def new_active_mask(artist_info, reference_year: int=None) -> np.ndarray:
+    '''Boolean mask of the active artists with a first release in the past five years.'''
+    c, year = classifier_columns(artist_info, reference_year)
+    return active_mask(c, year) & (c['first_release'] > year - 5)
+
+def legacy_mask(artist_info, reference_year: int=None) -> np.ndarray:
+    '''Boolean mask of the artists that fulfil all of the following:
+    1. Have not produced new music in the past five years
+    2. Have had more than 2 lifetime releases
+    3. Have two or more tracks per years between their first and last releases'''
+    c, year = classifier_columns(artist_info, reference_year)
+    return (
+        (c['num_releases'] > 2) & (c['last_release'] < year - 5) &
+        (c['num_tracks'] >= 2.*(c['last_release'] - c['first_release']))
+    )
+
+def label_artists(artist_info, reference_year: int=None) -> np.ndarray:
+    '''Label every artist as 'new_active', 'active', 'legacy' or 'other' in one pass.
+    The categories are exclusive: new active artists are not labelled 'active'.'''
+    c, year = classifier_columns(artist_info, reference_year)
+    active = active_mask(c, year)
+    codes = np.where(legacy_mask(c, year), 1, 0)
+    codes[active] = 2
+    codes[active & (c['first_release'] > year - 5)] = 3
+    return ARTIST_LABELS[codes]
+
+def select_artists(artist_info, mask: np.ndarray, return_indices: bool=False):
+    '''Rows of artist_info where mask is True, as a dict of arrays (one copy per
+    column), or just the row indices if return_indices.'''
+    if return_indices:
+        return np.flatnonzero(mask)
+    return {key: np.asarray(artist_info[key])[mask] for key in column_names(artist_info)}
+
+def get_active_artists(artist_info_dict, strict=False, reference_year: int=None, return_indices: bool=False) -> Dict[str, np.array]:
     '''Get artists from artist_info that fulfil both of the following:
     1. Have produced new music in the past five years
     2. If they're more than one years old, have an average of
@@ -228,49 +352,29 @@ def get_active_artists(artist_info_dict, strict=False) -> Dict[str, np.array]:
     args:
         artist_info_dict: dict or Pandas dataframe of artist information
         strict: bool, whether to use the stricter conditions
+        reference_year: year to count from (default: the current year)
+        return_indices: bool, return an array of row indices instead
     returns:
         dict of active artist information
     '''
 
-    required_keys = ['first_release', 'last_release', 'num_tracks', 'num_releases']
-    if not all(key in artist_info_dict.keys() for key in required_keys):
-        logger.critical(f"Missing required keys in artist_info: {required_keys}")
-        sys.exit(1)
-
-    cnd0 = np.array([num_releases > 0 for num_releases in artist_info_dict['num_releases']])
-    active_artist_info = {key: np.array(artist_info_dict[key])[cnd0] for key in artist_info_dict.keys()}
-
-    cnd1 = np.array([last_release > CURRENT_YEAR - 5 for last_release in active_artist_info['last_release']])
-    active_artist_info = {key: np.array(active_artist_info[key])[cnd1] for key in active_artist_info.keys()}
-
-    cnd2 = np.array([
-        (CURRENT_YEAR - first_release < 2) or (num_tracks > (CURRENT_YEAR - first_release) * 2)
-        for first_release, num_tracks
-        in zip(active_artist_info['first_release'], active_artist_info['num_tracks'])
-    ])
-    active_artist_info = {key: np.array(active_artist_info[key])[cnd2] for key in active_artist_info.keys()}
-
-    return active_artist_info
+    return select_artists(artist_info_dict, active_mask(artist_info_dict, reference_year), return_indices)
 
-def get_new_active_artists(artist_info_dict) -> Dict[str, np.array]:
+def get_new_active_artists(artist_info_dict, reference_year: int=None, return_indices: bool=False) -> Dict[str, np.array]:
     '''Get artists from artist_info that fulfil both of the following:
     1. Have a first release date in the past five years
     2. Have an average of two tracks per year since their first release
     args:
         artist_info_dict: dict or Pandas dataframe of artist information
+        reference_year: year to count from (default: the current year)
+        return_indices: bool, return an array of row indices instead
     returns:
         dict of new active artist information
     '''
 
-    active_artists = get_active_artists(artist_info_dict)
-    cnd_new = np.array(
-        [first_release > CURRENT_YEAR - 5 for first_release in active_artists['first_release']]
-    )
-    new_active_artists = {key: np.array(active_artists[key])[cnd_new] for key in active_artists.keys()}
-
-    return new_active_artists
+    return select_artists(artist_info_dict, new_active_mask(artist_info_dict, reference_year), return_indices)
 
-def get_legacy_artists(artist_info_dict) -> Dict[str, np.array]:
+def get_legacy_artists(artist_info_dict, reference_year: int=None, return_indices: bool=False) -> Dict[str, np.array]:
     '''Get artists from artist_info that fulfil all of the following:
     1. Have not produced new music in the past five years
     2. Have had more than 2 lifetime releases
@@ -278,32 +382,10 @@ def get_legacy_artists(artist_info_dict) -> Dict[str, np.array]:
     This returns artists that are no longer producing, but found success when they were.
     args:
         artist_info_dict: dict or Pandas dataframe of artist information
+        reference_year: year to count from (default: the current year)
+        return_indices: bool, return an array of row indices instead
     returns:
         dict of legacy artist information
     '''
 
-    required_keys = ['first_release', 'last_release', 'num_tracks', 'num_releases']
-    if not all(key in artist_info_dict.keys() for key in required_keys):
-        logger.critical(f"Missing required keys in artist_info: {required_keys}")
-        sys.exit(1)
-
-    cnd0 = np.array([num_releases > 0 for num_releases in artist_info_dict['num_releases']])
-    legacy_artist_info = {key: np.array(artist_info_dict[key])[cnd0] for key in artist_info_dict.keys()}
-
-    cnd1 = np.array([
-        num_releases > 2 and last_release < CURRENT_YEAR - 5 for num_releases, last_release
-        in zip(legacy_artist_info['num_releases'], legacy_artist_info['last_release'])
-    ])
-    legacy_artist_info = {key: np.array(legacy_artist_info[key])[cnd1] for key in legacy_artist_info.keys()}
-
-    cnd2 = np.array([
-        num_tracks >= 2.*(last_release - first_release) for first_release, last_release, num_tracks
-        in zip(
-            legacy_artist_info['first_release'],
-            legacy_artist_info['last_release'],
-            legacy_artist_info['num_tracks']
-        )
-    ])
-    legacy_artist_info = {key: np.array(legacy_artist_info[key])[cnd2] for key in legacy_artist_info.keys()}
-
-    return legacy_artist_info
\ No newline at end of file
+    return select_artists(artist_info_dict, legacy_mask(artist_info_dict, reference_year), return_indices)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import sqlite3
+import os, time, zlib
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any, Iterator
+
+from Webscrapers import get_scraper, parse_artist_page, match_genres
+from genre_matcher import get_matcher
+from settings import get_config
+
+'''
+Artist page records: each https://open.spotify.com/artist/{id} page is fetched once,
+and everything the pipeline needs from it (monthly listeners, bio) is extracted in
+one go and stored. The monthly-listener and bio-genre stages both read these records,
+so a page fetched by one stage is not fetched again by the other. Optionally, the
+zlib-compressed HTML is kept too, so that new fields can be re-extracted offline.
+'''
+
+config = get_config()
+CACHE_DIR = config['paths']['cache_dir']
+ARTIST_PAGES_FILE = config['filenames']['artist_pages']
+ARCHIVE_HTML = config['artist_pages']['archive_html']
+MONTHLY_LISTENERS_MAX_AGE_HOURS = config['artist_pages']['monthly_listeners_max_age_hours']
+
+class ArtistPageStore:
+    '''SQLite table of the fields extracted from each artist page, with the time the
+    page was fetched and, if archived, its compressed HTML.'''
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS artist_pages (
+            artist_id TEXT PRIMARY KEY,
+            monthly_listeners INTEGER,
+            bio TEXT,
+            html BLOB,
+            fetched_at REAL NOT NULL
+        )''')
+        self.conn.commit()
+
+    def get_many(self, artist_ids: List[str], max_age_hours: float=None) -> Dict[str, Dict[str, Any]]:
+        '''Stored records for the given artists, if fetched within max_age_hours
+        (any age if None).'''
+
+        oldest = 0. if max_age_hours is None else time.time() - max_age_hours*3600.
+        found = {}
+        artist_ids = list(dict.fromkeys(artist_ids))
+        for i in range(0, len(artist_ids), 500): # SQLite host-parameter limit
+            ids_batch = artist_ids[i:i + 500]
+            rows = self.conn.execute(
+                'SELECT artist_id, monthly_listeners, bio, fetched_at FROM artist_pages WHERE fetched_at >= ? AND artist_id IN ({:s})'.format(
+                    ','.join('?'*len(ids_batch))),
+                [oldest] + ids_batch
+            ).fetchall()
+            for artist_id, monthly_listeners, bio, fetched_at in rows:
+                found[artist_id] = {'monthly_listeners': monthly_listeners, 'bio': bio, 'fetched_at': fetched_at}
+        return found
+
+    def put_many(self, records: Dict[str, Dict[str, Any]]) -> None:
+        '''Store freshly extracted records, replacing older ones.'''
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO artist_pages VALUES (?, ?, ?, ?, ?)',
+                [(artist_id, record['monthly_listeners'], record['bio'], record.get('html'), record['fetched_at'])
+                 for artist_id, record in records.items()]
+            )
+
+    def reextract(self) -> int:
+        '''Re-run the page extraction over all archived HTML, e.g. after the page
+        layout or the extraction changes. Returns the number of records updated.'''
+
+        rows = self.conn.execute('SELECT artist_id, html FROM artist_pages WHERE html IS NOT NULL')
+        updates = []
+        for artist_id, html in rows:
+            record = parse_artist_page(zlib.decompress(html).decode('utf-8'))
+            updates.append((record['monthly_listeners'], record['bio'], artist_id))
+        with self.conn:
+            self.conn.executemany('UPDATE artist_pages SET monthly_listeners = ?, bio = ? WHERE artist_id = ?', updates)
+        logger.info(f'Re-extracted {len(updates)} archived artist pages.')
+        return len(updates)
+
+    def bios(self) -> Dict[str, str]:
+        rows = self.conn.execute('SELECT artist_id, bio FROM artist_pages WHERE bio IS NOT NULL').fetchall()
+        return dict(rows)
+
+def match_stored_bios(genres_to_find: List[str]) -> Dict[str, List[str]]:
+    '''Genres found in every stored bio, without fetching any pages.'''
+    bios = get_store().bios()
+    return dict(zip(bios.keys(), get_matcher(tuple(genres_to_find)).match_many(list(bios.values()))))
+
+def extract_record(html: str) -> Dict[str, Any]:
+    '''Extract a record from a freshly fetched page (runs in the scraper threads).'''
+    record = parse_artist_page(html)
+    record['fetched_at'] = time.time()
+    if ARCHIVE_HTML:
+        record['html'] = zlib.compress(html.encode('utf-8'))
+    return record
+
+store = None
+def get_store() -> ArtistPageStore:
+    '''The artist page store, opened on first use.'''
+    global store
+    if store is None:
+        store = ArtistPageStore(CACHE_DIR + ARTIST_PAGES_FILE)
+    return store
+
+def iter_artist_pages(artist_ids: List[str], genres_to_find: List[str]=None, max_age_hours: float=None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    '''Stream (artist_id, record) for each artist, with record None if the page could
+    not be loaded. Records stored within max_age_hours (any age if None) come first,
+    then the remaining pages are fetched concurrently and stored in batches of 100.
+    Each record has the keys 'monthly_listeners', 'bio' and 'fetched_at', and
+    'genres' if genres_to_find is given.'''
+
+    found = get_store().get_many(artist_ids, max_age_hours)
+    missing = [artist_id for artist_id in dict.fromkeys(artist_ids) if artist_id not in found]
+    logger.info(f'Artist pages: {len(found)} of {len(found) + len(missing)} from store.')
+
+    def with_genres(record: Dict[str, Any]) -> Dict[str, Any]:
+        if record is not None and genres_to_find is not None:
+            record['genres'] = match_genres(record['bio'], genres_to_find)
+        return record
+
+    for artist_id, record in found.items():
+        yield artist_id, with_genres(record)
+
+    fetched = {}
+    try:
+        for artist_id, record in get_scraper().scrape_many(missing, extract_record):
+            if record is not None:
+                fetched[artist_id] = record
+                if len(fetched) >= 100:
+                    get_store().put_many(fetched)
+                    fetched = {}
+                record = {key: value for key, value in record.items() if key != 'html'}
+            yield artist_id, with_genres(record)
+    finally:
+        get_store().put_many(fetched)
@@ -0,0 +1,85 @@
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+
+import os, sys, json, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run_e2e import REPO_DIR, make_config
+
+'''
+Check of import_MusicBrainz_dump.py against a small sample dump in fixtures/, in
+the format of the MusicBrainz JSON dumps: one artist per line, with aliases and URL
+relations. The sample also holds an alias equal to the artist's name, a relation
+that is not a Spotify URL, and two lines that cannot be imported (truncated JSON,
+and an artist without a name). Both the plain and the gzipped sample are imported,
+each into a fresh names store in a temporary directory, and the stored names,
+MBIDs, aliases and Spotify IDs are compared with those expected.
+
+    python benchmarks/check_MusicBrainz_dump_import.py
+'''
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SAMPLE_DUMPS = ['MusicBrainz_artist_dump_sample.jsonl', 'MusicBrainz_artist_dump_sample.jsonl.gz']
+
+EXPECTED_ARTISTS = {
+    ('5b11f4ce-a62d-471e-81fc-a69a8278c7da', 'Nirvana'),
+    ('a74b1b7f-71a5-4011-9441-d0b5e4122711', 'Radiohead'),
+    ('b10bbbfc-cf9e-42e0-be17-e2c3e1d2600d', 'The Beatles'),
+    ('f27ec8db-af05-4f36-916e-3d57f91ecf5e', 'Michael Jackson')
+}
+EXPECTED_ALIASES = {
+    ('5b11f4ce-a62d-471e-81fc-a69a8278c7da', 'Nirvana US'),
+    ('a74b1b7f-71a5-4011-9441-d0b5e4122711', 'On a Friday'),
+    ('f27ec8db-af05-4f36-916e-3d57f91ecf5e', 'マイケル・ジャクソン')
+}
+EXPECTED_SPOTIFY_IDS = {
+    ('5b11f4ce-a62d-471e-81fc-a69a8278c7da', '6olE6TJLqED3rqDCT0FyPh'),
+    ('a74b1b7f-71a5-4011-9441-d0b5e4122711', '4Z8W4fKeB5YxbusRsdQVPb')
+}
+
+def check_import(dump: str, store) -> List[str]:
+    '''Import a sample dump into an empty names store, and list what differs from
+    the expected contents.'''
+    import import_MusicBrainz_dump as imd
+
+    imd.import_dump(os.path.join(FIXTURES_DIR, dump), processes=2, chunk_lines=2)
+    stored = {
+        'artists': (set(store.conn.execute('SELECT mbid, name FROM artists')), EXPECTED_ARTISTS),
+        'aliases': (set(store.conn.execute('SELECT mbid, alias FROM aliases')), EXPECTED_ALIASES),
+        'spotify_ids': (set(store.conn.execute('SELECT mbid, spotify_id FROM spotify_ids')), EXPECTED_SPOTIFY_IDS)
+    }
+    sources = set(source for source, in store.conn.execute('SELECT source FROM artists'))
+
+    problems = []
+    for table, (found, expected) in stored.items():
+        if found != expected:
+            problems.append(f"{dump}: {table} missing {sorted(expected - found)}, unexpected {sorted(found - expected)}")
+    if sources != {'dump'}:
+        problems.append(f"{dump}: artists stored with sources {sorted(sources)}, expected only 'dump'")
+    return problems
+
+if __name__ == "__main__":
+    problems = []
+    with tempfile.TemporaryDirectory(prefix='serch-dump-') as tmp_dir:
+        config = make_config(tmp_dir, 'http://localhost', real_rate_limits=False)
+        config_path = tmp_dir + '/config.json'
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=2)
+        os.environ['SERCH_CONFIG'] = config_path
+        sys.path.insert(0, REPO_DIR)
+        from build_MusicBrainz_names_database import get_names_store
+
+        for dump in SAMPLE_DUMPS:
+            store = get_names_store()
+            with store.conn:
+                for table in ['artists', 'aliases', 'spotify_ids']:
+                    store.conn.execute(f'DELETE FROM {table}')
+            problems.extend(check_import(dump, store))
+            store.conn.close()
+
+    if len(problems) > 0:
+        logger.critical("MusicBrainz dump import check failed:\n" + "\n".join(problems))
+        sys.exit(1)
+    logger.info(f"MusicBrainz dump import check passed for {', '.join(SAMPLE_DUMPS)}.")
@@ -0,0 +1,54 @@
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from genre_matcher import GenreMatcher, get_matcher
+
+'''
+Check of genre_matcher.py on bios that need care: whole-word matches at punctuation
+and across runs of whitespace, overlapping genres, and case folding beyond ASCII,
+where the regex and str.lower() disagree (Turkish dotted capital I, long s). Every
+bio must give exactly the expected genres, and no bio may raise.
+
+    python benchmarks/check_genre_matcher.py
+'''
+
+VOCABULARY = [' hip hop ', ' hip ', ' soul ', ' new wave ', ' wave ', ' r&b ', ' pop ']
+
+CASES = [
+    ("Türk HİP HOP sanatçısı", [' hip hop ', ' hip ']),
+    ("ſoul music", [' soul ']),
+    ("ſOUL and İstanbul pop", [' soul ', ' pop ']),
+    ("HIP   HOP\nand R&B.", [' hip hop ', ' hip ', ' r&b ']),
+    ("new wave, then wave-pop", [' new wave ', ' wave ', ' pop ']),
+    ("hiphop popular soulful", []),
+    ("", [])
+]
+
+if __name__ == "__main__":
+    problems = []
+    matchers = [GenreMatcher(VOCABULARY)]
+    for bio, expected in CASES:
+        try:
+            found = matchers[0].match(bio)
+        except Exception as e:
+            problems.append(f"{bio!r}: raised {e!r}")
+            continue
+        if found != expected:
+            problems.append(f"{bio!r}: found {found}, expected {expected}")
+
+    '''The configured vocabulary must not raise on any of the bios either'''
+    for bio, _ in CASES:
+        try:
+            get_matcher().match(bio)
+        except Exception as e:
+            problems.append(f"{bio!r}: configured vocabulary raised {e!r}")
+
+    if len(problems) > 0:
+        logger.critical("Genre matcher check failed:\n" + "\n".join(problems))
+        sys.exit(1)
+    logger.info(f"Genre matcher check passed for {len(CASES)} bios.")
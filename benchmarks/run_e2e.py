@@ -0,0 +1,200 @@
+import argparse, logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+
+import os, sys, json, time, pickle, tempfile, subprocess, urllib.request
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from spotify_standin import start_standin, make_id
+
+'''
+End-to-end benchmarks of the pipelines against the local Spotify stand-in (see
+spotify_standin.py). Each benchmark gets a fresh temporary directory holding a copy
+of config.json that points all paths there and all Spotify URLs at the stand-in,
+seeds the input tables, and runs the pipeline function in a subprocess, exactly as
+a job would. Reported per benchmark: wall time, items per second and requests per
+item, in total and per endpoint (as counted by the stand-in).
+
+Unless --real-rate-limits is given, the client and scraper rate limits are lifted
+and the request budget stages are unpaced, so that the benchmarks measure the code
+rather than the configured limits. Use --latency-ms and --rate-429 to make the
+stand-in behave more like the real service, or --replay to serve a recording.
+
+    python benchmarks/run_e2e.py --items 200 --latency-ms 50 --output results.json
+
+Note that gather_artist_info_last_24hrs is not benchmarked: it reads a pickle of
+monthly listeners that nothing writes. The editorial benchmark runs the daily steps
+that do chain together, from the playlist table to the track info table.
+'''
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_MARKER = 'E2E_RESULT '
+CURRENT_DATE = datetime.now().strftime("%Y-%m-%d")
+
+def make_config(tmp_dir: str, base_url: str, real_rate_limits: bool) -> Dict[str, Any]:
+    with open(os.path.join(REPO_DIR, 'config.json')) as f:
+        config = json.load(f)
+    config['paths'] = {
+        'output_dir': tmp_dir + '/output/',
+        'editorial_output_dir': tmp_dir + '/output/Editorial-playlists/',
+        'cache_dir': tmp_dir + '/cache/'
+    }
+    config['spotify_client']['api_url'] = base_url + '/v1/'
+    config['spotify_client']['token_url'] = base_url + '/api/token'
+    config['scraper']['artist_url'] = base_url + '/artist/{:s}'
+    if not real_rate_limits:
+        for section in ['spotify_client', 'scraper']:
+            config[section]['requests_per_second'] = 1000.
+            config[section]['burst'] = 1000
+        for stage in config['request_budget']['stages'].values():
+            stage['paced'] = False
+    for path in config['paths'].values():
+        os.makedirs(path, exist_ok=True)
+    return config
+
+'''Seeding of the input tables of each benchmark, for num_items items'''
+
+def seed_musicbrainz_names(config: Dict[str, Any], num_items: int) -> None:
+    names = ['standin artist {:d}'.format(i) for i in range(2*num_items)]
+    pd.DataFrame({'artist_name': names}).to_csv(config['paths']['output_dir'] + config['filenames']['artist_names'], index=False)
+
+def seed_artist_ids(config: Dict[str, Any], num_items: int) -> None:
+    pd.DataFrame({
+        'names': ['standin artist {:d}'.format(i) for i in range(num_items)],
+        'ids': [make_id('artist', 'standin artist {:d}'.format(i)) for i in range(num_items)]
+    }).to_csv(config['paths']['output_dir'] + config['filenames']['artist_ids'], index=False)
+
+def seed_track_ids(config: Dict[str, Any], num_items: int) -> None:
+    pd.DataFrame({
+        'ids': [make_id('artist', 'standin artist {:d}'.format(i)) for i in range(num_items)],
+        'names': ['standin artist {:d}'.format(i) for i in range(num_items)],
+        'track_ids': [make_id('track', 'standin track {:d}'.format(i)) for i in range(num_items)]
+    }).to_csv(config['paths']['output_dir'] + config['filenames']['rand_track_ids'], index=False)
+
+def seed_editorial_playlists(config: Dict[str, Any], num_items: int) -> None:
+    '''About num_items artists: the stand-in's playlists hold 120 tracks on average
+    (many over one page), a third of them added in the last 24 hours.'''
+    num_playlists = max(1, num_items//40)
+    pd.DataFrame({
+        'playlist_id': [make_id('playlist', 'standin editorial', i) for i in range(num_playlists)],
+        'playlist_name': ['Standin Editorial {:d}'.format(i) for i in range(num_playlists)]
+    }).to_csv(config['paths']['editorial_output_dir'] + "Playlist_names-IDs_{:s}.csv".format(CURRENT_DATE), index=False)
+
+'''Pipeline run by each benchmark in the subprocess: statements, and an expression
+for the number of items it processed'''
+BENCHMARKS = {
+    'musicbrainz_id_search': (seed_musicbrainz_names, '''
+import MusicBrainz_ArtistNames_IDs as mb
+mb.extend_sample_MusicBrainz_artist_ids(num_artist_names=NUM_ITEMS)
+''', 'NUM_ITEMS'),
+    'artist_info': (seed_artist_ids, '''
+import MusicBrainz_artist_track_info as mbt
+mbt.get_artist_info(NUM_ITEMS)
+''', 'NUM_ITEMS'),
+    'track_info': (seed_track_ids, '''
+import MusicBrainz_artist_track_info as mbt
+mbt.generate_track_info_for_artists(NUM_ITEMS)
+''', 'NUM_ITEMS'),
+    'editorial_daily': (seed_editorial_playlists, '''
+import Editorial_playlists_info as epi
+epi.pickle_1000_artists_last_24hrs()
+epi.scrape_monthly_listeners_for_pickled_artists()
+epi.get_artist_info_for_pickled_artists()
+epi.get_save_track_info_for_pickled_tracks()
+''', '''len(pickle.load(open(epi.OUTPUT_DIR + "artists_last_24hrs_{:s}.pkl".format(epi.CURRENT_DATE), "rb"))['ids'])''')
+}
+
+WORKER = '''
+import json, pickle, time
+NUM_ITEMS = {num_items:d}
+start_time = time.perf_counter()
+{statements}
+seconds = time.perf_counter() - start_time
+print({marker!r} + json.dumps({{'seconds': seconds, 'items': {items}}}))
+'''
+
+def fetch_json(url: str, data: bytes=None) -> Dict[str, Any]:
+    with urllib.request.urlopen(url, data=data) as response:
+        return json.loads(response.read())
+
+def run_benchmark(name: str, base_url: str, num_items: int, real_rate_limits: bool, verbose: bool) -> Dict[str, Any]:
+    seed, statements, items = BENCHMARKS[name]
+    with tempfile.TemporaryDirectory(prefix='serch-e2e-') as tmp_dir:
+        config = make_config(tmp_dir, base_url, real_rate_limits)
+        config_path = tmp_dir + '/config.json'
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=2)
+        seed(config, num_items)
+
+        env = dict(os.environ, SERCH_CONFIG=config_path, PYTHONPATH=REPO_DIR,
+                   SPOTIPY_CLIENT_ID=os.environ.get('SPOTIPY_CLIENT_ID', 'standin'),
+                   SPOTIPY_CLIENT_SECRET=os.environ.get('SPOTIPY_CLIENT_SECRET', 'standin'))
+        code = WORKER.format(num_items=num_items, statements=statements, items=items, marker=RESULT_MARKER)
+        fetch_json(base_url + '/_reset', data=b'')
+        completed = subprocess.run(
+            [sys.executable, '-c', code], cwd=tmp_dir, env=env, text=True,
+            stdout=subprocess.PIPE, stderr=None if verbose else subprocess.PIPE
+        )
+        stats = fetch_json(base_url + '/_stats')
+
+    if completed.returncode != 0:
+        logger.critical(f"Benchmark {name} failed:\n{completed.stderr}")
+        sys.exit(1)
+    result = json.loads(next(line for line in completed.stdout.splitlines() if line.startswith(RESULT_MARKER))[len(RESULT_MARKER):])
+
+    counters = ['requests', 'bytes_sent', 'injected_429', 'replay_misses', 'token']
+    endpoints = {endpoint: count for endpoint, count in stats.items() if endpoint not in counters}
+    per_item = lambda count: count/result['items'] if result['items'] > 0 else None
+    return {
+        'benchmark': name,
+        'items': result['items'],
+        'seconds': result['seconds'],
+        'items_per_second': result['items']/result['seconds'],
+        'requests': stats.get('requests', 0),
+        'requests_per_item': per_item(stats.get('requests', 0)),
+        'requests_per_item_by_endpoint': {endpoint: per_item(count) for endpoint, count in sorted(endpoints.items())},
+        'token_requests': stats.get('token', 0),
+        'injected_429': stats.get('injected_429', 0),
+        'replay_misses': stats.get('replay_misses', 0),
+        'bytes_received': stats.get('bytes_sent', 0)
+    }
+
+def print_result(result: Dict[str, Any]) -> None:
+    print("{:s}: {:d} items in {:.2f}s, {:.1f} items/s, {:.2f} requests/item ({:d} 429s)".format(
+        result['benchmark'], result['items'], result['seconds'], result['items_per_second'],
+        result['requests_per_item'] or 0., result['injected_429']))
+    for endpoint, per_item in result['requests_per_item_by_endpoint'].items():
+        print("    {:<20s} {:.3f} requests/item".format(endpoint, per_item))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmarks against a local Spotify stand-in.")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--items", type=int, default=100, help="items per benchmark")
+    parser.add_argument("--latency-ms", type=float, default=0., help="stand-in delay before every response")
+    parser.add_argument("--rate-429", type=float, default=0., help="fraction of requests the stand-in answers with 429")
+    parser.add_argument("--replay", help="serve this recording (see spotify_standin.py --record) instead of synthetic data")
+    parser.add_argument("--real-rate-limits", action="store_true", help="keep the configured rate limits and pacing")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the pipelines' logs")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if len(unknown) > 0:
+        logger.critical(f"Unknown benchmarks: {unknown}. Choose from {list(BENCHMARKS)}.")
+        sys.exit(1)
+
+    server = start_standin(latency_ms=args.latency_ms, rate_429=args.rate_429, replay=args.replay)
+    results = []
+    for name in args.benchmarks:
+        results.append(run_benchmark(name, server.base_url, args.items, args.real_rate_limits, args.verbose))
+        print_result(results[-1])
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'items': args.items, 'latency_ms': args.latency_ms, 'rate_429': args.rate_429,
+                       'replay': args.replay, 'results': results}, f, indent=2)
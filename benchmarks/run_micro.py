@@ -0,0 +1,365 @@
+import argparse, logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any, Callable
+
+import os, sys, json, math, time, shutil, tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from spotify_standin import SyntheticCatalogue, make_id
+
+'''
+Micro-benchmarks of the CPU-bound paths: building the info containers from API
+payloads, the artist classifiers, the cleaning and sampling of the MusicBrainz name
+universe, bio genre matching, and the release-date and monthly-listener joins of
+the analysis notebooks (reproduced here as written in the notebooks, since those
+cannot be imported). All inputs come from the synthetic data generators below, with
+a fixed seed; API payloads come from the same synthetic catalogue as the local
+stand-in (spotify_standin.py).
+
+Each benchmark is timed (best of --repeats) at a quarter, a half and all of its
+full size, and the slope of log time against log size gives its scaling exponent:
+about 1 for linear paths, 2 for quadratic ones. Sizes are chosen so that the term
+that decides the scaling dominates the fixed per-row costs; e.g. the featured-track
+join scans a table of millions of tracks for a few hundred artists, so it reports
+its n·m scan as about n^2. At a small --scale the exponents are closer to 1.
+Results are compared with the stored baselines
+(benchmarks/micro_baselines.json), and the run fails if a benchmark got slower by
+more than --threshold, or if its scaling exponent rose by more than
+--exponent-threshold (which catches a quadratic path coming back, on any machine).
+
+    python benchmarks/run_micro.py                      # compare with the baselines
+    python benchmarks/run_micro.py --scale 0.1 active_artists legacy_artists
+    python benchmarks/run_micro.py --save-baseline      # after an intended change
+
+Baselines are kept per scale, so runs at a smaller --scale are compared only with
+baselines saved at that scale.
+'''
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+BASELINES_FILE = os.path.join(BENCHMARK_DIR, 'micro_baselines.json')
+SEED = 42
+
+def setup_environment(tmp_dir: str) -> None:
+    '''Point all paths of a copy of config.json at tmp_dir, before any repo module
+    reads it.'''
+    with open(os.path.join(REPO_DIR, 'config.json')) as f:
+        config = json.load(f)
+    config['paths'] = {key: tmp_dir + '/' + key + '/' for key in config['paths']}
+    for path in config['paths'].values():
+        os.makedirs(path, exist_ok=True)
+    with open(tmp_dir + '/config.json', 'w') as f:
+        json.dump(config, f, indent=2)
+    os.environ['SERCH_CONFIG'] = tmp_dir + '/config.json'
+    sys.path.insert(0, REPO_DIR)
+
+'''Synthetic data generators'''
+
+def synthetic_artist_table(num: int, seed: int=SEED) -> pd.DataFrame:
+    '''Artist info table, as in Spotify_artist_info.csv.'''
+    rng = np.random.default_rng(seed)
+    first_release = rng.integers(1960, 2026, num)
+    num_releases = rng.integers(0, 40, num)
+    return pd.DataFrame({
+        'ids': ['{:022d}'.format(i) for i in range(num)],
+        'names': ['artist {:d}'.format(i) for i in range(num)],
+        'popularity': rng.integers(0, 100, num),
+        'followers': rng.integers(0, 10**6, num),
+        'genres': rng.choice(['', 'indie pop', 'hip hop, rap', 'jazz'], num),
+        'first_release': np.where(num_releases > 0, first_release, -1),
+        'last_release': np.where(num_releases > 0, np.minimum(2026, first_release + rng.integers(0, 30, num)), -1),
+        'num_releases': num_releases,
+        'num_tracks': num_releases*rng.integers(1, 12, num)
+    })
+
+def synthetic_artist_names(num: int, seed: int=SEED) -> List[str]:
+    '''MusicBrainz-style names: mixed case and diacritics, with some duplicates,
+    empty and bracketed names.'''
+    rng = np.random.default_rng(seed)
+    words = np.array(['the', 'Black', 'Beyoncé', 'ØRKEN', 'los', 'Señor', 'band', 'DJ', 'quartet', 'Ümlaut', 'trio', 'Åsa'])
+    picks = rng.integers(0, len(words), (num, 3))
+    names = [' '.join(words[pick]) + ' {:d}'.format(i) for i, pick in enumerate(picks.tolist())]
+    for i in rng.integers(0, num, num//50).tolist():
+        names[i] = names[i//2] # duplicates
+    for i in rng.integers(0, num, num//200).tolist():
+        names[i] = '[unknown] {:d}'.format(i)
+    for i in rng.integers(0, num, num//500).tolist():
+        names[i] = ''
+    return names
+
+def synthetic_track_payloads(num: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    '''tracks and audio_features payloads, as returned by the API.'''
+    catalogue = SyntheticCatalogue()
+    track_ids = [make_id('micro track', i) for i in range(num)]
+    return [catalogue.track(track_id) for track_id in track_ids], [catalogue.audio_features(track_id) for track_id in track_ids]
+
+def synthetic_artist_payloads(num: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    '''artists payloads, and the full artist_albums listing of each artist.'''
+    catalogue = SyntheticCatalogue()
+    artist_ids = [make_id('micro artist', i) for i in range(num)]
+    artists_albums = []
+    for artist_id in artist_ids:
+        albums = [catalogue.simple_album(album_id) for album_id in catalogue.album_ids(artist_id)]
+        artists_albums.append({'items': albums, 'total': len(albums), 'next': None})
+    return [catalogue.artist(artist_id) for artist_id in artist_ids], artists_albums
+
+def synthetic_bios(num: int, seed: int=SEED) -> List[str]:
+    rng = np.random.default_rng(seed)
+    fillers = ['An artist from Leeds,', 'recording since 2009,', 'known for', 'blending', 'with', 'and a touch of', 'live shows.']
+    genres = ['hip hop', 'indie', 'new wave', 'lo fi', 'Singer-Songwriter', 'classical', 'drum and bass', 'rock']
+    return [
+        ' '.join(rng.choice(fillers, 6).tolist() + rng.choice(genres, 3).tolist()) + '.' if i % 4 else ''
+        for i in range(num)
+    ]
+
+def synthetic_track_table(num: int, num_artists: int, seed: int=SEED) -> pd.DataFrame:
+    '''Track info table, as in track_info_last_24hrs_{date}.csv, with release dates
+    at day, month and year precision.'''
+    rng = np.random.default_rng(seed)
+    years, months, days = rng.integers(1970, 2026, num), rng.integers(1, 13, num), rng.integers(1, 29, num)
+    precision = rng.integers(0, 10, num)
+    release_date = [
+        '{:d}-{:02d}-{:02d}'.format(y, m, d) if p > 1 else '{:d}-{:02d}'.format(y, m) if p == 1 else '{:d}'.format(y)
+        for y, m, d, p in zip(years.tolist(), months.tolist(), days.tolist(), precision.tolist())
+    ]
+    artists = rng.integers(0, 2*num_artists, (num, 2)) # half of the artists have no listeners
+    return pd.DataFrame({
+        'ids': ['{:022d}'.format(i) for i in range(num)],
+        'artists': [
+            '{:022d}'.format(a) if i % 3 else '{:022d}, {:022d}'.format(a, b)
+            for i, (a, b) in enumerate(artists.tolist())
+        ],
+        'release_date': release_date
+    })
+
+def synthetic_listeners_table(num_artists: int, seed: int=SEED) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'ids': ['{:022d}'.format(i) for i in range(num_artists)],
+        'monthly_listeners': rng.integers(0, 10**7, num_artists).astype(float)
+    }).set_index('ids')
+
+'''The notebook joins, as written in Editorial-tracks_dstrbns.ipynb and
+Combine_editorial_data.ipynb'''
+
+def notebook_days_since_release(df: pd.DataFrame) -> List[int]:
+    days_since_release = []
+    for date in df.release_date:
+        try:
+            days_since_release.append((datetime.now() - datetime.strptime(date, '%Y-%m-%d')).days)
+        except ValueError:
+            try:
+                days_since_release.append((datetime.now() - datetime.strptime(date, '%Y-%m')).days)
+            except ValueError:
+                days_since_release.append((datetime.now() - datetime.strptime(date, '%Y')).days)
+    return days_since_release
+
+def notebook_listener_join(df: pd.DataFrame, df_mnth_lstnrs: pd.DataFrame) -> List[float]:
+    monthly_listeners = []
+    for ids in df.artists:
+        monthly_listeners_ = []
+        for id in ids.replace(" ", "").split(','):
+            try:
+                val = df_mnth_lstnrs.loc[id].values[0]
+            except KeyError:
+                val = -1
+            monthly_listeners_.append(val)
+        monthly_listeners.append(max(monthly_listeners_))
+    return monthly_listeners
+
+def notebook_featured_track_join(artist_info_df: pd.DataFrame, track_ids_df: pd.DataFrame) -> List[str]:
+    feat_track_ids = [np.nan]*len(artist_info_df)
+    for i in range(len(artist_info_df)):
+        artist_id = artist_info_df['ids'].iloc[i]
+        track_ids = track_ids_df[track_ids_df['artist_ids'] == artist_id]['track_ids'].values
+        if len(track_ids) > 0:
+            feat_track_ids[i] = ', '.join(track_ids)
+    return feat_track_ids
+
+'''Benchmarks: name -> (full size, setup). setup(size) prepares the inputs, untimed,
+and returns the function to time.'''
+BENCHMARKS = {}
+
+def benchmark(size: int) -> Callable:
+    def register(setup: Callable[[int], Callable[[], Any]]) -> Callable[[int], Callable[[], Any]]:
+        BENCHMARKS[setup.__name__] = (size, setup)
+        return setup
+    return register
+
+@benchmark(50000)
+def track_info_dict(size: int) -> Callable[[], Any]:
+    import track_info_helper as tih
+    tracks_info, tracks_audio_info = synthetic_track_payloads(size)
+    return lambda: tih.TrackInfoDict(tracks_info, tracks_audio_info).to_pandas()
+
+@benchmark(20000)
+def artist_info_dict(size: int) -> Callable[[], Any]:
+    import artist_info_helper as aih
+    artists_info, artists_albums = synthetic_artist_payloads(size)
+    def run():
+        artist_info = aih.ArtistInfoDict()
+        artist_info.append_artists_info(artists_info, artists_albums)
+        return artist_info.to_pandas()
+    return run
+
+@benchmark(1000000)
+def active_artists(size: int) -> Callable[[], Any]:
+    import artist_info_helper as aih
+    artist_info = synthetic_artist_table(size)
+    return lambda: aih.get_active_artists(artist_info, reference_year=2025)
+
+@benchmark(1000000)
+def legacy_artists(size: int) -> Callable[[], Any]:
+    import artist_info_helper as aih
+    artist_info = synthetic_artist_table(size)
+    return lambda: aih.get_legacy_artists(artist_info, reference_year=2025)
+
+@benchmark(2000000)
+def clean_artist_names(size: int) -> Callable[[], Any]:
+    import name_universe
+    names = pd.Series(synthetic_artist_names(size), name='artist_name')
+    return lambda: name_universe.clean_artist_names(names)
+
+@benchmark(2000000)
+def load_clean_artist_names(size: int) -> Callable[[], Any]:
+    '''Loading from the artifact, which is built in the setup.'''
+    import MusicBrainz_ArtistNames_IDs as mb
+    pd.DataFrame({'artist_name': synthetic_artist_names(size)}).to_csv(mb.OUTPUT_DIR + mb.ARTIST_NAMES_FILE, index=False)
+    shutil.rmtree(mb.config['paths']['cache_dir'] + 'name_universe/', ignore_errors=True)
+    mb.load_clean_artist_names()
+    return mb.load_clean_artist_names
+
+@benchmark(100000)
+def only_new_names(size: int) -> Callable[[], Any]:
+    '''Taking size new names from a universe of 4*size, where every other name
+    among the last 2*size is already in the ledger.'''
+    import MusicBrainz_ArtistNames_IDs as mb
+    from stage_ledger import get_ledger
+    names = ['micro name {:d}.{:d}'.format(size, i) for i in range(4*size)]
+    get_ledger().add('search', names[-2*size::2])
+    return lambda: mb.only_new_names(list(names), size)
+
+@benchmark(100000)
+def bio_genre_matching(size: int) -> Callable[[], Any]:
+    from genre_matcher import get_matcher, GENRES
+    bios, matcher = synthetic_bios(size), get_matcher(tuple(GENRES))
+    return lambda: matcher.match_many(bios)
+
+@benchmark(100000)
+def notebook_release_dates(size: int) -> Callable[[], Any]:
+    df = synthetic_track_table(size, size//2)
+    return lambda: notebook_days_since_release(df)
+
+@benchmark(50000)
+def notebook_listeners(size: int) -> Callable[[], Any]:
+    df, df_mnth_lstnrs = synthetic_track_table(size, size//2), synthetic_listeners_table(size//2)
+    return lambda: notebook_listener_join(df, df_mnth_lstnrs)
+
+@benchmark(4800000)
+def notebook_featured_tracks(size: int) -> Callable[[], Any]:
+    '''size track rows, for size/24000 artists: the scan of the track table for each
+    artist (about 4 ns per track) has to outweigh pandas' overhead per artist (about
+    0.2 ms) at every size timed, or the join looks linear. Track rows refer to a pool
+    of size/100 ID strings, to keep millions of rows small in memory and to keep the
+    tracks found for each artist at about 100.'''
+    rng = np.random.default_rng(SEED)
+    num_artists = max(1, size//24000)
+    artist_ids = np.array(['{:022d}'.format(i) for i in range(max(num_artists, size//100))], dtype=object)
+    artist_info_df = pd.DataFrame({'ids': artist_ids[:num_artists]})
+    track_ids_df = pd.DataFrame({
+        'artist_ids': artist_ids[rng.integers(0, len(artist_ids), size)],
+        'track_ids': artist_ids[rng.integers(0, len(artist_ids), size)]
+    })
+    return lambda: notebook_featured_track_join(artist_info_df, track_ids_df)
+
+def time_benchmark(setup: Callable[[int], Callable[[], Any]], size: int, repeats: int) -> float:
+    '''Best time of repeats runs, in seconds.'''
+    run, best = setup(size), math.inf
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+def run_benchmark(name: str, scale: float, repeats: int) -> Dict[str, Any]:
+    full_size, setup = BENCHMARKS[name]
+    size = max(4, int(full_size*scale))
+    sizes = [size//4, size//2, size]
+    times = [time_benchmark(setup, n, repeats) for n in sizes]
+    exponent = np.polyfit(np.log(sizes), np.log(np.maximum(times, 1e-9)), 1)[0]
+    return {
+        'size': size,
+        'seconds': times[-1],
+        'per_item_us': 1e6*times[-1]/size,
+        'exponent': float(exponent)
+    }
+
+def check_regression(name: str, result: Dict[str, Any], baseline: Dict[str, Any], threshold: float, exponent_threshold: float) -> List[str]:
+    '''Descriptions of how result regressed from baseline (none if it did not).'''
+    regressions = []
+    if result['seconds'] > baseline['seconds']*(1. + threshold):
+        regressions.append("{:s}: {:.3f}s against a baseline of {:.3f}s (+{:.0f}%)".format(
+            name, result['seconds'], baseline['seconds'], 100.*(result['seconds']/baseline['seconds'] - 1.)))
+    if result['exponent'] > baseline['exponent'] + exponent_threshold:
+        regressions.append("{:s}: scales as n^{:.2f}, against n^{:.2f} in the baseline".format(
+            name, result['exponent'], baseline['exponent']))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the CPU-bound paths, with regression checks.")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--scale", type=float, default=1., help="fraction of the full input sizes")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per size, the best is kept")
+    parser.add_argument("--threshold", type=float, default=0.5, help="allowed slowdown against the baseline")
+    parser.add_argument("--exponent-threshold", type=float, default=0.4, help="allowed rise of the scaling exponent")
+    parser.add_argument("--baselines", default=BASELINES_FILE, help="baselines file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if len(unknown) > 0:
+        logger.critical(f"Unknown benchmarks: {unknown}. Choose from {list(BENCHMARKS)}.")
+        sys.exit(1)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    scale_key = '{:g}'.format(args.scale)
+    scale_baselines = baselines.setdefault(scale_key, {})
+
+    tmp_dir = tempfile.mkdtemp(prefix='serch-micro-')
+    setup_environment(tmp_dir)
+    logging.getLogger().setLevel(logging.WARNING) # the pipelines' progress logs
+    logger.setLevel(logging.INFO)
+    results, regressions = {}, []
+    try:
+        for name in args.benchmarks:
+            results[name] = result = run_benchmark(name, args.scale, args.repeats)
+            baseline = scale_baselines.get(name)
+            line = "{:<26s} n={:<8d} {:9.4f}s {:9.3f}us/item  n^{:.2f}".format(
+                name, result['size'], result['seconds'], result['per_item_us'], result['exponent'])
+            if baseline is not None:
+                line += "  (baseline {:.4f}s, n^{:.2f})".format(baseline['seconds'], baseline['exponent'])
+                regressions.extend(check_regression(name, result, baseline, args.threshold, args.exponent_threshold))
+            print(line, flush=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'scale': args.scale, 'results': results}, f, indent=2)
+    if args.save_baseline:
+        scale_baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        logger.info(f"Saved baselines for {len(results)} benchmarks to {args.baselines}.")
+    elif len(regressions) > 0:
+        logger.critical("Regressions:\n    " + "\n    ".join(regressions))
+        sys.exit(1)
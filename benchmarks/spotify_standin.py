@@ -0,0 +1,438 @@
+import argparse, logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+
+import os, re, json, time, random, string, hashlib, threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote
+
+'''
+Local stand-in for the parts of the Spotify Web API (and the open.spotify.com artist
+pages) that the pipelines use, so that they can be run and benchmarked without
+credentials or quota. Point a config at it (spotify_client.api_url, token_url and
+scraper.artist_url; see run_e2e.py) and run the pipelines as usual.
+
+Modes:
+    synthetic (default)  a deterministic synthetic catalogue: every ID and search
+                         query gets the same answer every time, with pagination
+                         as in the real API
+    --record FILE        forward every request to Spotify and append the responses
+                         to FILE (JSON lines), e.g. to capture a real session
+    --replay FILE        answer from a recording; unrecorded requests get a 404
+
+In every mode, --latency-ms delays each response and --rate-429 answers that
+fraction of requests with 429 and a Retry-After header, as Spotify does when
+rate limiting. Request counts per endpoint are served at /_stats (and reset by a
+POST to /_reset).
+'''
+
+UPSTREAMS = {
+    '/v1/': 'https://api.spotify.com/v1/',
+    '/api/token': 'https://accounts.spotify.com/api/token',
+    '/artist/': 'https://open.spotify.com/artist/'
+}
+
+'''Endpoint name (as the spotipy method) of each route'''
+ROUTES = [
+    (re.compile(r'^/api/token$'), 'token'),
+    (re.compile(r'^/v1/search$'), 'search'),
+    (re.compile(r'^/v1/artists$'), 'artists'),
+    (re.compile(r'^/v1/artists/(\w+)/albums$'), 'artist_albums'),
+    (re.compile(r'^/v1/albums$'), 'albums'),
+    (re.compile(r'^/v1/albums/(\w+)/tracks$'), 'album_tracks'),
+    (re.compile(r'^/v1/tracks$'), 'tracks'),
+    (re.compile(r'^/v1/audio-features$'), 'audio_features'),
+    (re.compile(r'^/v1/playlists/(\w+)$'), 'playlist'),
+    (re.compile(r'^/v1/playlists/(\w+)/(?:tracks|items)$'), 'playlist_items'),
+    (re.compile(r'^/v1/browse/categories$'), 'categories'),
+    (re.compile(r'^/v1/browse/categories/([\w-]+)/playlists$'), 'category_playlists'),
+    (re.compile(r'^/v1/markets$'), 'available_markets'),
+    (re.compile(r'^/v1/users/(\w+)/playlists$'), 'user_playlists'),
+    (re.compile(r'^/artist/(\w+)$'), 'artist_page')
+]
+
+BASE62 = string.digits + string.ascii_letters
+MARKETS = ['US', 'GB', 'DE', 'FR', 'SE', 'BR', 'JP', 'MX', 'AU', 'CA']
+GENRES = ['indie pop', 'hip hop', 'jazz', 'metal', 'folk', 'house', 'ambient', 'soul']
+
+def h(*parts) -> int:
+    '''Stable hash of the parts, as a non-negative integer.'''
+    return int.from_bytes(hashlib.blake2b('|'.join(map(str, parts)).encode('utf-8'), digest_size=8).digest(), 'big')
+
+def make_id(*parts) -> str:
+    '''Stable 22-character base62 ID, like Spotify's.'''
+    n, chars = h(*parts) << 64 | h('id', *parts), []
+    for _ in range(22):
+        n, r = divmod(n, 62)
+        chars.append(BASE62[r])
+    return ''.join(chars)
+
+def parse_fields(fields: str) -> Dict[str, Any]:
+    '''Spotify's fields projection syntax, e.g. "items(added_at,track(id)),total",
+    as a tree of nested dicts, with None for the fields kept whole.'''
+    root, stack, name = {}, [], ''
+    node = root
+    for char in fields + ',':
+        if char == '(':
+            stack.append(node)
+            node = node.setdefault(name.strip(), {})
+            name = ''
+        elif char in ',)':
+            if name.strip():
+                node[name.strip()] = None
+            name = ''
+            if char == ')':
+                node = stack.pop()
+        else:
+            name += char
+    return root
+
+def project(value: Any, tree: Dict[str, Any]) -> Any:
+    '''Keep only the fields of a payload that are in a parse_fields tree.'''
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+class SyntheticCatalogue:
+    '''Deterministic answers for every endpoint. Names given to artists by search
+    results are remembered, so that looking those artists up by ID is consistent.'''
+    def __init__(self, hit_rate: float=0.7):
+        self.hit_rate = hit_rate
+        self.names = {}
+        self.lock = threading.Lock()
+
+    def page(self, items: List[Any], total: int, offset: int, limit: int, next_url: str) -> Dict[str, Any]:
+        return {
+            'items': items, 'total': total, 'limit': limit, 'offset': offset,
+            'next': next_url.format(offset=offset + limit, limit=limit) if offset + limit < total else None,
+            'previous': None
+        }
+
+    def artist_name(self, artist_id: str) -> str:
+        with self.lock:
+            return self.names.get(artist_id) or 'artist {:d}'.format(h('name', artist_id) % 10**7)
+
+    def artist(self, artist_id: str) -> Dict[str, Any]:
+        genres = GENRES[h('genre', artist_id) % len(GENRES):][:h('genres', artist_id) % 3]
+        return {
+            'id': artist_id, 'type': 'artist', 'uri': 'spotify:artist:' + artist_id,
+            'name': self.artist_name(artist_id), 'popularity': h('popularity', artist_id) % 100,
+            'followers': {'href': None, 'total': h('followers', artist_id) % 10**6}, 'genres': genres
+        }
+
+    def search(self, query: str, offset: int, limit: int, next_url: str) -> Dict[str, Any]:
+        match = re.search(r'artist:"(.*)"', query)
+        name = match.group(1) if match else query
+        total = min(1000, 5 + h('total', name.lower()) % 400)
+        position = None # most exact matches are on the first page, some only in a deep search
+        if h('hit', name.lower()) % 100 < 100*self.hit_rate:
+            position = h('position', name.lower()) % min(total, 10 if h('deep', name.lower()) % 5 else 200)
+        items = []
+        for i in range(offset, min(offset + limit, total)):
+            artist_name = name if i == position else '{:s} {:d}'.format(name, i)
+            artist_id = make_id('artist', artist_name.lower())
+            with self.lock:
+                self.names[artist_id] = artist_name
+            items.append(self.artist(artist_id))
+        return {'artists': self.page(items, total, offset, limit, next_url)}
+
+    def album_ids(self, artist_id: str) -> List[str]:
+        return [make_id('album', artist_id, i) for i in range(h('albums', artist_id) % 80)]
+
+    def simple_album(self, album_id: str) -> Dict[str, Any]:
+        return {
+            'id': album_id, 'name': 'album {:s}'.format(album_id[:6]),
+            'album_type': ['album', 'single', 'single', 'compilation'][h('type', album_id) % 4],
+            'release_date': '{:d}-01-01'.format(1970 + h('year', album_id) % 56),
+            'total_tracks': 1 + h('tracks', album_id) % 14
+        }
+
+    def album(self, album_id: str, next_url: str) -> Dict[str, Any]:
+        album = self.simple_album(album_id)
+        album['tracks'] = self.album_tracks(album_id, 0, 50, next_url)
+        return album
+
+    def album_tracks(self, album_id: str, offset: int, limit: int, next_url: str) -> Dict[str, Any]:
+        total = self.simple_album(album_id)['total_tracks']
+        items = [{'id': make_id('track', album_id, i), 'name': 'track {:d}'.format(i)} for i in range(offset, min(offset + limit, total))]
+        return self.page(items, total, offset, limit, next_url)
+
+    def track(self, track_id: str) -> Dict[str, Any]:
+        artist_id = make_id('artist', 'of track', track_id)
+        return {
+            'id': track_id, 'name': 'track {:s}'.format(track_id[:6]), 'popularity': h('popularity', track_id) % 100,
+            'duration_ms': 60000 + h('duration', track_id) % 300000, 'explicit': h('explicit', track_id) % 5 == 0,
+            'available_markets': MARKETS[:h('markets', track_id) % len(MARKETS)],
+            'artists': [{'id': artist_id, 'name': self.artist_name(artist_id)}],
+            'album': self.simple_album(make_id('album', 'of track', track_id))
+        }
+
+    def audio_features(self, track_id: str) -> Dict[str, Any]:
+        if h('no audio', track_id) % 50 == 0:
+            return None
+        unit = lambda key: (h(key, track_id) % 1000)/1000.
+        return {
+            'id': track_id, 'acousticness': unit('a'), 'danceability': unit('d'), 'energy': unit('e'),
+            'instrumentalness': unit('i'), 'liveness': unit('l'), 'loudness': -60*unit('o'), 'speechiness': unit('s'),
+            'tempo': 60 + 140*unit('t'), 'valence': unit('v'), 'key': h('key', track_id) % 12,
+            'mode': h('mode', track_id) % 2, 'time_signature': 3 + h('ts', track_id) % 3
+        }
+
+    def playlist_items(self, playlist_id: str, offset: int, limit: int, next_url: str) -> Dict[str, Any]:
+        total = 20 + h('size', playlist_id) % 200
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        items = []
+        for i in range(offset, min(offset + limit, total)):
+            track_id = make_id('track', playlist_id, i)
+            added_at = now - timedelta(hours=h('added', playlist_id, i) % 72)
+            items.append({'added_at': added_at.strftime('%Y-%m-%dT%H:%M:%SZ'), 'track': self.track(track_id)})
+        return self.page(items, total, offset, limit, next_url)
+
+    def playlist(self, playlist_id: str, next_url: str) -> Dict[str, Any]:
+        return {
+            'id': playlist_id, 'name': 'playlist {:s}'.format(playlist_id[:6]), 'owner': {'id': 'spotify'}, 'public': True,
+            'tracks': self.playlist_items(playlist_id, 0, 100, next_url)
+        }
+
+    def simple_playlist(self, playlist_id: str) -> Dict[str, Any]:
+        return {'id': playlist_id, 'name': 'playlist {:s}'.format(playlist_id[:6]), 'owner': {'id': 'spotify'}, 'public': True}
+
+    def categories(self, country: str, offset: int, limit: int, next_url: str) -> Dict[str, Any]:
+        total = 40 + h('categories', country) % 30
+        items = [{'id': 'category-{:d}'.format(i), 'name': 'Category {:d}'.format(i)} for i in range(offset, min(offset + limit, total))]
+        return {'categories': self.page(items, total, offset, limit, next_url)}
+
+    def category_playlists(self, category_id: str, country: str, offset: int, limit: int, next_url: str) -> Dict[str, Any]:
+        total = 5 + h('playlists', category_id, country) % 80
+        items = [self.simple_playlist(make_id('playlist', category_id, i)) for i in range(offset, min(offset + limit, total))]
+        return {'playlists': self.page(items, total, offset, limit, next_url)}
+
+    def user_playlists(self, user: str, offset: int, limit: int, next_url: str) -> Dict[str, Any]:
+        items = [self.simple_playlist(make_id('playlist', user, i)) for i in range(offset, min(offset + limit, 120))]
+        return self.page(items, 120, offset, limit, next_url)
+
+    def artist_page(self, artist_id: str) -> str:
+        genre = GENRES[h('bio genre', artist_id) % len(GENRES)]
+        bio = '' if h('bio', artist_id) % 4 == 0 else (
+            '<span data-encore-id="type" class="Type__TypeElement-sc-goli3j-0 kmjYak G_f5DJd2sgHWeto5cwbi">'
+            'An artist making {:s} and more.</span>'.format(genre))
+        return (
+            '<html><head><title>{:s}</title></head><body><main>'
+            '<div data-testid="monthly-listeners-label">{:,d} monthly listeners</div>{:s}'
+            '</main></body></html>'
+        ).format(self.artist_name(artist_id), h('listeners', artist_id) % 10**7, bio)
+
+    def answer(self, endpoint: str, args: Tuple[str, ...], params: Dict[str, str], next_url: str) -> Tuple[int, Any]:
+        '''(status, JSON payload or HTML) for a request.'''
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 20))
+        ids = [entity_id for entity_id in params.get('ids', '').split(',') if entity_id]
+        if endpoint == 'token':
+            return 200, {'access_token': 'standin-token', 'token_type': 'Bearer', 'expires_in': 3600}
+        if endpoint == 'search':
+            return 200, self.search(params.get('q', ''), offset, limit, next_url)
+        if endpoint == 'artists':
+            return 200, {'artists': [self.artist(artist_id) for artist_id in ids]}
+        if endpoint == 'artist_albums':
+            album_ids = self.album_ids(args[0])
+            items = [self.simple_album(album_id) for album_id in album_ids[offset:offset + limit]]
+            return 200, self.page(items, len(album_ids), offset, limit, next_url)
+        if endpoint == 'albums':
+            return 200, {'albums': [self.album(album_id, next_url) for album_id in ids]}
+        if endpoint == 'album_tracks':
+            return 200, self.album_tracks(args[0], offset, limit, next_url)
+        if endpoint == 'tracks':
+            return 200, {'tracks': [self.track(track_id) for track_id in ids]}
+        if endpoint == 'audio_features':
+            return 200, {'audio_features': [self.audio_features(track_id) for track_id in ids]}
+        if endpoint == 'playlist':
+            return 200, self.playlist(args[0], next_url.replace('/v1/playlists/{:s}?'.format(args[0]), '/v1/playlists/{:s}/tracks?'.format(args[0])))
+        if endpoint == 'playlist_items':
+            return 200, self.playlist_items(args[0], offset, min(limit, 100), next_url)
+        if endpoint == 'categories':
+            return 200, self.categories(params.get('country'), offset, limit, next_url)
+        if endpoint == 'category_playlists':
+            return 200, self.category_playlists(args[0], params.get('country'), offset, limit, next_url)
+        if endpoint == 'available_markets':
+            return 200, {'markets': MARKETS}
+        if endpoint == 'user_playlists':
+            return 200, self.user_playlists(args[0], offset, limit, next_url)
+        if endpoint == 'artist_page':
+            return 200, self.artist_page(args[0])
+        return 404, {'error': {'status': 404, 'message': 'Not handled by the stand-in'}}
+
+class Recording:
+    '''Responses keyed by method and path (with the query string), as JSON lines.'''
+    def __init__(self, path: str):
+        self.path = path
+        self.responses = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    response = json.loads(line)
+                    self.responses[(response['method'], response['path'])] = response
+
+    def get(self, method: str, path: str) -> Dict[str, Any]:
+        if path == '/api/token': # the body holds the credentials, which are not recorded
+            return {'status': 200, 'content_type': 'application/json', 'body': json.dumps(
+                {'access_token': 'replay-token', 'token_type': 'Bearer', 'expires_in': 3600})}
+        return self.responses.get((method, path))
+
+    def add(self, method: str, path: str, status: int, content_type: str, body: str) -> None:
+        response = {'method': method, 'path': path, 'status': status, 'content_type': content_type, 'body': body}
+        with self.lock:
+            self.responses[(method, path)] = response
+            if path != '/api/token':
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(response) + '\n')
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], latency_ms: float=0., rate_429: float=0., retry_after: int=1,
+                 record: str=None, replay: str=None, seed: int=0):
+        super().__init__(address, StandinHandler)
+        self.latency = latency_ms/1000.
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.catalogue = SyntheticCatalogue()
+        self.recording = Recording(record or replay) if (record or replay) else None
+        self.upstream = record is not None
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return 'http://{:s}:{:d}'.format(*self.server_address[:2])
+
+    def count(self, **counts) -> None:
+        with self.stats_lock:
+            self.stats.update(counts)
+
+    def inject_429(self) -> bool:
+        with self.stats_lock:
+            return self.random.random() < self.rate_429
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status: int, body, content_type: str=None, headers: Dict[str, str]=None) -> None:
+        if not isinstance(body, (str, bytes)):
+            body, content_type = json.dumps(body), 'application/json'
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type or 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(bytes_sent=len(data))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.request_body = self.rfile.read(length) if length > 0 else b''
+        if self.path == '/_reset':
+            with self.server.stats_lock:
+                self.server.stats.clear()
+            self.send(200, {})
+            return
+        self.handle_request('POST')
+
+    def do_GET(self):
+        self.request_body = None
+        if self.path == '/_stats':
+            with self.server.stats_lock:
+                stats = dict(self.server.stats)
+            self.send(200, stats)
+            return
+        self.handle_request('GET')
+
+    def handle_request(self, method: str) -> None:
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/') or '/'
+        endpoint, args = 'unknown', ()
+        for pattern, name in ROUTES:
+            match = pattern.match(path)
+            if match:
+                endpoint, args = name, match.groups()
+                break
+        self.server.count(**{endpoint: 1}) if endpoint == 'token' else self.server.count(requests=1, **{endpoint: 1})
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if endpoint != 'token' and self.server.inject_429():
+            self.server.count(injected_429=1)
+            self.send(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                      headers={'Retry-After': str(self.server.retry_after)})
+            return
+
+        key = path + ('?' + url.query if url.query else '')
+        if self.server.upstream:
+            self.forward(method, key)
+        elif self.server.recording is not None:
+            response = self.server.recording.get(method, key)
+            if response is None:
+                self.server.count(replay_misses=1)
+                self.send(404, {'error': {'status': 404, 'message': 'Not in the recording: ' + key}})
+            else:
+                self.send(response['status'], self.localize(response['body']), response['content_type'])
+        else:
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            query = '&'.join('{:s}={:s}'.format(k, quote(v)) for k, v in params.items() if k not in ['offset', 'limit'])
+            next_url = self.server.base_url + path + '?' + (query + '&' if query else '') + 'offset={offset}&limit={limit}'
+            status, payload = self.server.catalogue.answer(endpoint, args, params, next_url)
+            if status == 200 and 'fields' in params:
+                payload = project(payload, parse_fields(params['fields']))
+            self.send(status, payload)
+
+    def localize(self, body: str) -> str:
+        '''Point URLs in a recorded body (e.g. next) back at the stand-in.'''
+        for prefix, upstream in UPSTREAMS.items():
+            body = body.replace(upstream, self.server.base_url + prefix)
+        return body
+
+    def forward(self, method: str, key: str) -> None:
+        '''Record mode: pass the request on to Spotify and record the response.'''
+        import requests
+        prefix = next(prefix for prefix in UPSTREAMS if key.startswith(prefix))
+        headers = {k: v for k, v in self.headers.items() if k.lower() in ['authorization', 'content-type', 'accept']}
+        response = requests.request(method, UPSTREAMS[prefix] + key[len(prefix):], headers=headers, data=self.request_body, timeout=30)
+        content_type = response.headers.get('Content-Type', 'application/json')
+        if response.status_code != 429:
+            self.server.recording.add(method, key, response.status_code, content_type, response.text)
+        extra_headers = {'Retry-After': response.headers['Retry-After']} if 'Retry-After' in response.headers else None
+        self.send(response.status_code, self.localize(response.text), content_type, extra_headers)
+
+def start_standin(port: int=0, **kwargs) -> StandinServer:
+    '''Start a stand-in in a background thread (port 0 picks a free port).'''
+    server = StandinServer(('127.0.0.1', port), **kwargs)
+    threading.Thread(target=server.serve_forever, name='spotify-standin', daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Spotify Web API and artist pages.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0., help="delay before every response")
+    parser.add_argument("--rate-429", type=float, default=0., help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of injected 429s, in seconds")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--record", help="forward to Spotify and record the responses to this file")
+    mode.add_argument("--replay", help="answer from this recording")
+    args = parser.parse_args()
+
+    server = StandinServer(('127.0.0.1', args.port), latency_ms=args.latency_ms, rate_429=args.rate_429,
+                           retry_after=args.retry_after, record=args.record, replay=args.replay)
+    logger.info(f"Spotify stand-in listening on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,248 @@
+import fcntl, os, sys, time, json, atexit, threading, contextvars
+from contextlib import ContextDecorator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple
+from settings import get_config
+
+'''
+Daily request budget, shared by every pipeline stage and every process on the
+machine. Spotify enforces an undisclosed daily limit, so requests are counted per
+endpoint family and per stage in a small JSON state file (locked while it is
+read and updated), which starts afresh each UTC day. Each process reserves
+requests from the state file in blocks of config.json["request_budget"]["block_size"]
+and counts them off locally, so the file is only locked and rewritten once per
+block rather than once per request; what is left of its blocks is given back at
+exit.
+
+Stages are served by priority: a stage can only spend what is left of the day's
+limit after the unspent reserves of all stages ahead of it, so the editorial
+daily sweep always finds its share, whatever the background random-sample crawl
+has done. Paced stages are also spread evenly across the day: by a given time
+they may only have used that fraction of the limit (plus a small burst), and
+wait otherwise. When a stage has nothing left for the day, BudgetExhausted is
+raised, and callers can use affordable() beforehand to size their batches so
+that no batch is started that cannot be finished.
+
+Endpoint families (FAMILIES): 'search', 'playlists', 'catalog' (everything else
+on the Web API) and 'web' (the artist pages on open.spotify.com).
+
+The stage being charged is held in a context variable (see spending()), so that
+threads running different stages do not charge each other's. Tasks run on a
+StageExecutor are charged to the stage of the code that submitted them.
+'''
+
+config = get_config()
+CACHE_DIR = config['paths']['cache_dir']
+BUDGET_FILE = config['filenames']['request_budget']
+DAILY_LIMITS = config['request_budget']['daily_limits']
+STAGES = config['request_budget']['stages']
+DEFAULT_STAGE = config['request_budget']['default_stage']
+BURST_FRACTION = config['request_budget']['burst_fraction']
+BLOCK_SIZE = config['request_budget']['block_size']
+
+FAMILIES = {
+    'search': 'search',
+    'next': 'search', # only used to page through search results
+    'categories': 'playlists',
+    'category_playlists': 'playlists',
+    'featured_playlists': 'playlists',
+    'user_playlists': 'playlists',
+    'playlist': 'playlists',
+    'playlist_items': 'playlists',
+    'playlist_tracks': 'playlists'
+}
+MAX_WAIT = 5*60 # re-check the pacing at least this often while waiting
+
+class BudgetExhausted(Exception):
+    pass
+
+def family_of(method: str) -> str:
+    '''Endpoint family of a spotipy method.'''
+    return FAMILIES.get(method, 'catalog')
+
+def today() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+def fraction_of_day() -> float:
+    now = datetime.now(timezone.utc)
+    return (now.hour*3600 + now.minute*60 + now.second) / 86400
+
+class BudgetPlanner:
+    '''Request counts of the current day, per family and stage, in a state file
+    shared between processes: {"date": ..., "spent": {family: {stage: n}}}.
+    Requests are reserved in the file a block at a time (counted as spent), and
+    the reserved requests not made yet are kept per (family, stage) in reserved.'''
+    def __init__(self, path: str, limits: Dict[str, int]=DAILY_LIMITS, stages: Dict[str, Dict]=STAGES,
+                 burst_fraction: float=BURST_FRACTION, block_size: int=BLOCK_SIZE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.limits = limits
+        self.stages = stages
+        self.burst_fraction = burst_fraction
+        self.block_size = block_size
+        self.reserved, self.reserved_date = {}, today()
+        self.lock = threading.Lock() # flock only excludes other processes
+        self.reserve_lock = threading.Lock()
+
+    def transact(self, update=None) -> Dict:
+        '''Read the state under an exclusive file lock, apply update(state) and
+        write it back if update returns True. Returns the state.'''
+        with self.lock, open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+            except (FileNotFoundError, ValueError):
+                state = {}
+            if state.get('date') != today():
+                state = {'date': today(), 'spent': {}}
+            if update is not None and update(state):
+                with open(self.path + '.tmp', 'w') as f:
+                    json.dump(state, f)
+                os.replace(self.path + '.tmp', self.path)
+            return state
+
+    def allowance(self, state: Dict, family: str, stage: str) -> int:
+        '''Requests the stage may still make today: the limit, less everything spent,
+        less the unspent reserves of the stages ahead of it.'''
+        limit = self.limits.get(family)
+        if limit is None:
+            return sys.maxsize
+        spent = state['spent'].get(family, {})
+        priority = self.stages[stage]['priority']
+        held_back = sum(
+            max(0, int(settings['reserve']*limit) - spent.get(other, 0))
+            for other, settings in self.stages.items() if settings['priority'] < priority
+        )
+        return limit - sum(spent.values()) - held_back
+
+    def paced_wait(self, state: Dict, family: str, n: int) -> float:
+        '''Seconds until n more requests fit the even spread of the limit over the day.'''
+        limit = self.limits.get(family)
+        if limit is None:
+            return 0.
+        spent = sum(state['spent'].get(family, {}).values())
+        fraction_needed = (spent + n)/limit - self.burst_fraction
+        return max(0., (fraction_needed - fraction_of_day())*86400)
+
+    def acquire(self, family: str, n: int=1, stage: str=None) -> None:
+        '''Record n requests of the family for the stage (default: the current stage,
+        see spending()), waiting first if the stage is paced and ahead of schedule.
+        The requests are taken from this process's reserved block, and a new block
+        is reserved in the state file when it runs out (a smaller one if the whole
+        block is not allowed or not due yet). Raises BudgetExhausted if the stage
+        has no allowance left today.'''
+        stage = stage or current_stage.get()
+        key = (family, stage)
+        while True:
+            outcome = {}
+            with self.reserve_lock:
+                if self.reserved_date != today(): # yesterday's blocks were charged to yesterday
+                    self.reserved, self.reserved_date = {}, today()
+                if self.reserved.get(key, 0) >= n:
+                    self.reserved[key] -= n
+                    return
+                needed = n - self.reserved.get(key, 0)
+                def update(state: Dict) -> bool:
+                    allowance = self.allowance(state, family, stage)
+                    if allowance < needed:
+                        outcome['exhausted'] = True
+                        return False
+                    block = max(needed, min(self.block_size, allowance))
+                    if self.stages[stage]['paced']:
+                        if self.paced_wait(state, family, block) > 0:
+                            block = needed
+                        outcome['wait'] = self.paced_wait(state, family, block)
+                        if outcome['wait'] > 0:
+                            return False
+                    spent = state['spent'].setdefault(family, {})
+                    spent[stage] = spent.get(stage, 0) + block
+                    outcome['block'] = block
+                    return True
+                self.transact(update)
+                if 'block' in outcome:
+                    self.reserved[key] = self.reserved.get(key, 0) + outcome['block'] - n
+                    return
+            if outcome.get('exhausted'):
+                raise BudgetExhausted(f"Daily {family} budget of stage {stage} is used up.")
+            time.sleep(min(outcome['wait'], MAX_WAIT))
+
+    def release(self) -> None:
+        '''Give the reserved requests that were not made back to today's budget.'''
+        with self.reserve_lock:
+            reserved = {key: n for key, n in self.reserved.items() if n > 0}
+            self.reserved = {}
+            if len(reserved) == 0 or self.reserved_date != today():
+                return
+            def update(state: Dict) -> bool:
+                for (family, stage), n in reserved.items():
+                    spent = state['spent'].get(family, {})
+                    if stage in spent:
+                        spent[stage] = max(0, spent[stage] - n)
+                return True
+            self.transact(update)
+
+    def remaining(self, family: str, stage: str=None) -> int:
+        '''Requests the stage may still make today, including those this process
+        has reserved but not made yet.'''
+        stage = stage or current_stage.get()
+        state = self.transact()
+        with self.reserve_lock:
+            reserved = self.reserved.get((family, stage), 0) if self.reserved_date == today() else 0
+        return self.allowance(state, family, stage) + reserved
+
+    def affordable(self, family: str, num_items: int, requests_per_item: float=1., stage: str=None) -> int:
+        '''How many of num_items the stage can still process today, at an estimated
+        requests_per_item, so that batches can be cut to fit before they start.'''
+        num_affordable = max(0, min(num_items, int(self.remaining(family, stage) / requests_per_item)))
+        if num_affordable < num_items:
+            logger.info(f"Request budget: only {num_affordable} of {num_items} items fit today's remaining {family} budget.")
+        return num_affordable
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        return self.transact()['spent']
+
+current_stage = contextvars.ContextVar('current_stage', default=DEFAULT_STAGE)
+
+class spending(ContextDecorator):
+    '''Charge the requests made within a block, or a decorated function, to a stage,
+    e.g. @spending('editorial'). This includes the requests of tasks it submits to
+    a StageExecutor (the executors of the Spotify client and the scraper).'''
+    def __init__(self, stage: str):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown budget stage: {stage}")
+        self.stage = stage
+        self.token = None
+
+    def _recreate_cm(self):
+        return spending(self.stage) # a fresh one for each call of a decorated function
+
+    def __enter__(self):
+        self.token = current_stage.set(self.stage)
+        return self
+
+    def __exit__(self, *exc):
+        current_stage.reset(self.token)
+        return False
+
+class StageExecutor(ThreadPoolExecutor):
+    '''ThreadPoolExecutor that runs each task in a copy of the submitting thread's
+    context, so the task's requests are charged to the submitter's stage.'''
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+planner = None
+planner_lock = threading.Lock()
+def get_planner() -> BudgetPlanner:
+    '''The process-wide planner, which gives back its unused reservations at exit.'''
+    global planner
+    with planner_lock:
+        if planner is None:
+            planner = BudgetPlanner(CACHE_DIR + BUDGET_FILE)
+            atexit.register(planner.release)
+    return planner
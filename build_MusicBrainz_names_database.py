@@ -2,83 +2,175 @@ import musicbrainzngs
 import argparse, logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Iterator
 
 import pandas as pd
-import os, glob, json
+import os, glob, re, time, sqlite3
 import pickle
 
-with open('config.json') as f:
-    config = json.load(f)
-OUTPUT_DIR = config['paths']['output_dir']
-
-def get_all_artist_names_musicbrainz(start_offset=0, num_artists=1000):
-    '''Get num_artists artist names from the MusicBrainz database, starting at
-    an offset of start_offset. As of March 2024, this adheres to rate-limiting
-    restrictions and does not require an API key.'''
-
-    musicbrainzngs.set_useragent("MusicBrainz All Artists", "0.1", "https://sjeffreson.github.io/serch")
-
-    all_artist_names = []
+from table_storage import read_table, append_table, write_table, table_exists
+from settings import get_config
 
+config = get_config()
+OUTPUT_DIR = config['paths']['output_dir']
+ARTIST_NAMES_FILE = config['filenames']['artist_names']
+NAMES_STORE_FILE = config['filenames']['musicbrainz_names']
+PAGE_SIZE = config['musicbrainz_harvest']['page_size']
+LOG_EVERY_PAGES = config['musicbrainz_harvest']['log_every_pages']
+MAX_RETRIES = config['musicbrainz_harvest']['max_retries']
+EXPORT_CHUNK_ROWS = config['storage']['compact_rows']
+
+musicbrainzngs.set_useragent("MusicBrainz All Artists", "0.1", "https://sjeffreson.github.io/serch")
+
+class NameStore:
+    '''Append-only store of MusicBrainz artists, one row per MBID, together with the
+    harvest cursor. Each page of results and the cursor that follows it are written
+    in the same transaction, so an interrupted harvest neither loses nor re-fetches
+    a page.'''
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS artists (
+            mbid TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            source TEXT NOT NULL
+        )''')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS aliases (mbid TEXT NOT NULL, alias TEXT NOT NULL, PRIMARY KEY (mbid, alias))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS spotify_ids (mbid TEXT NOT NULL, spotify_id TEXT NOT NULL, PRIMARY KEY (mbid, spotify_id))')
+        self.conn.commit()
+
+    def get_cursor(self, name: str='search') -> int:
+        row = self.conn.execute('SELECT value FROM cursors WHERE name = ?', (name,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def add(self, records: List[Tuple[str, str]], source: str, cursor: Tuple[str, int]=None) -> int:
+        '''Store (mbid, name) records, ignoring MBIDs already stored, and optionally
+        move a cursor in the same transaction. Returns the number of new records.'''
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO artists (mbid, name, source) VALUES (?, ?, ?)',
+                [(mbid, name, source) for mbid, name in records]
+            )
+            num_new = self.conn.total_changes - before
+            if cursor is not None:
+                self.conn.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', cursor)
+        return num_new
+
+    def add_links(self, aliases: List[Tuple[str, str]], spotify_ids: List[Tuple[str, str]]) -> None:
+        '''Store (mbid, alias) and (mbid, spotify_id) pairs, ignoring those already stored.'''
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO aliases VALUES (?, ?)', aliases)
+            self.conn.executemany('INSERT OR IGNORE INTO spotify_ids VALUES (?, ?)', spotify_ids)
+
+    def count(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM artists').fetchone()[0]
+
+    def iter_chunks(self, chunk_rows: int=EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        '''Stream the store in insertion order, chunk_rows at a time.'''
+        rows = self.conn.execute('SELECT name, mbid FROM artists ORDER BY rowid')
+        while True:
+            chunk = rows.fetchmany(chunk_rows)
+            if len(chunk) == 0:
+                break
+            yield pd.DataFrame(chunk, columns=["artist_name", "mbid"])
+
+def get_names_store() -> NameStore:
+    return NameStore(OUTPUT_DIR + NAMES_STORE_FILE)
+
+def fetch_artists_page(offset: int, limit: int=PAGE_SIZE) -> List[Tuple[str, str]]:
+    '''One page of (mbid, name) from the match-all artist search. musicbrainzngs
+    keeps to the MusicBrainz rate limit itself; network errors are retried with
+    exponential backoff.'''
+    for attempt in range(MAX_RETRIES):
+        try:
+            artists = musicbrainzngs.search_artists(query="*", limit=limit, offset=offset)
+            return [(artist["id"], artist["name"]) for artist in artists["artist-list"]]
+        except musicbrainzngs.NetworkError as e:
+            logger.error(f"Network error at offset {offset}: {e}. Retrying in {2**attempt} seconds.")
+            time.sleep(2**attempt)
+    raise musicbrainzngs.NetworkError(f"Giving up at offset {offset} after {MAX_RETRIES} attempts.")
+
+def harvest_artist_names(max_pages: int=None) -> None:
+    '''Page through all MusicBrainz artists from the stored cursor, until the last
+    page, max_pages pages, or an interruption. Safe to stop and restart at any time.'''
+
+    store = get_names_store()
+    offset = store.get_cursor()
+    logger.info(f"Resuming harvest at offset {offset}, {store.count()} artists stored.")
+
+    start_time, num_pages, num_new = time.time(), 0, 0
     try:
-        query = "*"  # Empty query to fetch all artists
-        offset = start_offset
-        limit = 100  # Adjust the limit as needed
-        while offset < start_offset + num_artists:
-            artists = musicbrainzngs.search_artists(query=query, limit=limit, offset=offset)
-            all_artist_names.extend(artist["name"] for artist in artists["artist-list"])
-
-            # Check if there are more results
-            if len(artists["artist-list"]) == limit:
-                offset += limit
-            else:
+        while max_pages is None or num_pages < max_pages:
+            records = fetch_artists_page(offset)
+            offset += len(records)
+            num_new += store.add(records, source='search', cursor=('search', offset))
+            num_pages += 1
+            if num_pages % LOG_EVERY_PAGES == 0:
+                elapsed = time.time() - start_time
+                logger.info(f"Offset {offset}: {num_new} new artists in {elapsed:.0f} s "
+                            f"({num_pages/elapsed:.2f} pages/s, {num_new/elapsed:.1f} artists/s).")
+            if len(records) < PAGE_SIZE:
+                logger.info(f"Reached the last page at offset {offset}.")
                 break
-
     except musicbrainzngs.ResponseError as e:
-        print("Error:", e)
-
-    return all_artist_names
-
-def save_all_artist_names_musicbrainz_temp():
-    '''Save batches of artist names from the MusicBrainz database to a pickle file.
-    Will continue until interrupted or until there are no more names left to
-    fetch in the database.'''
-
-    start_offset=790000
-    num_artists_batch=10000
-    num_artist_names = num_artists_batch
-    while num_artist_names == num_artists_batch: # retrieved a full batch, might be more
-        all_artist_names = get_all_artist_names_musicbrainz(start_offset=start_offset, num_artists=num_artists_batch)
-
-        filename = OUTPUT_DIR + "/artist_names_{:d}.pkl".format(start_offset)
-        with open(filename, "wb") as f:
-            pickle.dump(all_artist_names, f)
-        logger.info(f"Saved artist names to {filename}")
-
-        num_artist_names = len(all_artist_names)
-        start_offset += num_artists_batch
-
-def write_all_pickles_to_csv():
-    '''Write all pickles to a single csv file'''
-
-    all_pickles = glob.glob(OUTPUT_DIR + "artist_names_*.pkl")
-    all_artist_names = []
-    for p in all_pickles:
-        with open(p, "rb") as f:
-            all_artist_names.extend(pickle.load(f))
-
-    df = pd.DataFrame(all_artist_names, columns=["artist_name"])
-    df.to_csv(OUTPUT_DIR + "all_artist_names.csv", index=False)
+        logger.error(f"Error at offset {offset}: {e}")
+    logger.info(f"Harvested {num_pages} pages, {num_new} new artists. Cursor is at {offset}.")
+
+def import_legacy_pickles() -> None:
+    '''Import the names in the artist_names_{offset}.pkl files written by the old
+    harvester, which did not keep MBIDs, and move the cursor past the last
+    contiguous pickle.'''
+
+    store = get_names_store()
+    pickles = {}
+    for p in glob.glob(OUTPUT_DIR + "artist_names_*.pkl"):
+        match = re.search(r"artist_names_(\d+)\.pkl$", p)
+        if match:
+            pickles[int(match.group(1))] = p
+
+    cursor = store.get_cursor()
+    for start_offset in sorted(pickles):
+        with open(pickles[start_offset], "rb") as f:
+            names = pickle.load(f)
+        records = [("legacy:{:d}".format(start_offset + i), name) for i, name in enumerate(names)]
+        if start_offset <= cursor:
+            cursor = max(cursor, start_offset + len(names))
+        store.add(records, source='legacy', cursor=('search', cursor))
+        logger.info(f"Imported {len(names)} names from {pickles[start_offset]}")
+
+def export_artist_names() -> None:
+    '''Write the stored names to the artist names table (all_artist_names.csv),
+    streaming from the store a chunk at a time.'''
+
+    store = get_names_store()
+    for i, chunk in enumerate(store.iter_chunks()):
+        if i == 0:
+            write_table(chunk, OUTPUT_DIR + ARTIST_NAMES_FILE)
+        else:
+            append_table(chunk, OUTPUT_DIR + ARTIST_NAMES_FILE)
+    logger.info(f"Exported {store.count()} artist names to {OUTPUT_DIR + ARTIST_NAMES_FILE}")
 
 def check_len_artist_name_csv():
     '''Check the length of the csv file'''
 
-    assert os.path.exists(OUTPUT_DIR + "all_artist_names.csv"), "CSV file does not exist"
+    assert table_exists(OUTPUT_DIR + ARTIST_NAMES_FILE), "CSV file does not exist"
 
-    df = pd.read_csv(OUTPUT_DIR + "all_artist_names.csv")
+    df = read_table(OUTPUT_DIR + ARTIST_NAMES_FILE, columns=["artist_name"])
     print(len(df))
 
 if __name__ == "__main__":
-    #save_all_artist_names_musicbrainz_temp()
-    #write_all_pickles_to_csv()
-    check_len_artist_name_csv()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Harvest all artist names from MusicBrainz.")
+    parser.add_argument("--import-pickles", action="store_true", help="import the pickles of the old harvester first")
+    parser.add_argument("--max-pages", type=int, default=None, help="stop after this many pages")
+    parser.add_argument("--export", action="store_true", help="write the names table after harvesting")
+    args = parser.parse_args()
+
+    if args.import_pickles:
+        import_legacy_pickles()
+    harvest_artist_names(max_pages=args.max_pages)
+    if args.export:
+        export_artist_names()
+        check_len_artist_name_csv()
@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any, Callable, NamedTuple
+
+import sys
+from operator import itemgetter
+
+'''
+Columnar, typed storage for the artist and track info containers. Each field is a
+NumPy buffer that grows by doubling, rather than a list of boxed Python objects.
+Repetitive strings (names, genres, artist lists, release dates) are dictionary-encoded
+as int32 codes into a list of distinct values. Columns export to pandas and Arrow
+as views of their buffers.
+
+Column kinds:
+    'int'       int64, with a validity mask allocated on the first missing value
+    'float'     float64, missing values are NaN
+    'category'  dictionary-encoded strings, missing values have code -1
+    'str'       distinct strings (e.g. IDs), as an object array
+    'object'    anything else, as an object array
+
+Containers declare their fields once, as a schema of Field(kind, group, path,
+transform), where group names the payload the field comes from (e.g. 'track' or
+'audio' for the tracks and audio_features endpoints), path is the chain of keys
+into that payload, and transform is applied to the value found there. For each
+group and set of keys, the fields are gathered into a single function that turns a
+payload into a row tuple, so every payload is read in one pass.
+
+container[key] returns a column as a list, as the containers always have; use
+to_pandas() or to_arrow() for the whole table without copying.
+'''
+
+BUFFER_DTYPES = {'int': np.int64, 'float': np.float64, 'category': np.int32, 'str': object, 'object': object}
+
+class Column:
+    __slots__ = ('kind', 'buffer', 'mask', 'size', 'categories', 'codes')
+
+    def __init__(self, kind: str, capacity: int=64):
+        self.kind = kind
+        self.buffer = np.empty(capacity, dtype=BUFFER_DTYPES[kind])
+        self.mask = None
+        self.size = 0
+        self.categories = []
+        self.codes = {}
+
+    @classmethod
+    def from_values(cls, values) -> 'Column':
+        '''Column holding an existing sequence, typed by its NumPy dtype if it has one.'''
+        values = np.asarray(values)
+        kind = {'i': 'int', 'u': 'int', 'b': 'int', 'f': 'float'}.get(values.dtype.kind, 'object')
+        column = cls(kind, capacity=max(len(values), 1))
+        column.extend(values.tolist() if kind == 'object' else values)
+        return column
+
+    def __len__(self) -> int:
+        return self.size
+
+    def reserve(self, num: int) -> None:
+        '''Make room for num more values, at least doubling the capacity.'''
+        if self.size + num <= len(self.buffer):
+            return
+        capacity = max(2*len(self.buffer), self.size + num)
+        buffer = np.empty(capacity, dtype=self.buffer.dtype)
+        buffer[:self.size] = self.buffer[:self.size]
+        self.buffer = buffer
+        if self.mask is not None:
+            mask = np.zeros(capacity, dtype=bool)
+            mask[:self.size] = self.mask[:self.size]
+            self.mask = mask
+
+    def encode(self, value) -> int:
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def append(self, value) -> None:
+        self.extend([value])
+
+    def extend(self, values) -> None:
+        num = len(values)
+        self.reserve(num)
+        start, end = self.size, self.size + num
+        if self.kind == 'category':
+            self.buffer[start:end] = [self.encode(value) for value in values]
+        elif self.kind == 'int' and not isinstance(values, np.ndarray) and any(value is None for value in values):
+            if self.mask is None:
+                self.mask = np.zeros(len(self.buffer), dtype=bool)
+            self.mask[start:end] = [value is None for value in values]
+            self.buffer[start:end] = [0 if value is None else value for value in values]
+        elif self.kind == 'float' and not isinstance(values, np.ndarray):
+            self.buffer[start:end] = [np.nan if value is None else value for value in values]
+        else:
+            self.buffer[start:end] = values
+        self.size = end
+
+    def values(self) -> np.ndarray:
+        '''View of the stored values (codes, for a category column).'''
+        return self.buffer[:self.size]
+
+    def to_list(self) -> List[Any]:
+        '''The stored values as a list, with None for missing values (NaN for floats).'''
+        values = self.values()
+        if self.kind == 'category':
+            return [self.categories[code] if code >= 0 else None for code in values.tolist()]
+        if self.kind == 'int' and self.mask is not None:
+            return [None if missing else value for value, missing in zip(values.tolist(), self.mask[:self.size].tolist())]
+        return values.tolist()
+
+    def to_pandas(self) -> pd.Series:
+        values = self.values()
+        if self.kind == 'category':
+            return pd.Series(pd.Categorical.from_codes(values, categories=pd.Index(self.categories, dtype=object)))
+        if self.kind == 'int' and self.mask is not None:
+            return pd.Series(pd.arrays.IntegerArray(values, self.mask[:self.size]))
+        return pd.Series(values, copy=False)
+
+    def to_arrow(self):
+        import pyarrow as pa
+        values = self.values()
+        if self.kind == 'category':
+            return pa.DictionaryArray.from_arrays(pa.array(values, mask=values < 0), pa.array(self.categories, type=pa.string()))
+        if self.kind == 'int' and self.mask is not None:
+            return pa.array(values, mask=self.mask[:self.size])
+        if self.kind == 'str':
+            return pa.array(values, type=pa.string())
+        return pa.array(values)
+
+class Field(NamedTuple):
+    kind: str
+    group: str
+    path: Tuple[str, ...]
+    transform: Callable[[Any], Any] = None
+
+def field_getter(field: Field) -> Callable[[Dict[str, Any]], Any]:
+    '''Function of a payload returning the field: the value at the end of its path
+    of keys, transformed.'''
+    path, transform = field.path, field.transform
+    if len(path) == 1:
+        get = itemgetter(path[0])
+    else:
+        def get(payload: Dict[str, Any]) -> Any:
+            for key in path:
+                payload = payload[key]
+            return payload
+    if transform is None:
+        return get
+    return lambda payload: transform(get(payload))
+
+def compile_extractor(fields: List[Field]) -> Callable[[Dict[str, Any]], Tuple]:
+    '''One function of a payload returning the row tuple of the fields, e.g.
+    (str(p['id']), len(p['available_markets'])). A None payload (e.g. an unknown
+    ID in an audio_features response) gives a row of None.'''
+
+    getters = [field_getter(field) for field in fields]
+    missing = (None,)*len(fields)
+    def extract(payload: Dict[str, Any]) -> Tuple:
+        if payload is None:
+            return missing
+        return tuple([get(payload) for get in getters])
+    return extract
+
+class ColumnarRecords:
+    '''Base for the info containers: a fixed schema of typed columns, addressed by
+    key as before (container[key], container.keys). Subclasses set FIELDS, mapping
+    each default key to its Field. Keys assigned with container[key] = values
+    that are not in the schema are stored alongside, but not added to .keys.'''
+    __slots__ = ('keys', 'data')
+    FIELDS = {}
+    extractors = {}
+
+    def __init__(self, exclude_keys=None):
+        self.keys = list(self.FIELDS)
+        if exclude_keys:
+            if 'ids' in exclude_keys:
+                logger.critical("Cannot exclude 'ids' key.")
+                sys.exit(1)
+            self.keys = [key for key in self.keys if key not in exclude_keys]
+
+        self.data = {key: Column(self.FIELDS[key].kind) for key in self.keys}
+
+    def group_keys(self, group: str) -> List[str]:
+        return [key for key in self.keys if self.FIELDS[key].group == group]
+
+    def append_payloads(self, group: str, payloads: List[Dict[str, Any]]) -> None:
+        '''Extract the stored keys of a group from each payload, in one pass.'''
+        keys = self.group_keys(group)
+        if len(keys) == 0:
+            return
+        signature = (type(self).__name__, group, tuple(keys))
+        if signature not in self.extractors:
+            self.extractors[signature] = compile_extractor([self.FIELDS[key] for key in keys])
+        extract = self.extractors[signature]
+
+        rows = [extract(payload) for payload in payloads]
+        for key, values in zip(keys, zip(*rows)):
+            self.data[key].extend(values)
+
+    def __getitem__(self, key) -> List[Any]:
+        return self.data[key].to_list()
+
+    def __setitem__(self, key, value):
+        self.data[key] = value if isinstance(value, Column) else Column.from_values(value)
+
+    def __len__(self) -> int:
+        return len(self.data['ids'])
+
+    def check_equal_length(self):
+        '''Check that all columns have the same length.'''
+        for key in self.keys:
+            if len(self.data[key]) != len(self.data['ids']):
+                logger.critical(f"Length of {key} does not match length of ids.")
+                sys.exit(1)
+
+    def to_pandas(self, keys: List[str]=None) -> pd.DataFrame:
+        '''DataFrame of the given keys (default: .keys), backed by the column buffers.'''
+        keys = self.keys if keys is None else keys
+        return pd.DataFrame({key: self.data[key].to_pandas() for key in keys}, copy=False)
+
+    def to_arrow(self, keys: List[str]=None):
+        import pyarrow as pa
+        keys = self.keys if keys is None else keys
+        return pa.table({key: self.data[key].to_arrow() for key in keys})
@@ -0,0 +1,126 @@
+import random
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+
+from spotify_client import sp, gather
+from settings import get_config
+
+config = get_config()
+TRACK_POLICY = config['representative_tracks']['policy']
+TRACK_SEED = config['representative_tracks']['seed']
+
+'''
+Complete artist discographies from the artist_albums endpoint. The first page
+(limit=50) of every artist in a batch is requested concurrently, then all the
+remaining pages of the artists with more than 50 releases, again concurrently.
+Every page goes through the response cache. Album objects missing total_tracks are
+completed in bulk through the multi-album endpoint.
+
+Representative tracks for many artists are chosen from these discographies, with
+the track lists of the chosen albums fetched 20 albums per request through the
+multi-album endpoint, instead of one album_tracks request per album.
+'''
+
+PAGE_LIMIT = 50 # maximum for artist_albums
+ALBUMS_BATCH = 20 # maximum for the albums endpoint
+
+def get_artists_albums(artist_ids: List[str], include_groups: str='album,single') -> List[Dict[str, Any]]:
+    '''Full artist_albums listing for each artist, in the same shape as a single
+    artist_albums response ({'items': [...], 'total': n}), with the items of all
+    pages in order and without duplicate albums.'''
+
+    first_pages = sp.map_cached('artist_albums', artist_ids, include_groups=include_groups, limit=PAGE_LIMIT)
+
+    '''Remaining pages of the prolific artists'''
+    requests = [
+        (i, offset)
+        for i, first_page in enumerate(first_pages)
+        for offset in range(PAGE_LIMIT, first_page['total'], PAGE_LIMIT)
+    ]
+    futures = [
+        sp.executor.submit(sp.cached, 'artist_albums', artist_ids[i], include_groups=include_groups, limit=PAGE_LIMIT, offset=offset)
+        for i, offset in requests
+    ]
+    items = [list(first_page['items']) for first_page in first_pages]
+    for (i, offset), page in zip(requests, gather(futures)):
+        items[i].extend(page['items'])
+    if len(requests) > 0:
+        logger.info(f'Fetched {len(requests)} further artist_albums pages for {len(set(i for i, _ in requests))} prolific artists.')
+
+    discographies = []
+    for first_page, artist_items in zip(first_pages, items):
+        seen = set()
+        unique_items = [item for item in artist_items if not (item['id'] in seen or seen.add(item['id']))]
+        discographies.append({'items': unique_items, 'total': first_page['total']})
+
+    fill_total_tracks(discographies)
+    return discographies
+
+def fill_total_tracks(discographies: List[Dict[str, Any]]) -> None:
+    '''Fetch total_tracks, in bulk, for any album objects that lack it.'''
+    incomplete = [item for discography in discographies for item in discography['items'] if item.get('total_tracks') is None]
+    if len(incomplete) == 0:
+        return
+    albums = sp.entities('albums', list(dict.fromkeys(item['id'] for item in incomplete)), batch_size=ALBUMS_BATCH)
+    total_tracks = {album['id']: album['total_tracks'] for album in albums if album is not None}
+    for item in incomplete:
+        item['total_tracks'] = total_tracks.get(item['id'], 0)
+
+def get_artist_albums(artist_id: str, include_groups: str='album,single') -> Dict[str, Any]:
+    '''Full artist_albums listing for a single artist.'''
+    return get_artists_albums([artist_id], include_groups)[0]
+
+def order_albums(artist_id: str, discography: Dict[str, Any], policy: str, seed: int) -> List[Dict[str, Any]]:
+    '''Albums and singles with tracks, in the order they should be tried:
+    'first' keeps the order Spotify lists them in, 'recent' puts the latest
+    release first, and 'random' shuffles them, reproducibly for a given seed.'''
+    albums = [
+        album for album in discography['items']
+        if album['album_type'] in ['album', 'single'] and album.get('total_tracks', 1) != 0
+    ]
+    if policy == 'recent':
+        return sorted(albums, key=lambda album: album['release_date'], reverse=True)
+    if policy == 'random':
+        albums = albums.copy()
+        random.Random(f'{seed}:{artist_id}').shuffle(albums)
+        return albums
+    if policy != 'first':
+        raise ValueError(f"Unknown track selection policy: {policy}")
+    return albums
+
+def get_representative_tracks(artist_ids: List[str], policy: str=TRACK_POLICY, seed: int=TRACK_SEED,
+                              discographies: List[Dict[str, Any]]=None) -> List[str]:
+    '''One track ID per artist (None if the artist has no tracks), chosen by policy
+    ('first', 'recent' or 'random'; see order_albums). The first track of the chosen
+    album is taken, or a random one under the 'random' policy. Discographies already
+    fetched can be passed in, otherwise they come from get_artists_albums (and
+    usually from the response cache). Album track lists are fetched in bulk, one
+    round per fallback album, so most artists cost 1/20 of a request.'''
+
+    if discographies is None:
+        discographies = get_artists_albums(artist_ids)
+    candidates = {
+        artist_id: order_albums(artist_id, discography, policy, seed)
+        for artist_id, discography in zip(artist_ids, discographies)
+    }
+
+    track_ids = {}
+    pending = [artist_id for artist_id in dict.fromkeys(artist_ids) if len(candidates[artist_id]) > 0]
+    while len(pending) > 0:
+        album_ids = list(dict.fromkeys(candidates[artist_id][0]['id'] for artist_id in pending))
+        albums = dict(zip(album_ids, sp.entities('albums', album_ids, batch_size=ALBUMS_BATCH)))
+        still_pending = []
+        for artist_id in pending:
+            album = albums.get(candidates[artist_id].pop(0)['id'])
+            tracks = [] if album is None else album['tracks']['items']
+            if len(tracks) > 0:
+                track = random.Random(f'{seed}:{artist_id}').choice(tracks) if policy == 'random' else tracks[0]
+                track_ids[artist_id] = track['id']
+            elif len(candidates[artist_id]) > 0:
+                still_pending.append(artist_id)
+        pending = still_pending
+
+    return [track_ids.get(artist_id) for artist_id in artist_ids]
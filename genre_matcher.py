@@ -0,0 +1,84 @@
+import re
+from functools import lru_cache
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple
+from settings import get_config
+
+'''
+Matching of the genre vocabulary (config.json["genres"]) against bio text. The
+vocabulary is compiled once into a single regex, with longest alternatives first,
+so the text is scanned once however many genres there are. Genres match as whole
+words, including at punctuation and at the start and end of the text.
+
+The regex folds case differently from str.lower() for a few non-ASCII letters
+(e.g. "HİP HOP" and "ſoul" match "hip hop" and "soul", but do not lower to them),
+so a matched text that does not lower to a genre is mapped back to it by matching
+each genre's own pattern.
+'''
+
+config = get_config()
+GENRES = config['genres']
+
+def normalize(term: str) -> str:
+    return ' '.join(term.lower().split())
+
+class GenreMatcher:
+    '''Finds the genres of a vocabulary that appear in a text. Matches are returned
+    as the vocabulary entries (e.g. " hip hop ", as stored in the genre tables),
+    de-duplicated and in vocabulary order.'''
+    def __init__(self, vocabulary: List[str]):
+        self.labels = {}
+        for label in vocabulary:
+            term = normalize(label)
+            if len(term) > 0 and term not in self.labels:
+                self.labels[term] = label
+        if len(self.labels) < len(vocabulary):
+            logger.info(f'Genre vocabulary: dropped {len(vocabulary) - len(self.labels)} duplicate or empty entries.')
+
+        terms = sorted(self.labels, key=len, reverse=True)
+        term_patterns = [r'\s+'.join(re.escape(word) for word in term.split(' ')) for term in terms]
+        '''The lookahead lets matches overlap, e.g. "new wave" and "wave" at different positions'''
+        self.pattern = re.compile(r'(?<!\w)(?=(' + '|'.join(term_patterns) + r')(?!\w))', re.IGNORECASE)
+        self.term_patterns = [(term, re.compile(pattern, re.IGNORECASE)) for term, pattern in zip(terms, term_patterns)]
+
+        '''Shorter terms that start a longer one (e.g. "hip" in "hip hop") are implied by it'''
+        self.implied = {
+            term: [other for other in terms if len(other) < len(term) and term.startswith(other) and not term[len(other)].isalnum()]
+            for term in terms
+        }
+
+    def match(self, text: str) -> List[str]:
+        if not text:
+            return []
+        found = set()
+        for match in self.pattern.finditer(text):
+            term = self.term_of(match.group(1))
+            if term is None:
+                continue
+            found.add(term)
+            found.update(self.implied[term])
+        return [label for term, label in self.labels.items() if term in found]
+
+    def term_of(self, text: str) -> str:
+        '''The vocabulary term a matched text stands for: its lower-case form, or else
+        the first term (longest first, as in the regex) whose pattern matches it.'''
+        term = normalize(text)
+        if term in self.implied:
+            return term
+        for term, pattern in self.term_patterns:
+            if pattern.fullmatch(text):
+                return term
+        logger.warning(f"Genre match {text!r} is not in the vocabulary.")
+        return None
+
+    def match_many(self, texts: List[str]) -> List[List[str]]:
+        '''Batch mode, e.g. for re-running genre extraction over all stored bios.'''
+        return [self.match(text) for text in texts]
+
+@lru_cache(maxsize=8)
+def get_matcher(vocabulary: Tuple[str, ...]=tuple(GENRES)) -> GenreMatcher:
+    '''Compiled matcher for a vocabulary, built once per vocabulary.'''
+    return GenreMatcher(list(vocabulary))
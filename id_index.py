@@ -0,0 +1,163 @@
+import pandas as pd
+import os, io, json, hashlib
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple
+
+import table_storage
+from settings import get_config
+
+'''
+Persistent index of the IDs already present in an append-only output table, so that
+"not yet scraped" selections are O(1) per ID and do not re-read the whole table. The
+index remembers how far into the table it has read (the byte offset of a CSV table,
+or the Parquet partitions already seen), and on each sync only reads the rows
+appended since then.
+'''
+
+config = get_config()
+CACHE_DIR = config['paths']['cache_dir']
+INDEX_DIR = CACHE_DIR + "id_indexes/"
+CHECK_BYTES = 256 # bytes before the synced offset that must be unchanged
+
+class ProcessedIdIndex:
+    '''Ordered, de-duplicated set of the values in one column of a table. The
+    values are mirrored in a sidecar file under INDEX_DIR, with a small JSON file
+    recording how much of the table has been indexed. If the table is truncated or
+    rewritten, the index is rebuilt from scratch.'''
+    def __init__(self, table_path: str, column: str='ids'):
+        self.table_path = table_path
+        self.column = column
+        stem = "{:s}.{:s}.{:s}".format(
+            os.path.basename(table_path),
+            hashlib.sha1(os.path.abspath(table_path).encode('utf-8')).hexdigest()[:8],
+            column
+        )
+        self.ids_path = INDEX_DIR + stem + ".ids"
+        self.meta_path = INDEX_DIR + stem + ".json"
+
+        self.ids = []
+        self.id_set = set()
+        self.meta = {'offset': 0, 'header': None, 'check': None, 'partitions': []}
+        if os.path.exists(self.meta_path) and os.path.exists(self.ids_path):
+            with open(self.meta_path) as f:
+                self.meta.update(json.load(f))
+            with open(self.ids_path) as f:
+                self.add_to_memory(f.read().splitlines())
+        self.sync()
+
+    def __contains__(self, id) -> bool:
+        return id in self.id_set
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add_to_memory(self, ids: List[str]) -> List[str]:
+        new_ids = []
+        for id in ids:
+            if id not in self.id_set:
+                self.id_set.add(id)
+                new_ids.append(id)
+        self.ids.extend(new_ids)
+        return new_ids
+
+    def check_bytes(self, f, offset: int) -> str:
+        f.seek(max(0, offset - CHECK_BYTES))
+        return hashlib.sha1(f.read(min(offset, CHECK_BYTES))).hexdigest()
+
+    def reset(self) -> None:
+        self.ids, self.id_set = [], set()
+        self.meta = {'offset': 0, 'header': None, 'check': None, 'partitions': []}
+        if os.path.exists(self.ids_path):
+            os.remove(self.ids_path)
+
+    def save(self, new_ids: List[str]) -> None:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        with open(self.ids_path, 'a') as f:
+            f.writelines(id + '\n' for id in new_ids)
+        with open(self.meta_path + '.tmp', 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+
+    def sync(self) -> None:
+        '''Index any complete rows appended to the table since the last sync.'''
+
+        if table_storage.is_parquet():
+            self.sync_partitions()
+            return
+
+        if not os.path.exists(self.table_path):
+            if self.meta['offset'] > 0:
+                self.reset()
+            return
+
+        with open(self.table_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.meta['offset'] or self.check_bytes(f, self.meta['offset']) != self.meta['check']:
+                if self.meta['offset'] > 0:
+                    logger.info(f'{self.table_path} was rewritten, rebuilding its {self.column} index.')
+                self.reset()
+            if size == self.meta['offset']:
+                return
+
+            if self.meta['header'] is None:
+                f.seek(0)
+                header_line = f.readline()
+                self.meta['header'] = pd.read_csv(io.BytesIO(header_line), nrows=0).columns.tolist()
+                self.meta['offset'] = len(header_line)
+            f.seek(self.meta['offset'])
+            tail = f.read(size - self.meta['offset'])
+            tail = tail[:tail.rfind(b'\n') + 1] # only complete rows
+            if len(tail) == 0:
+                return
+            offset = self.meta['offset'] + len(tail)
+            check = self.check_bytes(f, offset)
+
+        if self.column not in self.meta['header']:
+            logger.error(f'Column {self.column} not found in {self.table_path}.')
+            return
+        tail_df = pd.read_csv(
+            io.BytesIO(tail), header=None, names=self.meta['header'], usecols=[self.column], dtype=str
+        )
+        new_ids = self.add_to_memory(tail_df[self.column].dropna().tolist())
+        self.meta['offset'], self.meta['check'] = offset, check
+        self.save(new_ids)
+
+    def sync_partitions(self) -> None:
+        '''Index any Parquet partitions written since the last sync. If a partition
+        that was already indexed has gone (compaction or a rewrite), start over.'''
+
+        partitions = [os.path.basename(partition) for partition in table_storage.list_partitions(self.table_path)]
+        if not set(self.meta['partitions']).issubset(partitions):
+            logger.info(f'{self.table_path} was rewritten, rebuilding its {self.column} index.')
+            self.reset()
+        new_partitions = [partition for partition in partitions if partition not in self.meta['partitions']]
+        if len(new_partitions) == 0:
+            return
+
+        import pyarrow.parquet as pq
+        new_ids = []
+        for partition in new_partitions:
+            schema = pq.read_schema(table_storage.dataset_dir(self.table_path) + partition)
+            if self.column not in schema.names:
+                continue
+            column = pq.read_table(table_storage.dataset_dir(self.table_path) + partition, columns=[self.column])[self.column]
+            new_ids.extend(self.add_to_memory([str(id) for id in column.drop_null().to_pylist()]))
+        self.meta['partitions'] = self.meta['partitions'] + new_partitions
+        self.save(new_ids)
+
+    def filter_new(self, ids: List[str]) -> List[str]:
+        '''Return the IDs that are not yet in the table, preserving order.'''
+        return [id for id in ids if id not in self.id_set]
+
+indexes = {}
+def get_index(table_path: str, column: str='ids') -> ProcessedIdIndex:
+    '''The index for a table column, brought up to date with the table. Instances are
+    kept for the lifetime of the process, so repeated calls only read new rows.'''
+    if (table_path, column) not in indexes:
+        indexes[(table_path, column)] = ProcessedIdIndex(table_path, column)
+    else:
+        indexes[(table_path, column)].sync()
+    return indexes[(table_path, column)]
@@ -0,0 +1,120 @@
+import argparse, logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Iterator, IO
+
+import os, json, re, time
+import gzip, bz2, lzma, tarfile
+from multiprocessing import Pool
+from collections import deque
+
+from build_MusicBrainz_names_database import get_names_store
+from settings import get_config
+
+'''
+Offline import of a MusicBrainz JSON data dump (e.g. artist.tar.xz from
+https://data.metabrainz.org/pub/musicbrainz/data/json-dumps/) into the names store,
+as an alternative to harvesting through the rate-limited search API. The dump has
+one artist per line as JSON. It is streamed line by line and parsed in chunks on
+all cores; only a bounded number of chunks is held in memory at a time.
+
+Accepts the .tar(.xz/.gz/.bz2) archive as downloaded, or the extracted
+mbdump/artist file, compressed or not. A small sample dump, and a check of what it
+imports, are in benchmarks/ (fixtures/ and check_MusicBrainz_dump_import.py).
+'''
+
+config = get_config()
+CHUNK_LINES = 10000
+
+SPOTIFY_ARTIST_URL = re.compile(r'open\.spotify\.com/artist/([0-9A-Za-z]{22})')
+
+def open_dump(path: str) -> IO[bytes]:
+    '''Binary stream of the artist lines in a dump file, decompressing as needed.'''
+    if re.search(r'\.(tar|tar\.xz|tar\.gz|tgz|tar\.bz2)$', path):
+        tar = tarfile.open(path, mode='r|*') # streaming, no seeking back
+        for member in tar:
+            if member.isfile() and member.name.endswith('mbdump/artist'):
+                return tar.extractfile(member)
+        raise FileNotFoundError(f"No mbdump/artist member in {path}")
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    return open(path, 'rb')
+
+def iter_chunks(stream: IO[bytes], chunk_lines: int=CHUNK_LINES) -> Iterator[List[bytes]]:
+    chunk = []
+    for line in stream:
+        chunk.append(line)
+        if len(chunk) == chunk_lines:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+def parse_chunk(lines: List[bytes]) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]], List[Tuple[str, str]], int]:
+    '''Extract (mbid, name), (mbid, alias) and (mbid, spotify_id) from a chunk of
+    dump lines. Runs in the worker processes. Also returns the number of lines that
+    could not be parsed.'''
+
+    artists, aliases, spotify_ids, num_bad = [], [], [], 0
+    for line in lines:
+        try:
+            artist = json.loads(line)
+            mbid, name = artist['id'], artist['name']
+        except (ValueError, KeyError, TypeError):
+            num_bad += 1
+            continue
+        artists.append((mbid, name))
+        for alias in artist.get('aliases') or []:
+            if alias.get('name') and alias['name'] != name:
+                aliases.append((mbid, alias['name']))
+        for relation in artist.get('relations') or []:
+            url = (relation.get('url') or {}).get('resource', '')
+            match = SPOTIFY_ARTIST_URL.search(url)
+            if match:
+                spotify_ids.append((mbid, match.group(1)))
+    return artists, aliases, spotify_ids, num_bad
+
+def import_dump(path: str, processes: int=None, chunk_lines: int=CHUNK_LINES) -> None:
+    '''Import all artists in a dump into the names store. Chunks are parsed in a
+    process pool, with at most 2 chunks per process in flight, and written to the
+    store in order by this process.'''
+
+    store = get_names_store()
+    processes = processes or os.cpu_count()
+    start_time = time.time()
+    counts = {'lines': 0, 'new': 0, 'aliases': 0, 'spotify_ids': 0, 'bad': 0}
+
+    def store_result(num_chunk_lines, result) -> None:
+        artists, aliases, spotify_ids, num_bad = result.get()
+        counts['new'] += store.add(artists, source='dump')
+        store.add_links(aliases, spotify_ids)
+        counts['lines'] += num_chunk_lines
+        counts['aliases'] += len(aliases)
+        counts['spotify_ids'] += len(spotify_ids)
+        counts['bad'] += num_bad
+
+    with open_dump(path) as stream, Pool(processes) as pool:
+        in_flight = deque()
+        for i, chunk in enumerate(iter_chunks(stream, chunk_lines), start=1):
+            in_flight.append((len(chunk), pool.apply_async(parse_chunk, (chunk,))))
+            if len(in_flight) >= 2*processes:
+                store_result(*in_flight.popleft())
+            if i % 20 == 0:
+                logger.info(f"{counts['lines']} lines, {counts['new']} new artists, {counts['lines']/(time.time() - start_time):.0f} lines/s.")
+        while len(in_flight) > 0:
+            store_result(*in_flight.popleft())
+
+    logger.info(f"Imported {path} in {time.time() - start_time:.0f} s: {counts['lines']} lines, {counts['new']} new artists, "
+                f"{counts['aliases']} aliases, {counts['spotify_ids']} Spotify IDs, {counts['bad']} unparseable lines.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a MusicBrainz artist JSON dump into the names store.")
+    parser.add_argument("path", help="artist.tar.xz, or the mbdump/artist file (optionally .gz/.bz2/.xz)")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    import_dump(args.path, processes=args.processes)
@@ -0,0 +1,275 @@
+from urllib3.util.retry import Retry
+
+import os, sys, json, time, atexit, bisect, threading
+from contextlib import contextmanager
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+
+import budget
+from settings import get_config
+
+'''
+Request metrics for every Spotify Web API call and artist page fetch, kept per
+endpoint (the spotipy method name, or 'artist_page') and per budget stage:
+
+- calls, failed calls, and the items returned (e.g. 50 for a full artists batch)
+- a histogram of call latency, from sending the request until the response was
+  read, including any retries; and the time spent waiting beforehand for the
+  request budget and the rate limiter
+- status codes of the final responses, and of the responses that were retried
+  (e.g. 429), with the Retry-After delays the server asked for
+- bytes received
+
+The metrics are written as a JSON summary and as a Prometheus textfile (for the
+node_exporter textfile collector) to CACHE_DIR/metrics/, every
+config.json["metrics"]["export_interval_seconds"] during a run and once at its end.
+The files are named after the script being run, e.g.
+request_metrics.Editorial_playlists_info.prom.
+'''
+
+config = get_config()
+METRICS_DIR = config['paths']['cache_dir'] + "metrics/"
+METRICS_FILE = config['filenames']['request_metrics']
+EXPORT_INTERVAL = config['metrics']['export_interval_seconds']
+LATENCY_BUCKETS = config['metrics']['latency_buckets_seconds']
+
+def run_name() -> str:
+    script = os.path.basename(sys.argv[0]) if len(sys.argv) > 0 else ''
+    return script[:-3] if script.endswith('.py') else 'interactive'
+
+def count_items(response: Any) -> int:
+    '''Number of entities in an API response: the length of its page of items or of
+    its list of entities (not counting None, for unknown IDs), or 1.'''
+    if isinstance(response, list):
+        return sum(entity is not None for entity in response)
+    if not isinstance(response, dict):
+        return 0 if response is None else 1
+    if isinstance(response.get('items'), list):
+        return len(response['items'])
+    if len(response) == 1: # e.g. {'artists': [...]}, or {'artists': {'items': [...]}} from search
+        return count_items(next(iter(response.values())))
+    return 1
+
+class EndpointMetrics:
+    __slots__ = ('calls', 'errors', 'items', 'latency_buckets', 'latency_sum', 'wait_sum',
+                 'statuses', 'retried_statuses', 'retry_after_count', 'retry_after_sum', 'bytes')
+
+    def __init__(self):
+        self.calls, self.errors, self.items = 0, 0, 0
+        self.latency_buckets = [0]*(len(LATENCY_BUCKETS) + 1) # the last one is +Inf
+        self.latency_sum, self.wait_sum = 0., 0.
+        self.statuses, self.retried_statuses = {}, {}
+        self.retry_after_count, self.retry_after_sum = 0, 0.
+        self.bytes = 0
+
+    def latency_quantile(self, quantile: float) -> float:
+        '''Upper bound of the histogram bucket holding the quantile (None if +Inf).'''
+        target, total = quantile*self.calls, 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets):
+            total += count
+            if total >= target:
+                return bound
+        return None
+
+    def summary(self, seconds: float) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'items': self.items,
+            'items_per_request': self.items/self.calls if self.calls > 0 else None,
+            'calls_per_second': self.calls/seconds if seconds > 0 else None,
+            'latency_mean_seconds': self.latency_sum/self.calls if self.calls > 0 else None,
+            'latency_p50_seconds': self.latency_quantile(0.5),
+            'latency_p95_seconds': self.latency_quantile(0.95),
+            'latency_buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], self.latency_buckets)),
+            'wait_seconds': self.wait_sum,
+            'statuses': dict(self.statuses),
+            'retried_statuses': dict(self.retried_statuses),
+            'throttled': self.statuses.get('429', 0) + self.retried_statuses.get('429', 0),
+            'retry_after_count': self.retry_after_count,
+            'retry_after_seconds': self.retry_after_sum,
+            'bytes': self.bytes
+        }
+
+class Call:
+    '''Timing of one call, see RequestMetrics.measure.'''
+    __slots__ = ('endpoint', 'stage', 'start', 'sent', 'items')
+
+    def __init__(self, endpoint: str, stage: str):
+        self.endpoint, self.stage = endpoint, stage
+        self.start, self.sent = time.monotonic(), None
+        self.items = 0
+
+    def send(self) -> None:
+        '''Mark the end of the wait for the budget and rate limiter.'''
+        self.sent = time.monotonic()
+
+class RequestMetrics:
+    '''Process-wide metrics store, safe to share between threads. Calls are measured
+    with measure(); the sessions they go through report their responses with
+    response_hook and MeteredRetry, and these are attributed to the call in
+    progress on the same thread.'''
+    def __init__(self, name: str=None):
+        self.name = name or run_name()
+        self.started_at = time.time()
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get(self, endpoint: str, stage: str) -> EndpointMetrics:
+        '''Metrics of an endpoint and stage; call with the lock held.'''
+        key = (endpoint, stage)
+        if key not in self.endpoints:
+            self.endpoints[key] = EndpointMetrics()
+        return self.endpoints[key]
+
+    def current(self) -> Tuple[str, str]:
+        call = getattr(self.local, 'call', None)
+        return (call.endpoint, call.stage) if call is not None else ('other', budget.current_stage.get())
+
+    @contextmanager
+    def measure(self, endpoint: str):
+        '''Measure the call made in the block: call send() on the yielded Call once the
+        request is about to go out, and set its items from the response. If the block
+        fails before send() (e.g. with BudgetExhausted), only the wait is recorded.'''
+        call = self.local.call = Call(endpoint, budget.current_stage.get())
+        failed = False
+        try:
+            yield call
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.local.call = None
+            end = time.monotonic()
+            with self.lock:
+                metrics = self.get(call.endpoint, call.stage)
+                metrics.wait_sum += (call.sent or end) - call.start
+                if call.sent is not None:
+                    latency = end - call.sent
+                    metrics.calls += 1
+                    metrics.errors += failed
+                    metrics.items += call.items
+                    metrics.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+                    metrics.latency_sum += latency
+
+    def response_hook(self, response, *args, **kwargs):
+        '''requests response hook: the status and size of a final response.'''
+        endpoint, stage = self.current()
+        status, size = str(response.status_code), len(response.content)
+        with self.lock:
+            metrics = self.get(endpoint, stage)
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.bytes += size
+        return response
+
+    def record_retry(self, status: str, retry_after: str=None) -> None:
+        '''A response (or connection error) that is about to be retried.'''
+        endpoint, stage = self.current()
+        with self.lock:
+            metrics = self.get(endpoint, stage)
+            metrics.retried_statuses[status] = metrics.retried_statuses.get(status, 0) + 1
+            if retry_after is not None:
+                metrics.retry_after_count += 1
+                try:
+                    metrics.retry_after_sum += float(retry_after)
+                except ValueError: # an HTTP date
+                    pass
+
+    def summary(self) -> Dict[str, Any]:
+        seconds = time.time() - self.started_at
+        with self.lock:
+            endpoints = [
+                dict(endpoint=endpoint, stage=stage, **metrics.summary(seconds))
+                for (endpoint, stage), metrics in sorted(self.endpoints.items())
+            ]
+        return {'run': self.name, 'pid': os.getpid(), 'started_at': self.started_at, 'seconds': seconds, 'endpoints': endpoints}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        def metric(name: str, kind: str, description: str, samples: List[Tuple[str, Dict[str, str], float]]) -> None:
+            lines.append(f'# HELP serch_{name} {description}')
+            lines.append(f'# TYPE serch_{name} {kind}')
+            for suffix, labels, value in samples:
+                labels = ','.join('{:s}="{:s}"'.format(key, str(value)) for key, value in dict(run=self.name, **labels).items())
+                lines.append(f'serch_{name}{suffix}{{{labels}}} {value}')
+
+        with self.lock:
+            endpoints = [(dict(endpoint=endpoint, stage=stage), metrics) for (endpoint, stage), metrics in sorted(self.endpoints.items())]
+            histogram = []
+            for labels, m in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], m.latency_buckets):
+                    cumulative += count
+                    histogram.append(('_bucket', dict(labels, le=str(bound)), cumulative))
+                histogram.extend([('_sum', labels, m.latency_sum), ('_count', labels, m.calls)])
+            metric('request_duration_seconds', 'histogram', 'Latency of calls, including retries.', histogram)
+            counters = [
+                ('request_errors_total', 'Calls that failed.', lambda m: m.errors),
+                ('request_items_total', 'Entities returned by calls.', lambda m: m.items),
+                ('request_wait_seconds_total', 'Time waited for the request budget and rate limiter.', lambda m: m.wait_sum),
+                ('retry_after_total', 'Retried responses with a Retry-After header.', lambda m: m.retry_after_count),
+                ('retry_after_seconds_total', 'Retry-After delays asked for.', lambda m: m.retry_after_sum),
+                ('response_bytes_total', 'Bytes received in final responses.', lambda m: m.bytes)
+            ]
+            for name, description, value in counters:
+                metric(name, 'counter', description, [('', labels, value(m)) for labels, m in endpoints])
+            metric('responses_total', 'counter', 'Final responses, by status code.', [
+                ('', dict(labels, status=status), count) for labels, m in endpoints for status, count in sorted(m.statuses.items())
+            ])
+            metric('retried_responses_total', 'counter', 'Responses (or errors) that were retried, by status code.', [
+                ('', dict(labels, status=status), count) for labels, m in endpoints for status, count in sorted(m.retried_statuses.items())
+            ])
+        return '\n'.join(lines) + '\n'
+
+    def export(self) -> None:
+        '''Write the JSON summary and the Prometheus textfile (atomically).'''
+        if len(self.endpoints) == 0:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        stem = METRICS_DIR + "{:s}.{:s}".format(METRICS_FILE, self.name)
+        for path, text in [(stem + '.json', json.dumps(self.summary(), indent=2)), (stem + '.prom', self.to_prometheus())]:
+            with open(path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)
+
+    def log_summary(self) -> None:
+        for endpoint in self.summary()['endpoints']:
+            logger.info("{:s} ({:s}): {:d} calls, {:d} failed, {:.1f} items/call, mean {:.3f}s, {:d} throttled, waited {:.0f}s.".format(
+                endpoint['endpoint'], endpoint['stage'], endpoint['calls'], endpoint['errors'], endpoint['items_per_request'] or 0.,
+                endpoint['latency_mean_seconds'] or 0., endpoint['throttled'], endpoint['wait_seconds']))
+
+class MeteredRetry(Retry):
+    '''urllib3 retry policy that reports each response it is about to retry (e.g. a
+    429 and its Retry-After) to the request metrics. Retries happen inside the
+    transport, so the response hook only ever sees the final response.'''
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None:
+            get_metrics().record_retry(str(response.status), response.headers.get('Retry-After'))
+        else:
+            get_metrics().record_retry(type(error).__name__ if error is not None else 'error')
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+metrics = None
+metrics_lock = threading.Lock()
+def get_metrics() -> RequestMetrics:
+    '''The process-wide request metrics, exported periodically from a background
+    thread and at exit.'''
+    global metrics
+    with metrics_lock:
+        if metrics is None:
+            metrics = RequestMetrics()
+            stop = threading.Event()
+            def export_periodically():
+                while not stop.wait(EXPORT_INTERVAL):
+                    metrics.export()
+            threading.Thread(target=export_periodically, name='metrics-export', daemon=True).start()
+            def export_at_exit():
+                stop.set()
+                metrics.export()
+                metrics.log_summary()
+            atexit.register(export_at_exit)
+    return metrics
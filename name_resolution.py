@@ -0,0 +1,127 @@
+import sqlite3
+import threading, time, os, unicodedata
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+from settings import get_config
+
+'''
+Local cache of the artist name -> Spotify ID resolution. Every artist on every
+search page received is stored under its normalized name, so a later lookup of a
+name that appeared among the candidates of an earlier search (e.g. a repeat, or a
+case or diacritic variant, of a MusicBrainz name) is resolved without a request.
+Searches that found no exact match are stored as negative results, which expire
+after config.json["name_resolution"]["negative_ttl_hours"], so that artists new to
+Spotify are eventually found.
+
+Names are normalized by NFKD decomposition, dropping combining marks (diacritics),
+casefolding and collapsing whitespace: "Beyoncé", "BEYONCE" and "beyonce " are the
+same name.
+
+Negative results record the depth of the search that missed: 'search' for the
+limit-10 search and 'deep' for the search through all 1,000 results, which implies
+the first.
+'''
+
+config = get_config()
+CACHE_DIR = config['paths']['cache_dir']
+NAME_RESOLUTION_FILE = config['filenames']['name_resolution']
+NEGATIVE_TTL_HOURS = config['name_resolution']['negative_ttl_hours']
+
+DEPTHS = {'search': 0, 'deep': 1}
+
+def normalize_name(name: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', str(name))
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.casefold().split())
+
+class NameResolutionCache:
+    '''SQLite-backed store of normalized name -> candidate IDs (with their popularity,
+    the most popular candidate wins) and of unexpired negative results. Safe to share
+    between threads.'''
+    def __init__(self, path: str, negative_ttl_hours: float=NEGATIVE_TTL_HOURS):
+        self.path = path
+        self.negative_ttl = negative_ttl_hours*3600.
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS candidates (
+            name TEXT NOT NULL,
+            spotify_id TEXT NOT NULL,
+            popularity INTEGER NOT NULL,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (name, spotify_id)
+        )''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS negatives (
+            name TEXT PRIMARY KEY,
+            depth INTEGER NOT NULL,
+            searched_at REAL NOT NULL
+        )''')
+        self.conn.commit()
+
+    def lookup(self, name: str, depth: str='search') -> Tuple[bool, str]:
+        '''(True, spotify_id) if the name is among stored candidates, (True, None) if a
+        search at least as deep as depth missed it recently, (False, None) if it is
+        unknown and must be searched.'''
+        key = normalize_name(name)
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT spotify_id FROM candidates WHERE name = ? ORDER BY popularity DESC, seen_at LIMIT 1', (key,)
+            ).fetchone()
+            if row is None:
+                row = self.conn.execute(
+                    'SELECT NULL FROM negatives WHERE name = ? AND depth >= ? AND searched_at >= ?',
+                    (key, DEPTHS[depth], time.time() - self.negative_ttl)
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, row[0]
+
+    def record_page(self, artists: List[Dict[str, Any]]) -> None:
+        '''Store every artist object of a search results page as a candidate for its name.'''
+        now = time.time()
+        rows = [
+            (normalize_name(artist['name']), artist['id'], artist.get('popularity') or 0, now)
+            for artist in artists if artist is not None and artist.get('name')
+        ]
+        if len(rows) == 0:
+            return
+        with self.lock:
+            self.conn.executemany(
+                '''INSERT INTO candidates VALUES (?, ?, ?, ?)
+                ON CONFLICT (name, spotify_id) DO UPDATE SET popularity = excluded.popularity''', rows)
+            self.conn.commit()
+
+    def record_miss(self, name: str, depth: str='search') -> None:
+        '''Store a negative result, keeping the deeper of any earlier unexpired one.'''
+        key, now = normalize_name(name), time.time()
+        with self.lock:
+            self.conn.execute(
+                '''INSERT INTO negatives VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    depth = CASE WHEN searched_at >= ? THEN MAX(depth, excluded.depth) ELSE excluded.depth END,
+                    searched_at = excluded.searched_at''',
+                (key, DEPTHS[depth], now, now - self.negative_ttl)
+            )
+            self.conn.commit()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        return f'{self.hits} of {total} names resolved locally.'
+
+resolution_cache = None
+resolution_cache_lock = threading.Lock()
+def get_resolution_cache() -> NameResolutionCache:
+    '''The process-wide name resolution cache, opened on first use.'''
+    global resolution_cache
+    with resolution_cache_lock:
+        if resolution_cache is None:
+            resolution_cache = NameResolutionCache(CACHE_DIR + NAME_RESOLUTION_FILE)
+    return resolution_cache
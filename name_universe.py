@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import os, json, hashlib
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple
+
+import table_storage
+from table_storage import read_table
+from settings import get_config
+
+'''
+The cleaned universe of MusicBrainz artist names (de-duplicated, strings only, no
+empty or bracketed names, lowercased), built once from the artist names table with
+vectorized string operations and kept as a compact binary artifact under
+CACHE_DIR: a NumPy archive of the names as one UTF-8 buffer, separated by NUL
+characters, with the character offset of each name.
+
+The artifact records the fingerprint of the source table (name, size and mtime of
+each file) and a hash of its contents. When the fingerprint has changed, the
+contents are hashed again, and the names are only rebuilt if they differ, so that
+e.g. a copy of an unchanged table does not force a rebuild.
+'''
+
+config = get_config()
+CACHE_DIR = config['paths']['cache_dir']
+ARTIFACT_DIR = CACHE_DIR + "name_universe/"
+SEPARATOR = '\x00'
+
+def clean_artist_names(names: pd.Series) -> pd.Series:
+    '''De-duplicate (keeping first occurrences), drop anything that is not a
+    non-empty string or that contains brackets, and lowercase.'''
+    names = names[~names.duplicated()]
+    names = names[names.str.len() > 0] # NaN, and so dropped, for non-strings
+    names = names[~names.str.contains(r'[\[\]]', regex=True).astype(bool)]
+    return names.astype(object).str.lower() # Python's lowercasing, whatever the string dtype
+
+def source_files(table_path: str) -> List[str]:
+    if table_storage.is_parquet():
+        return table_storage.list_partitions(table_path)
+    return [table_path]
+
+def fingerprint(table_path: str) -> List[Tuple[str, int, int]]:
+    return [
+        (os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns)
+        for path in source_files(table_path)
+    ]
+
+def content_hash(table_path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for path in source_files(table_path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+class NameUniverse:
+    '''The cleaned names of one table, loaded from (or built into) its artifact.'''
+    def __init__(self, table_path: str, column: str='artist_name'):
+        self.table_path = table_path
+        self.column = column
+        stem = "{:s}.{:s}.{:s}".format(
+            os.path.basename(table_path),
+            hashlib.sha1(os.path.abspath(table_path).encode('utf-8')).hexdigest()[:8],
+            column
+        )
+        self.artifact_path = ARTIFACT_DIR + stem + ".npz"
+
+    def read_meta(self) -> Dict:
+        '''Metadata of the artifact, or None if there is no readable artifact.'''
+        try:
+            with np.load(self.artifact_path) as artifact:
+                return json.loads(str(artifact['meta']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def is_current(self, meta: Dict) -> bool:
+        '''Whether the artifact was built from the table as it is now. Rewrites the
+        recorded fingerprint if only that has changed.'''
+        current = [list(entry) for entry in fingerprint(self.table_path)]
+        if meta['fingerprint'] == current:
+            return True
+        if meta['hash'] != content_hash(self.table_path):
+            return False
+        meta['fingerprint'] = current
+        with np.load(self.artifact_path) as artifact:
+            self.save(artifact['text'], artifact['offsets'], meta)
+        return True
+
+    def save(self, text: np.ndarray, offsets: np.ndarray, meta: Dict) -> None:
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        with open(self.artifact_path + '.tmp', 'wb') as f:
+            np.savez(f, text=text, offsets=offsets, meta=np.array(json.dumps(meta)))
+        os.replace(self.artifact_path + '.tmp', self.artifact_path)
+
+    def build(self) -> None:
+        '''Clean the names of the table and write the artifact.'''
+        meta = {'fingerprint': [list(entry) for entry in fingerprint(self.table_path)], 'hash': content_hash(self.table_path)}
+        names = clean_artist_names(read_table(self.table_path, columns=[self.column])[self.column])
+        lengths = names.str.len().to_numpy(dtype=np.int64)
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(lengths + 1, out=offsets[1:]) # each name is followed by a separator
+        text = np.frombuffer((SEPARATOR.join(names) + SEPARATOR).encode('utf-8'), dtype=np.uint8)
+        self.save(text, offsets, meta)
+        logger.info(f"Built the cleaned names artifact of {self.table_path}: {len(names)} names.")
+
+    def load(self) -> List[str]:
+        '''The cleaned names, in table order, rebuilding the artifact first if needed.'''
+        meta = self.read_meta()
+        if meta is None or not self.is_current(meta):
+            self.build()
+        with np.load(self.artifact_path) as artifact:
+            text, offsets = artifact['text'].tobytes().decode('utf-8'), artifact['offsets']
+        names = text.split(SEPARATOR)[:-1]
+        if len(names) != len(offsets) - 1: # a name containing the separator
+            names = [text[start:end - 1] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+        return names
+
+def load_clean_names(table_path: str, column: str='artist_name') -> List[str]:
+    return NameUniverse(table_path, column).load()
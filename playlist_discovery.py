@@ -0,0 +1,128 @@
+from spotipy.exceptions import SpotifyException
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+
+from spotify_client import sp, gather
+from budget import get_planner
+
+'''
+Discovery of Spotify's own public playlists by browsing categories in every market.
+All (market, category) pairs are crawled concurrently through the shared,
+rate-limited client, as in discography.py: the first page of every pair is
+requested at once, then all the remaining pages (by offset, up to and including
+the last one) of the pairs with more than one page.
+
+Playlists are de-duplicated across markets and categories as they are found: a
+playlist that appears in 80 markets is recorded once, with the category it was
+first found in and all the markets (and categories) it appears in.
+
+The items of playlists are fetched in the same way, through the playlist items
+endpoint with a fields projection, so only the date each track was added and the
+IDs of the track and its artists are transferred, for all the items of each
+playlist rather than only the first page.
+'''
+
+PAGE_LIMIT = 50 # maximum for categories, category_playlists and user_playlists
+PLAYLIST_ITEMS_LIMIT = 100 # maximum for playlist_items
+PLAYLIST_ITEM_FIELDS = 'items(added_at,track(id,artists(id))),total,next'
+USER_ID = 'spotify'
+EMPTY_PAGE = {'items': [], 'total': 0, 'next': None}
+
+def fetch_page(method: str, key: str, limit: int=PAGE_LIMIT, **kwargs) -> Dict[str, Any]:
+    '''One page of a paged endpoint (the paging object under key, if the endpoint
+    wraps it), or an empty page if the endpoint has nothing for these arguments
+    (e.g. a category that is not browsable in a market).'''
+    try:
+        response = sp.call(method, limit=limit, **kwargs)
+    except SpotifyException as e:
+        if e.http_status != 404:
+            raise
+        logger.info(f"{method}: nothing found for {kwargs}.")
+        return EMPTY_PAGE
+    return response[key] if key is not None else response
+
+def fetch_all_items(method: str, key: str, requests: List[Dict[str, Any]], limit: int=PAGE_LIMIT) -> List[List[Dict[str, Any]]]:
+    '''All items of a paged endpoint, for each set of keyword arguments in requests,
+    in pages of limit items.'''
+
+    first_pages = gather([sp.executor.submit(fetch_page, method, key, limit, **kwargs) for kwargs in requests])
+
+    '''Remaining pages, by offset, up to the total of the first page'''
+    later_requests = [
+        (i, offset)
+        for i, first_page in enumerate(first_pages) if first_page['next']
+        for offset in range(limit, first_page['total'], limit)
+    ]
+    futures = [sp.executor.submit(fetch_page, method, key, limit, offset=offset, **requests[i]) for i, offset in later_requests]
+    items = [list(first_page['items']) for first_page in first_pages]
+    for (i, _), page in zip(later_requests, gather(futures)):
+        items[i].extend(page['items'])
+    if len(later_requests) > 0:
+        logger.info(f'{method}: fetched {len(later_requests)} further pages for {len(set(i for i, _ in later_requests))} requests.')
+
+    return [[item for item in request_items if item is not None] for request_items in items]
+
+def is_spotify_public(playlist: Dict[str, Any]) -> bool:
+    return playlist['owner']['id'] == USER_ID and playlist['public']
+
+def get_market_categories(markets: List[str]) -> List[List[Dict[str, Any]]]:
+    '''The categories (id and name) of each market.'''
+    return fetch_all_items('categories', 'categories', [{'country': market} for market in markets])
+
+def get_playlists_items(playlist_ids: List[str]) -> List[List[Dict[str, Any]]]:
+    '''All the items of each playlist, projected to PLAYLIST_ITEM_FIELDS (the date each
+    track was added, and the IDs of the track and its artists). Episodes are left out.'''
+    return fetch_all_items(
+        'playlist_items', None,
+        [{'playlist_id': playlist_id, 'fields': PLAYLIST_ITEM_FIELDS, 'additional_types': ('track',)} for playlist_id in playlist_ids],
+        limit=PLAYLIST_ITEMS_LIMIT
+    )
+
+def discover_playlists(markets: List[str]) -> Dict[str, Dict[str, Any]]:
+    '''Spotify's public playlists in the categories of the given markets, by playlist
+    ID. Each record holds the playlist's name, owner and public flag, the category it
+    was first found in, and the lists of all markets and categories it appears in.
+    If today's request budget cannot cover a first page for every (market, category)
+    pair, only the pairs that fit are crawled, market by market.'''
+
+    market_categories = get_market_categories(markets)
+    pairs = [(market, category) for market, categories in zip(markets, market_categories) for category in categories]
+    num_affordable = get_planner().affordable('playlists', len(pairs))
+    if num_affordable < len(pairs):
+        logger.info(f"Crawling {num_affordable} of {len(pairs)} market and category pairs, as today's budget allows.")
+        pairs = pairs[:num_affordable]
+    logger.info(f"Crawling {len(pairs)} categories across {len(markets)} markets.")
+
+    playlists_by_pair = fetch_all_items(
+        'category_playlists', 'playlists',
+        [{'category_id': category['id'], 'country': market} for market, category in pairs]
+    )
+
+    '''Record each playlist once, with all the markets and categories it appears in'''
+    seen = {}
+    for (market, category), playlists in zip(pairs, playlists_by_pair):
+        for playlist in playlists:
+            if not is_spotify_public(playlist):
+                continue
+            record = seen.get(playlist['id'])
+            if record is None:
+                record = seen[playlist['id']] = {
+                    'playlist_name': playlist['name'],
+                    'playlist_id': playlist['id'],
+                    'playlist_owner': playlist['owner']['id'],
+                    'public': playlist['public'],
+                    'category_id': category['id'],
+                    'category_name': category['name'],
+                    'markets': [],
+                    'category_ids': []
+                }
+            if market not in record['markets']:
+                record['markets'].append(market)
+            if category['id'] not in record['category_ids']:
+                record['category_ids'].append(category['id'])
+    logger.info(f"Found {len(seen)} unique playlists across {len(markets)} markets.")
+
+    return seen
@@ -0,0 +1,131 @@
+import sqlite3
+import threading, time, json, zlib, os
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+from settings import get_config
+
+'''
+On-disk cache of Spotify Web API responses, one row per (endpoint, entity ID). Rows
+expire after a per-endpoint TTL, and the oldest rows are evicted once the stored
+payloads exceed a size limit.
+'''
+
+config = get_config()
+CACHE_DIR = config['paths']['cache_dir']
+RESPONSE_CACHE_FILE = config['filenames']['response_cache']
+MAX_SIZE_MB = config['response_cache']['max_size_mb']
+TTL_HOURS = config['response_cache']['ttl_hours']
+
+class ResponseCache:
+    '''SQLite-backed cache of JSON payloads. Payloads are zlib-compressed, and the
+    running total of their sizes is kept in memory so that eviction checks are free.
+    Safe to share between threads.'''
+    def __init__(self, path: str, ttl_hours: Dict[str, float], max_size_mb: float):
+        self.path = path
+        self.ttls = {endpoint: hours*3600. for endpoint, hours in ttl_hours.items()}
+        self.max_size = int(max_size_mb * 1024**2)
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            endpoint TEXT NOT NULL,
+            key TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (endpoint, key)
+        )''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at)')
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get_many(self, endpoint: str, keys: List[str]) -> Dict[str, Any]:
+        '''Return the unexpired payloads stored for the given keys. Keys that are
+        missing or expired are absent from the returned dict.'''
+
+        if endpoint not in self.ttls:
+            return {}
+        oldest = time.time() - self.ttls[endpoint]
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            for i in range(0, len(keys), 500): # SQLite host-parameter limit
+                keys_batch = keys[i:i + 500]
+                rows = self.conn.execute(
+                    'SELECT key, payload FROM responses WHERE endpoint = ? AND fetched_at >= ? AND key IN ({:s})'.format(
+                        ','.join('?'*len(keys_batch))),
+                    [endpoint, oldest] + keys_batch
+                ).fetchall()
+                for key, payload in rows:
+                    found[key] = json.loads(zlib.decompress(payload))
+        return found
+
+    def put_many(self, endpoint: str, items: Dict[str, Any]) -> None:
+        '''Store payloads for the given keys, replacing any older copies. None payloads
+        (e.g. unknown IDs) are not stored, so they are retried next time.'''
+
+        if endpoint not in self.ttls:
+            return
+        now = time.time()
+        rows = []
+        for key, payload in items.items():
+            if payload is None:
+                continue
+            blob = zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+            rows.append((endpoint, key, blob, len(blob), now))
+        if len(rows) == 0:
+            return
+        with self.lock:
+            replaced = 0
+            for i in range(0, len(rows), 500):
+                keys_batch = [row[1] for row in rows[i:i + 500]]
+                replaced += self.conn.execute(
+                    'SELECT COALESCE(SUM(size), 0) FROM responses WHERE endpoint = ? AND key IN ({:s})'.format(
+                        ','.join('?'*len(keys_batch))),
+                    [endpoint] + keys_batch
+                ).fetchone()[0]
+            self.conn.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', rows)
+            self.conn.commit()
+            self.size += sum(row[3] for row in rows) - replaced
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self) -> None:
+        '''Drop expired rows, then the oldest rows until the cache is back under 90%
+        of its size limit. Must be called with the lock held.'''
+
+        for endpoint, ttl in self.ttls.items():
+            self.conn.execute('DELETE FROM responses WHERE endpoint = ? AND fetched_at < ?', (endpoint, time.time() - ttl))
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+        target = int(0.9 * self.max_size)
+        while self.size > target:
+            rows = self.conn.execute('SELECT rowid, size FROM responses ORDER BY fetched_at LIMIT 100').fetchall()
+            if len(rows) == 0:
+                break
+            self.conn.executemany('DELETE FROM responses WHERE rowid = ?', [(rowid,) for rowid, _ in rows])
+            self.size -= sum(size for _, size in rows)
+        self.conn.commit()
+        logger.info(f'Evicted cached responses, cache is now {self.size/1024**2:.1f} MB.')
+
+def request_key(entity_id: str, **kwargs) -> str:
+    '''Cache key for a single-entity request, including any query parameters.'''
+    if len(kwargs) == 0:
+        return entity_id
+    return entity_id + '?' + '&'.join(f'{key}={kwargs[key]}' for key in sorted(kwargs))
+
+cache = None
+cache_lock = threading.Lock()
+def get_cache() -> ResponseCache:
+    '''The process-wide response cache, opened on first use.'''
+    global cache
+    with cache_lock:
+        if cache is None:
+            cache = ResponseCache(CACHE_DIR + RESPONSE_CACHE_FILE, TTL_HOURS, MAX_SIZE_MB)
+    return cache
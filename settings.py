@@ -0,0 +1,26 @@
+import os, json, threading
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple
+
+'''
+Access to config.json for all modules. The file is found next to this module
+(or at the path in the SERCH_CONFIG environment variable), not in the current
+working directory, so the modules can be imported from notebooks and jobs that
+run elsewhere. It is read on first use, once per process.
+'''
+
+CONFIG_PATH = os.environ.get('SERCH_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json'))
+
+config = None
+config_lock = threading.Lock()
+def get_config() -> Dict:
+    '''The parsed config.json, read on first use.'''
+    global config
+    with config_lock:
+        if config is None:
+            with open(CONFIG_PATH) as f:
+                config = json.load(f)
+    return config
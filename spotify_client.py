@@ -0,0 +1,267 @@
+import spotipy
+import requests
+from spotipy.oauth2 import SpotifyClientCredentials
+from spotipy.cache_handler import CacheHandler
+
+import fcntl, os, threading, time, json
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+
+from response_cache import get_cache, request_key
+from budget import get_planner, family_of, StageExecutor
+from metrics import get_metrics, count_items, MeteredRetry
+from settings import get_config
+
+'''
+Shared Spotify Web API client for all pipeline modules. Every request, from any
+thread, draws from a single process-wide token bucket, so several requests can be
+kept in flight without exceeding the request rate, is charged to the daily
+request budget (see budget.py), and is measured in the request metrics (see
+metrics.py).
+
+The client is only built when first used, so importing a module that uses `sp`
+costs no credentials handshake. The access token is cached in a file shared by
+all processes, so concurrent jobs reuse one token until it expires.
+
+Remember environment variables:
+export SPOTIPY_CLIENT_ID='your-spotify-client-id'
+export SPOTIPY_CLIENT_SECRET='your-spotify-client-secret'
+export SPOTIPY_REDIRECT_URI='your-app-redirect-url'
+'''
+
+config = get_config()
+REQUESTS_PER_SECOND = config['spotify_client']['requests_per_second']
+BURST = config['spotify_client']['burst']
+MAX_WORKERS = config['spotify_client']['max_workers']
+API_URL = config['spotify_client']['api_url'] # e.g. a local stand-in, see benchmarks/
+TOKEN_URL = config['spotify_client']['token_url']
+TOKEN_CACHE_FILE = config['paths']['cache_dir'] + config['filenames']['spotify_token']
+
+'''Where the list of entities sits in the response of each multi-ID endpoint'''
+BATCH_RESPONSE_KEYS = {'artists': 'artists', 'tracks': 'tracks', 'albums': 'albums', 'audio_features': None}
+
+class TokenBucket:
+    '''Thread-safe token bucket. Tokens refill continuously at `rate` per second,
+    up to `capacity`. acquire() blocks until a token is available.'''
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int=1) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+class SharedTokenCache(CacheHandler):
+    '''Client-credentials token shared by all processes through a file (readable by
+    the owner only). The token is also kept in memory, so the file is only read
+    again once it has expired.'''
+    def __init__(self, path: str):
+        self.path = path
+        self.token_info = None
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        '''Exclusive lock across threads and processes, held while the token is refreshed.'''
+        with self.lock, open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def get_cached_token(self) -> Dict[str, Any]:
+        if self.token_info is None:
+            try:
+                with open(self.path) as f:
+                    self.token_info = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+        return self.token_info
+
+    def save_token_to_cache(self, token_info: Dict[str, Any]) -> None:
+        self.token_info = token_info
+        with open(os.open(self.path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(token_info, f)
+        os.replace(self.path + '.tmp', self.path)
+
+class SharedClientCredentials(SpotifyClientCredentials):
+    '''Client credentials flow through a SharedTokenCache. When the token has expired,
+    only one process (and thread) requests a new one; the others wait for it and
+    then read it from the cache, so a batch of jobs starting together makes a single
+    credentials handshake.'''
+    OAUTH_TOKEN_URL = TOKEN_URL
+
+    def get_access_token(self, as_dict=True, check_cache=True):
+        token_info = self.cache_handler.get_cached_token()
+        if token_info is None or self.is_token_expired(token_info):
+            with self.cache_handler.locked():
+                self.cache_handler.token_info = None # re-read, another process may have refreshed it
+                token_info = self.cache_handler.get_cached_token()
+                if token_info is None or self.is_token_expired(token_info):
+                    token_info = self._add_custom_values_to_token_info(self._request_access_token())
+                    self.cache_handler.save_token_to_cache(token_info)
+        return token_info if as_dict else token_info['access_token']
+
+class MeteredSpotify(spotipy.Spotify):
+    '''spotipy.Spotify whose HTTP session reports responses and retries to the request
+    metrics. The retry policy is spotipy's own.'''
+    def _build_session(self):
+        super()._build_session()
+        retry = MeteredRetry(
+            total=self.retries,
+            connect=None,
+            read=False,
+            allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+            status=self.status_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist
+        )
+        adapter = requests.adapters.HTTPAdapter(max_retries=retry)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.hooks['response'].append(get_metrics().response_hook)
+
+class SpotifyClient:
+    '''Drop-in stand-in for spotipy.Spotify. Any endpoint method can be called as
+    usual (e.g. sp.artists(ids)), and is rate-limited by the shared token bucket.
+    Each worker thread gets its own spotipy.Spotify (and HTTP session), all sharing
+    the same credentials. Use submit() and map() to keep several requests in flight,
+    and entities(), cached() and map_cached() to go through the response cache.'''
+    def __init__(self, bucket: TokenBucket, max_workers: int=MAX_WORKERS):
+        self.bucket = bucket
+        self.client_credentials_manager = SharedClientCredentials(cache_handler=SharedTokenCache(TOKEN_CACHE_FILE))
+        self.local = threading.local()
+        self.executor = StageExecutor(max_workers=max_workers, thread_name_prefix='spotify')
+
+    def spotify(self) -> spotipy.Spotify:
+        '''The spotipy client for the calling thread.'''
+        if not hasattr(self.local, 'sp'):
+            self.local.sp = MeteredSpotify(client_credentials_manager=self.client_credentials_manager)
+            self.local.sp.prefix = API_URL
+        return self.local.sp
+
+    def call(self, method: str, *args, **kwargs) -> Any:
+        '''Call a spotipy endpoint method once the daily budget allows it and a token
+        is available.'''
+        with get_metrics().measure(method) as measured:
+            get_planner().acquire(family_of(method))
+            self.bucket.acquire()
+            measured.send()
+            response = getattr(self.spotify(), method)(*args, **kwargs)
+            measured.items = count_items(response)
+        return response
+
+    def __getattr__(self, method: str):
+        if not callable(getattr(spotipy.Spotify, method, None)):
+            raise AttributeError(method)
+        def rate_limited(*args, **kwargs):
+            return self.call(method, *args, **kwargs)
+        return rate_limited
+
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        '''Queue a single rate-limited request on the worker pool.'''
+        return self.executor.submit(self.call, method, *args, **kwargs)
+
+    def map(self, method: str, args_list: List[Tuple], **kwargs) -> List[Any]:
+        '''Run the same endpoint for each tuple of positional arguments in args_list,
+        with up to max_workers requests in flight. Results are returned in order.'''
+        futures = [self.submit(method, *args, **kwargs) for args in args_list]
+        return gather(futures)
+
+    def fetch_batch_and_cache(self, method: str, ids: List[str]) -> List[Any]:
+        '''Call a multi-ID endpoint and store each returned entity in the response cache.'''
+        response = self.call(method, ids)
+        items = response if BATCH_RESPONSE_KEYS[method] is None else response[BATCH_RESPONSE_KEYS[method]]
+        get_cache().put_many(method, dict(zip(ids, items)))
+        return items
+
+    def entities(self, method: str, ids: List[str], batch_size: int=50) -> List[Any]:
+        '''Fetch entities through a multi-ID endpoint (artists, tracks, albums, audio_features).
+        Entities already in the response cache are taken from there, and only the missing
+        IDs are requested, in concurrent batches of batch_size. Each batch is cached as
+        soon as it arrives, so a crashed run loses at most the batches in flight. Results
+        are returned in the same order as ids, with None for unknown IDs.'''
+
+        found = get_cache().get_many(method, ids)
+        num_cached = len(found)
+        missing = [entity_id for entity_id in dict.fromkeys(ids) if entity_id not in found]
+        missing_batches = batched(missing, batch_size)
+        futures = [self.executor.submit(self.fetch_batch_and_cache, method, batch) for batch in missing_batches]
+        for missing_batch, items in zip(missing_batches, gather(futures)):
+            found.update(zip(missing_batch, items))
+        logger.info(f'{method}: {num_cached} of {num_cached + len(missing)} entities from cache, {len(missing_batches)} requests.')
+
+        return [found.get(entity_id) for entity_id in ids]
+
+    def fetch_and_cache(self, method: str, entity_id: str, **kwargs) -> Any:
+        '''Call a single-entity endpoint and store the response in the response cache.'''
+        response = self.call(method, entity_id, **kwargs)
+        get_cache().put_many(method, {request_key(entity_id, **kwargs): response})
+        return response
+
+    def cached(self, method: str, entity_id: str, **kwargs) -> Any:
+        '''Single-entity endpoint call (e.g. artist_albums, album_tracks) that is answered
+        from the response cache when possible.'''
+        key = request_key(entity_id, **kwargs)
+        found = get_cache().get_many(method, [key])
+        if key in found:
+            return found[key]
+        return self.fetch_and_cache(method, entity_id, **kwargs)
+
+    def map_cached(self, method: str, entity_ids: List[str], **kwargs) -> List[Any]:
+        '''Like map(), for a single-entity endpoint called once per ID, but only the IDs
+        that are not in the response cache are requested.'''
+        keys = [request_key(entity_id, **kwargs) for entity_id in entity_ids]
+        found = get_cache().get_many(method, keys)
+        futures = {
+            key: self.executor.submit(self.fetch_and_cache, method, entity_id, **kwargs)
+            for key, entity_id in zip(keys, entity_ids) if key not in found
+        }
+        found.update(zip(futures.keys(), gather(list(futures.values()))))
+        return [found[key] for key in keys]
+
+def gather(futures: List[Future]) -> List[Any]:
+    '''Wait for futures in order, cancelling those not yet started if one fails.'''
+    try:
+        return [future.result() for future in futures]
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+def batched(items: List[Any], size: int) -> List[List[Any]]:
+    '''Split a list into consecutive batches of at most `size` items.'''
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+client = None
+client_lock = threading.Lock()
+def get_client() -> SpotifyClient:
+    '''The process-wide Spotify client, built on first use.'''
+    global client
+    with client_lock:
+        if client is None:
+            client = SpotifyClient(TokenBucket(REQUESTS_PER_SECOND, BURST))
+    return client
+
+class LazyClient:
+    '''Stands in for the shared SpotifyClient, which is built the first time one of
+    its attributes is used.'''
+    def __getattr__(self, name: str):
+        return getattr(get_client(), name)
+
+sp = LazyClient()
@@ -0,0 +1,163 @@
+import sqlite3
+import os, time
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple
+
+from table_storage import read_table, table_exists
+from settings import get_config
+
+'''
+Transactional ledger of the name -> Spotify ID resolution, with one row per name per
+stage. Stages claim pending names, then commit their results in bulk, so restarts
+only touch the names still pending, and no file is rewritten.
+
+Stages:
+    'search'       the limit-10 search (aih.get_artist_spotify_id, through the name
+                   resolution cache of name_resolution.py)
+    'deep_search'  the 1000-result search for names missed by 'search'
+Statuses: 'pending', 'claimed', 'found', 'missing'
+'''
+
+config = get_config()
+OUTPUT_DIR = config['paths']['output_dir']
+LEDGER_FILE = config['filenames']['stage_ledger']
+ARTIST_IDS_FILE = config['filenames']['artist_ids']
+MISSING_NAMES_FILE = config['filenames']['missing_names']
+DEEP_MISSING_NAMES_FILE = config['filenames']['deep_missing_names']
+CLAIM_TIMEOUT = 6*60*60 # claims older than this are from crashed runs, and are released
+
+class StageLedger:
+    '''SQLite-backed ledger. All writes are batched into single transactions.'''
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS ledger (
+            stage TEXT NOT NULL,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            spotify_id TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (stage, name)
+        )''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ledger_status ON ledger (stage, status, updated_at)')
+        self.conn.commit()
+
+    def add(self, stage: str, names: List[str], status: str='pending', spotify_ids: List[str]=None) -> int:
+        '''Add names to a stage, ignoring those already there. Returns the number added.'''
+        if spotify_ids is None:
+            spotify_ids = [None]*len(names)
+        now = time.time()
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO ledger (stage, name, status, spotify_id, updated_at) VALUES (?, ?, ?, ?, ?)',
+                [(stage, name, status, spotify_id, now) for name, spotify_id in zip(names, spotify_ids)]
+            )
+            return self.conn.total_changes - before
+
+    def known(self, stage: str, names: List[str]) -> set:
+        '''The subset of names that already have a row in the stage, whatever its status.'''
+        known = set()
+        for i in range(0, len(names), 500): # SQLite host-parameter limit
+            names_batch = names[i:i + 500]
+            rows = self.conn.execute(
+                'SELECT name FROM ledger WHERE stage = ? AND name IN ({:s})'.format(','.join('?'*len(names_batch))),
+                [stage] + names_batch
+            ).fetchall()
+            known.update(row[0] for row in rows)
+        return known
+
+    def claim(self, stage: str, num: int=None) -> List[str]:
+        '''Claim up to num pending names in the stage (all if num is None), oldest first.
+        Claims left behind by a crashed run are released after CLAIM_TIMEOUT.'''
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "UPDATE ledger SET status = 'pending' WHERE stage = ? AND status = 'claimed' AND updated_at < ?",
+                (stage, now - CLAIM_TIMEOUT)
+            )
+            rows = self.conn.execute(
+                "SELECT name FROM ledger WHERE stage = ? AND status = 'pending' ORDER BY updated_at, rowid LIMIT ?",
+                (stage, -1 if num is None else num)
+            ).fetchall()
+            names = [row[0] for row in rows]
+            self.conn.executemany(
+                "UPDATE ledger SET status = 'claimed', attempts = attempts + 1, updated_at = ? WHERE stage = ? AND name = ?",
+                [(now, stage, name) for name in names]
+            )
+        return names
+
+    def release(self, stage: str, names: List[str]) -> None:
+        '''Return claimed names that will not be processed in this run to pending.'''
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE ledger SET status = 'pending' WHERE stage = ? AND name = ? AND status = 'claimed'",
+                [(stage, name) for name in names]
+            )
+
+    def commit(self, stage: str, found: Dict[str, str], missing: List[str]) -> None:
+        '''Record the results of a batch of claimed names in one transaction.'''
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE ledger SET status = 'found', spotify_id = ?, updated_at = ? WHERE stage = ? AND name = ?",
+                [(spotify_id, now, stage, name) for name, spotify_id in found.items()]
+            )
+            self.conn.executemany(
+                "UPDATE ledger SET status = 'missing', updated_at = ? WHERE stage = ? AND name = ?",
+                [(now, stage, name) for name in missing]
+            )
+
+    def count(self, stage: str, status: str=None) -> int:
+        if status is None:
+            return self.conn.execute('SELECT COUNT(*) FROM ledger WHERE stage = ?', (stage,)).fetchone()[0]
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM ledger WHERE stage = ? AND status = ?', (stage, status)).fetchone()[0]
+
+    def names(self, stage: str, status: str) -> List[str]:
+        rows = self.conn.execute(
+            'SELECT name FROM ledger WHERE stage = ? AND status = ? ORDER BY updated_at, rowid', (stage, status)).fetchall()
+        return [row[0] for row in rows]
+
+    def import_legacy_files(self) -> None:
+        '''One-off import of the artist_ids, missing_names and deep_missing_names tables
+        that held this state before the ledger existed.'''
+
+        if table_exists(OUTPUT_DIR + ARTIST_IDS_FILE):
+            artist_ids_df = read_table(OUTPUT_DIR + ARTIST_IDS_FILE, columns=['names', 'ids']).dropna()
+            names = [str(name).lower() for name in artist_ids_df['names']]
+            self.add('search', names, status='found', spotify_ids=artist_ids_df['ids'].tolist())
+        if table_exists(OUTPUT_DIR + MISSING_NAMES_FILE):
+            missing_names_df = read_table(OUTPUT_DIR + MISSING_NAMES_FILE)
+            names = [str(name).lower() for name in missing_names_df.iloc[:, 0].dropna()] # header varies
+            self.add('search', names, status='missing')
+            self.add('deep_search', names, status='pending')
+        if table_exists(OUTPUT_DIR + DEEP_MISSING_NAMES_FILE):
+            deep_missing_names_df = read_table(OUTPUT_DIR + DEEP_MISSING_NAMES_FILE)
+            names = [str(name).lower() for name in deep_missing_names_df.iloc[:, 0].dropna()]
+            self.add('search', names, status='missing')
+            self.add('deep_search', names, status='missing')
+            with self.conn: # in case a name was also left in the missing names file
+                self.conn.executemany(
+                    "UPDATE ledger SET status = 'missing' WHERE stage = 'deep_search' AND name = ?",
+                    [(name,) for name in names]
+                )
+        logger.info(f"Imported legacy files into the ledger: {self.count('search')} names searched, "
+                    f"{self.count('deep_search', 'pending')} pending deep search.")
+
+ledger = None
+def get_ledger() -> StageLedger:
+    '''The name -> ID ledger, opened on first use. If it is new, the legacy files
+    are imported into it.'''
+    global ledger
+    if ledger is None:
+        is_new = not os.path.exists(OUTPUT_DIR + LEDGER_FILE)
+        ledger = StageLedger(OUTPUT_DIR + LEDGER_FILE)
+        if is_new:
+            ledger.import_legacy_files()
+    return ledger
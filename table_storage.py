@@ -0,0 +1,192 @@
+import pandas as pd
+import numpy as np
+import os, glob, uuid
+from datetime import datetime
+
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+from typing import List, Dict, Tuple, Any
+from settings import get_config
+
+'''
+Storage layer for the output tables named in config.json. Tables are addressed by
+their CSV path (e.g. OUTPUT_DIR + "Spotify_artist_info.csv"), whatever the backend:
+
+- "csv": the original single CSV file, appended to in place.
+- "parquet": a directory named after the CSV (e.g. OUTPUT_DIR + "Spotify_artist_info/")
+  holding append-only Parquet partitions, one per append, named by date. Reads only
+  load the requested columns, and row filters are pushed down to the Parquet reader.
+
+Filters use the pyarrow DNF format in both backends, e.g. [('ids', 'in', artist_ids)].
+pyarrow is only needed for the Parquet backend.
+'''
+
+config = get_config()
+STORAGE_FORMAT = config['storage']['format']
+COMPACT_ROWS = config['storage']['compact_rows']
+
+def is_parquet() -> bool:
+    return STORAGE_FORMAT == 'parquet'
+
+def dataset_dir(path: str) -> str:
+    '''Directory holding the Parquet partitions of the table at a CSV path.'''
+    return os.path.splitext(path)[0] + '/'
+
+def list_partitions(path: str) -> List[str]:
+    '''Parquet partition files of a table, oldest first.'''
+    return sorted(glob.glob(dataset_dir(path) + 'part-*.parquet'))
+
+def table_exists(path: str) -> bool:
+    if is_parquet():
+        return len(list_partitions(path)) > 0
+    return os.path.exists(path)
+
+def apply_filters(df: pd.DataFrame, filters: List[Tuple[str, str, Any]]) -> pd.DataFrame:
+    '''Apply a conjunction of (column, op, value) filters to a DataFrame, for the
+    CSV backend.'''
+
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        if op in ['=', '==']:
+            mask &= (df[column] == value).to_numpy()
+        elif op == '!=':
+            mask &= (df[column] != value).to_numpy()
+        elif op == '<':
+            mask &= (df[column] < value).to_numpy()
+        elif op == '<=':
+            mask &= (df[column] <= value).to_numpy()
+        elif op == '>':
+            mask &= (df[column] > value).to_numpy()
+        elif op == '>=':
+            mask &= (df[column] >= value).to_numpy()
+        elif op == 'in':
+            mask &= df[column].isin(value).to_numpy()
+        elif op == 'not in':
+            mask &= ~df[column].isin(value).to_numpy()
+        else:
+            raise ValueError(f"Unsupported filter operation: {op}")
+    return df[mask].reset_index(drop=True)
+
+def read_parquet_dataset(path: str, columns: List[str]=None, filters: List[Tuple[str, str, Any]]=None) -> pd.DataFrame:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    partitions = list_partitions(path)
+    if len(partitions) == 0:
+        raise FileNotFoundError(f"No partitions found for table: {dataset_dir(path)}")
+
+    '''Batches where a column was all-null, or all-integer, are reconciled here'''
+    schema = pa.unify_schemas([pq.read_schema(partition) for partition in partitions], promote_options='permissive')
+    dataset = ds.dataset(partitions, schema=schema, format='parquet')
+    expression = pq.filters_to_expression(filters) if filters else None
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+def read_table(path: str, columns: List[str]=None, filters: List[Tuple[str, str, Any]]=None, **kwargs) -> pd.DataFrame:
+    '''Read a table, loading only the given columns and the rows that pass the
+    filters. Extra keyword arguments are passed to pd.read_csv for the CSV backend.
+    Raises FileNotFoundError if the table does not exist, as pd.read_csv does.'''
+
+    if is_parquet():
+        return read_parquet_dataset(path, columns, filters)
+
+    if filters:
+        usecols = None if columns is None else list(dict.fromkeys(columns + [filter[0] for filter in filters]))
+        df = apply_filters(pd.read_csv(path, usecols=usecols, **kwargs), filters)
+        return df if columns is None else df[columns]
+    return pd.read_csv(path, usecols=columns, **kwargs)
+
+def plain_table(table):
+    '''Decode dictionary (categorical) columns, so that every partition has the same
+    schema whether or not it was written from categoricals. Parquet dictionary-encodes
+    string columns on disk anyway.'''
+    import pyarrow as pa
+
+    schema = pa.schema([
+        field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field
+        for field in table.schema
+    ])
+    return table if schema.equals(table.schema) else table.cast(schema)
+
+def append_table(df: pd.DataFrame, path: str, partition: str=None) -> None:
+    '''Append rows to a table, creating it if it does not exist. For the Parquet
+    backend, each call writes a new partition, labelled with the date-like
+    `partition` (default: the current date) so that partitions sort by time of writing.'''
+
+    if len(df) == 0:
+        return
+
+    if is_parquet():
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if partition is None:
+            partition = datetime.now().strftime("%Y-%m-%d")
+        os.makedirs(dataset_dir(path), exist_ok=True)
+        filename = dataset_dir(path) + "part-{:s}-{:s}-{:s}.parquet".format(
+            partition, datetime.now().strftime("%H%M%S%f"), uuid.uuid4().hex[:8])
+        pq.write_table(plain_table(pa.Table.from_pandas(df, preserve_index=False)), filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+        return
+
+    if not os.path.exists(path):
+        df.to_csv(path, index=False)
+    else:
+        df.to_csv(path, mode='a', header=False, index=False)
+
+def write_table(df: pd.DataFrame, path: str) -> None:
+    '''Replace the whole contents of a table.'''
+
+    if is_parquet():
+        old_partitions = list_partitions(path)
+        append_table(df, path, partition='0000-00-00')
+        for partition in old_partitions:
+            os.remove(partition)
+        return
+
+    df.to_csv(path, index=False)
+
+def compact_table(path: str, rows_per_partition: int=COMPACT_ROWS) -> None:
+    '''Merge the many small partitions left by batch appends into partitions of
+    about rows_per_partition rows each, preserving row order. The new partitions
+    are written before the old ones are removed.'''
+
+    if not is_parquet():
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    old_partitions = list_partitions(path)
+    if len(old_partitions) <= 1:
+        return
+    schema = pa.unify_schemas([pq.read_schema(partition) for partition in old_partitions], promote_options='permissive')
+    table = pa.concat_tables([pq.read_table(partition).cast(schema) for partition in old_partitions])
+    if table.num_rows == 0: # nothing to merge, and the partitions hold the schema
+        return
+
+    stamp = os.path.basename(old_partitions[-1])[len('part-'):len('part-') + len('YYYY-MM-DD')]
+    for i, offset in enumerate(range(0, table.num_rows, rows_per_partition)):
+        filename = dataset_dir(path) + "part-{:s}-{:s}-{:06d}-{:s}.parquet".format(
+            stamp, '0'*12, i, uuid.uuid4().hex[:8])
+        pq.write_table(table.slice(offset, rows_per_partition), filename + '.tmp')
+        os.replace(filename + '.tmp', filename)
+    for partition in old_partitions:
+        os.remove(partition)
+    logger.info(f"Compacted {len(old_partitions)} partitions of {dataset_dir(path)} into {i + 1}.")
+
+def migrate_csv_to_parquet(path: str, chunksize: int=COMPACT_ROWS) -> None:
+    '''Convert an existing CSV table into Parquet partitions, one per chunk, without
+    loading the whole CSV into memory. The CSV itself is left in place.'''
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if len(list_partitions(path)) > 0:
+        logger.error(f"Parquet table already exists: {dataset_dir(path)}")
+        return
+    os.makedirs(dataset_dir(path), exist_ok=True)
+    for i, chunk in enumerate(pd.read_csv(path, chunksize=chunksize)):
+        filename = dataset_dir(path) + "part-0000-00-00-{:s}-{:06d}.parquet".format('0'*12, i)
+        pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), filename)
+    logger.info(f"Migrated {path} to {dataset_dir(path)}.")